@@ -1,4 +1,28 @@
 from .metadata import __version__
 
-from .messagelane import MessageLane
-from .datamessage import DataMessage
+# The client classes are imported on first use to keep startup fast
+
+EXPORTS = {
+    "MessageLane": "messagelane",
+    "AsyncMessageLane": "asyncmessagelane",
+    "DataMessage": "datamessage",
+}
+
+
+def __getattr__(name):
+    """Import the client classes on first access."""
+    if name not in EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    import importlib
+
+    module = importlib.import_module(f".{EXPORTS[name]}", __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    """List the module attributes, including the lazy exports."""
+    return [*globals(), *EXPORTS]
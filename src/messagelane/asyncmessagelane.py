@@ -0,0 +1,205 @@
+"""An asyncio MessageLane client class.
+
+AsyncMessageLane offers the MessageLane API on a SQLAlchemy AsyncSession
+(asyncpg or psycopg async). Each call runs the MessageLane method itself
+on the session with AsyncSession.run_sync(), so the statements are the
+same as the synchronous class and cannot drift from it.
+
+Results are fully loaded before they are returned, including the
+payloads of the returned messages, since attributes cannot be lazy
+loaded outside of the call. Messages listed with payload False have no
+payload to read.
+
+Example:
+-------
+>>> from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+>>> engine = create_async_engine("postgresql+asyncpg:///messagelane")
+>>> async with async_sessionmaker(engine).begin() as session:
+...     msglane = AsyncMessageLane(session)
+...     await msglane.post_message("telemetry", "hello")
+
+"""
+
+##########################################################################
+#
+#   AsyncMessageLane Interface
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import functools
+import itertools
+
+import sqlalchemy as sa
+
+from sqlalchemy import inspect
+
+from .messagelane import MessageLane
+from .models import Message
+
+# MessageLane methods available as coroutines. Listening, file and stream
+# posts depend on blocking driver calls and are left out.
+
+METHODS = [
+    "has_lane",
+    "get_lane_id",
+    "get_lane",
+    "overview",
+    "overview_exact",
+    "status",
+    "rebuild_lane_stats",
+    "list_lanes",
+    "create_lane",
+    "del_lane",
+    "list_messages_after_ts",
+    "del_messages",
+    "is_partitioned",
+    "get_message",
+    "get_message_bytes",
+    "first_message",
+    "next_message",
+    "get_messages",
+    "post_message",
+    "post_message_bytes",
+    "post_message_from_email",
+    "post_messages",
+    "post_message_to_lanes",
+    "reserve_positions",
+    "release_positions",
+    "committed_position",
+    "list_consumers",
+    "get_consumer",
+    "subscribe",
+    "unsubscribe",
+    "fetch",
+    "fetch_after",
+    "ack",
+    "list_queues",
+    "create_queue",
+    "del_queue",
+    "claim",
+    "complete",
+    "release",
+    "del_message",
+    "del_message_range",
+    "get_message_from_uuid",
+    "has_message_uuid",
+    "has_messages",
+    "get_message_from_hash",
+    "has_message_hash",
+    "find_hashes",
+    "add_manifest",
+    "get_manifest",
+    "find_messages",
+]
+
+
+def load(result):
+    """Return result with any pending rows and payloads loaded."""
+    if isinstance(result, (sa.Result, sa.ScalarResult)):
+        result = result.all()
+
+    items = result if isinstance(result, list) else [result]
+
+    for item in items:
+        if isinstance(item, Message) and "payload_text" not in inspect(item).unloaded:
+            item.payload_source  # noqa: B018 - load a shared payload
+
+    return result
+
+
+def run_sync(name):
+    """Return a coroutine method running a MessageLane method."""
+    method = getattr(MessageLane, name)
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kw):
+        def call(session):
+            # Looked up per call to pick up instrumented methods
+            return load(getattr(self.msglane, name)(*args, **kw))
+
+        return await self.session.run_sync(call)
+
+    return wrapper
+
+
+class AsyncMessageLane:
+    """The MessageLane API for asyncio."""
+
+    def __init__(self, session, **kw):
+        """Initialize AsyncMessageLane instance.
+
+        The keyword arguments (codec, level, dedup) are passed on to
+        MessageLane.
+        """
+        self.session = session
+        self.msglane = MessageLane(session.sync_session, **kw)
+
+    async def iterate(self, batch_size, method, *args):
+        """Yield the results of a MessageLane iterator method in batches."""
+        iterator = None
+
+        def fetch(session):
+            nonlocal iterator
+
+            if iterator is None:
+                iterator = iter(method(*args))
+
+            return [load(item) for item in itertools.islice(iterator, batch_size)]
+
+        while True:
+            batch = await self.session.run_sync(fetch)
+
+            if not batch:
+                return
+
+            for item in batch:
+                yield item
+
+    def list_messages(self, name, payload=False, batch_size=1000):
+        """List messages in a lane."""
+        return self.iterate(
+            batch_size, self.msglane.list_messages, name, payload, batch_size
+        )
+
+    def iter_messages(self, name, after_position=0, batch_size=1000, payload=True):
+        """Iterate over the messages in a lane after a position."""
+        return self.iterate(
+            batch_size,
+            self.msglane.iter_messages,
+            name,
+            after_position,
+            batch_size,
+            payload,
+        )
+
+    def iter_message_bytes(self, name, position, chunk_size=1024 * 1024):
+        """Yield the payload of a message from a lane in chunks of bytes."""
+        return self.iterate(
+            1, self.msglane.iter_message_bytes, name, position, chunk_size
+        )
+
+    def recompress_messages(
+        self, name, batch_size=1000, after_position=0, max_bytes=64 * 1024 * 1024
+    ):
+        """Recompress the payloads of a lane with the current codec."""
+        return self.iterate(
+            1,
+            self.msglane.recompress_messages,
+            name,
+            batch_size,
+            after_position,
+            max_bytes,
+        )
+
+    def index_messages(self, name, after_position=0, batch_size=100):
+        """Record the manifests of the messages already in a lane."""
+        return self.iterate(
+            batch_size, self.msglane.index_messages, name, after_position
+        )
+
+
+for name in METHODS:
+    setattr(AsyncMessageLane, name, run_sync(name))
@@ -0,0 +1 @@
+"""MessageLane benchmarks."""
@@ -0,0 +1,143 @@
+"""Producer contention benchmark.
+
+Measure the posting throughput of a single lane as the number of
+concurrent producer processes grows, comparing the default lane row
+lock with block reservations.
+
+Example:
+-------
+>>> from messagelane.bench import contention
+>>> contention.run("postgresql:///messagelane", [1, 2, 4, 8])
+
+"""
+
+##########################################################################
+#
+#   Producer contention benchmark
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import multiprocessing
+import os
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+
+from ..messagelane import MessageLane
+from ..models import Lane, Message
+
+MODES = ["lock", "reserve"]
+
+
+def producer(url, name, mode, messages, batch, payload, barrier):
+    """Post messages to a lane from one producer process."""
+    engine = sa.create_engine(url)
+    Session = sessionmaker(engine)
+
+    barrier.wait()
+
+    for offset in range(0, messages, batch):
+        payloads = [payload] * min(batch, messages - offset)
+
+        if mode == "reserve":
+            with Session() as session:
+                msglane = MessageLane(session)
+                reservation = msglane.reserve_positions(name, len(payloads))
+                with session.begin():
+                    msglane.post_messages(name, payloads, reservation=reservation)
+        else:
+            with Session.begin() as session:
+                MessageLane(session).post_messages(name, payloads)
+
+    engine.dispose()
+
+
+def check_lane(Session, name):
+    """Return the message count and whether the positions are dense."""
+    stmt = (
+        sa.select(
+            sa.func.count(),
+            sa.func.min(Message.lane_position),
+            sa.func.max(Message.lane_position),
+        )
+        .join(Message.lane)
+        .where(Lane.name == name)
+    )
+
+    with Session() as session:
+        count, first, last = session.execute(stmt).one()
+
+    dense = count == 0 or last - first + 1 == count
+
+    return count, dense
+
+
+def clear_lane(Session, name):
+    """Remove a benchmark lane and its messages."""
+    lane_id = sa.select(Lane.lane_id).where(Lane.name == name).scalar_subquery()
+
+    with Session.begin() as session:
+        session.execute(sa.delete(Message).where(Message.lane_id == lane_id))
+        MessageLane(session).del_lane(name)
+
+
+def run_one(url, producers, mode="lock", messages=1000, batch=1, payload_size=256):
+    """Run one benchmark round and return its results."""
+    engine = sa.create_engine(url)
+    Session = sessionmaker(engine)
+
+    name = f"bench-contention-{os.getpid()}-{mode}-{producers}"
+    payload = "x" * payload_size
+
+    with Session.begin() as session:
+        MessageLane(session).create_lane(name)
+
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(producers + 1)
+
+    procs = [
+        ctx.Process(
+            target=producer,
+            args=(url, name, mode, messages, batch, payload, barrier),
+        )
+        for _ in range(producers)
+    ]
+
+    for proc in procs:
+        proc.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+
+    for proc in procs:
+        proc.join()
+
+    elapsed = time.perf_counter() - start
+
+    count, dense = check_lane(Session, name)
+    clear_lane(Session, name)
+    engine.dispose()
+
+    return {
+        "mode": mode,
+        "producers": producers,
+        "batch": batch,
+        "messages": count,
+        "seconds": elapsed,
+        "rate": count / elapsed if elapsed else 0,
+        "dense": dense,
+    }
+
+
+def run(url, producers, modes=None, **kw):
+    """Run the benchmark for each mode and producer count."""
+    if modes is None:
+        modes = MODES
+
+    for mode in modes:
+        for count in producers:
+            yield run_one(url, count, mode, **kw)
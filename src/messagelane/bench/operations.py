@@ -0,0 +1,325 @@
+"""Operation benchmark.
+
+Measure the throughput and latency of the MessageLane operations on
+lanes seeded with a given number of messages and payload size. Each
+call runs in its own transaction, as a client would make it. The
+results are plain dicts that can be saved as JSON and compared between
+versions.
+
+Seeded lanes are named bench-<messages>-<payload size> and are kept
+between runs, topped up to the requested size, since seeding the
+larger lanes takes a while.
+
+Example:
+-------
+>>> from messagelane.bench import operations
+>>> results = list(operations.run("postgresql:///messagelane", [1000, 100000]))
+>>> report = operations.report(results)
+
+"""
+
+##########################################################################
+#
+#   Operation benchmark
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import base64
+import datetime
+import os
+import platform
+import random
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+
+from ..messagelane import MessageLane
+from ..metadata import __version__
+from ..models import Lane, Message
+
+OPERATIONS = [
+    "get_message",
+    "next_message",
+    "overview",
+    "list_messages_after_ts",
+    "post_message",
+    "del_messages",
+]
+
+SEED_BATCH = 10000
+SEED_SPAN = datetime.timedelta(days=30)
+
+
+def lane_name(messages, payload_size):
+    """Return the name of the benchmark lane."""
+    return f"bench-{messages}-{payload_size}"
+
+
+def make_payloads(payload_size, count, rng):
+    """Return count random text payloads of payload_size characters."""
+    # Random text keeps the compression ratio close to real data
+    raw_size = payload_size * 3 // 4 + 3
+
+    return [
+        base64.b64encode(rng.randbytes(raw_size)).decode()[:payload_size]
+        for _ in range(count)
+    ]
+
+
+def lane_extent(Session, name):
+    """Return the message count and first and last positions of a lane."""
+    stmt = (
+        sa.select(
+            sa.func.count(),
+            sa.func.min(Message.lane_position),
+            sa.func.max(Message.lane_position),
+        )
+        .join(Message.lane)
+        .where(Lane.name == name)
+    )
+
+    with Session() as session:
+        return tuple(session.execute(stmt).one())
+
+
+def seed_lane(Session, name, messages, payload_size, rng, log=None):
+    """Create or top up a lane to hold at least messages messages.
+
+    The seeded timestamps are spread evenly over the SEED_SPAN before
+    now. Returns the number of messages added.
+    """
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        if not msglane.has_lane(name):
+            msglane.create_lane(name)
+
+    count, _, _ = lane_extent(Session, name)
+    missing = messages - count
+
+    if missing <= 0:
+        return 0
+
+    payloads = make_payloads(payload_size, 64, rng)
+    step = SEED_SPAN / missing
+    start = datetime.datetime.now(datetime.timezone.utc) - SEED_SPAN
+
+    for offset in range(0, missing, SEED_BATCH):
+        batch = range(offset, min(offset + SEED_BATCH, missing))
+
+        with Session.begin() as session:
+            MessageLane(session).post_messages(
+                name,
+                [payloads[index % len(payloads)] for index in batch],
+                timestamps=[start + step * index for index in batch],
+            )
+
+        if log:
+            log(f"Seeded {name}: {batch.stop} of {missing} messages")
+
+    return missing
+
+
+def percentile(values, fraction):
+    """Return the nearest rank percentile of sorted values."""
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+
+    return values[index]
+
+
+def summarize(operation, messages, payload_size, times):
+    """Return the result dict for the latencies of an operation."""
+    times = sorted(times)
+    total = sum(times)
+
+    return {
+        "operation": operation,
+        "messages": messages,
+        "payload_size": payload_size,
+        "ops": len(times),
+        "seconds": total,
+        "rate": len(times) / total if total else 0,
+        "mean_ms": total / len(times) * 1000,
+        "p50_ms": percentile(times, 0.50) * 1000,
+        "p99_ms": percentile(times, 0.99) * 1000,
+    }
+
+
+def measure(Session, call, args, warmup=10):
+    """Return the latency of call(msglane, *arg) for each args entry.
+
+    Each call runs in its own transaction and any result rows are
+    fetched. The first warmup calls are not included.
+    """
+    times = []
+
+    for index, arg in enumerate(args):
+        start = time.perf_counter()
+
+        with Session.begin() as session:
+            result = call(MessageLane(session), *arg)
+            if isinstance(result, sa.Result):
+                result.all()
+
+        if index >= warmup:
+            times.append(time.perf_counter() - start)
+
+    return times
+
+
+def operation_args(Session, name, operation, ops, payload_size, rng, window, delete):
+    """Return the argument tuples for ops calls of an operation."""
+    _, first, last = lane_extent(Session, name)
+
+    if operation in ("get_message", "next_message"):
+        return [(name, rng.randint(first, last)) for _ in range(ops)]
+
+    if operation == "overview":
+        return [()] * ops
+
+    if operation == "list_messages_after_ts":
+        # The timestamp of the window newest messages
+        newest = (
+            sa.select(Message.ts)
+            .join(Message.lane)
+            .where(Lane.name == name)
+            .order_by(Message.ts.desc())
+            .limit(window)
+            .subquery()
+        )
+        with Session() as session:
+            ts = session.scalar(sa.select(sa.func.min(newest.c.ts)))
+        return [(name, ts)] * ops
+
+    if operation == "post_message":
+        payloads = make_payloads(payload_size, 64, rng)
+        return [(name, payloads[index % len(payloads)]) for index in range(ops)]
+
+    if operation == "del_messages":
+        # Cutoffs that each remove the next delete oldest messages
+        stmt = (
+            sa.select(Message.ts)
+            .join(Message.lane)
+            .where(Lane.name == name)
+            .order_by(Message.ts)
+            .limit(ops * delete)
+        )
+        with Session() as session:
+            stamps = session.scalars(stmt).all()
+        return [(name, ts) for ts in stamps[delete - 1 :: delete]]
+
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def run_lane(
+    Session,
+    messages,
+    payload_size,
+    operations=None,
+    ops=1000,
+    warmup=10,
+    window=100,
+    delete=1,
+    seed=0,
+    log=None,
+):
+    """Seed one lane and benchmark each operation on it.
+
+    Each list_messages_after_ts call returns the window newest messages
+    and each del_messages call removes the delete oldest, so that with
+    the default of one the deletes balance the posts and the lane keeps
+    its size between runs.
+    """
+    if operations is None:
+        operations = OPERATIONS
+
+    rng = random.Random(seed)
+    name = lane_name(messages, payload_size)
+
+    seed_lane(Session, name, messages, payload_size, rng, log)
+
+    # Reads first, since posts and deletes change the lane
+
+    for operation in sorted(operations, key=OPERATIONS.index):
+        args = operation_args(
+            Session, name, operation, ops + warmup, payload_size, rng, window, delete
+        )
+        call = getattr(MessageLane, operation)
+        times = measure(Session, call, args, warmup)
+
+        if times:
+            yield summarize(operation, messages, payload_size, times)
+
+
+def run(url, sizes, payload_sizes=(256,), **kw):
+    """Run the benchmark for each lane size and payload size."""
+    engine = sa.create_engine(url)
+    Session = sessionmaker(engine)
+
+    try:
+        for payload_size in payload_sizes:
+            for messages in sizes:
+                yield from run_lane(Session, messages, payload_size, **kw)
+    finally:
+        engine.dispose()
+
+
+def report(results, url=None, **settings):
+    """Return a JSON serializable report of the results."""
+    server = None
+
+    if url:
+        engine = sa.create_engine(url)
+        with engine.connect() as conn:
+            server = conn.scalar(sa.text("SHOW server_version"))
+        engine.dispose()
+
+    return {
+        "version": __version__,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "sqlalchemy": sa.__version__,
+        "postgresql": server,
+        "settings": settings,
+        "results": list(results),
+    }
+
+
+def result_key(result):
+    """Return the key matching a result between reports."""
+    return result["operation"], result["messages"], result["payload_size"]
+
+
+def compare(old, new, threshold=10):
+    """Compare the results of two reports.
+
+    Yields a dict for each result in both reports with the old and new
+    p50 and p99 latencies, the percent change of p50 and whether the
+    change is a regression of more than threshold percent.
+    """
+    previous = {result_key(result): result for result in old["results"]}
+
+    for result in new["results"]:
+        before = previous.get(result_key(result))
+
+        if before is None:
+            continue
+
+        change = (result["p50_ms"] / before["p50_ms"] - 1) * 100
+
+        yield {
+            "operation": result["operation"],
+            "messages": result["messages"],
+            "payload_size": result["payload_size"],
+            "old_p50_ms": before["p50_ms"],
+            "new_p50_ms": result["p50_ms"],
+            "old_p99_ms": before["p99_ms"],
+            "new_p99_ms": result["p99_ms"],
+            "change": change,
+            "regression": change > threshold,
+        }
@@ -0,0 +1,73 @@
+"""Startup time benchmark.
+
+Measure the time to import a module in a fresh interpreter and check
+that the modules deferred for a fast command line startup stay unloaded.
+Each run is a new process, so nothing is cached between samples other
+than the compiled bytecode.
+
+Example:
+-------
+>>> from messagelane.bench import startup
+>>> startup.run("messagelane.commands.msglane", repeat=5)
+
+"""
+
+##########################################################################
+#
+#   Startup time benchmark
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import json
+import subprocess
+import sys
+
+# Modules that must not be loaded by importing the command line program
+
+DEFERRED = ["sqlalchemy", "psycopg2", "dotenv", "texttable", "prefixed", "email"]
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(sys.modules)]))
+"""
+
+
+def measure(module):
+    """Return the seconds to import module and the modules it loaded."""
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(module=module)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    elapsed, modules = json.loads(output)
+
+    return elapsed, modules
+
+
+def run(module, repeat=5, deferred=None):
+    """Return the import times and the deferred modules that were loaded."""
+    if deferred is None:
+        deferred = DEFERRED
+
+    times = []
+    loaded = set()
+
+    for _ in range(repeat):
+        elapsed, modules = measure(module)
+        times.append(elapsed)
+        loaded.update(m.split(".")[0] for m in modules)
+
+    return {
+        "module": module,
+        "best": min(times),
+        "median": sorted(times)[len(times) // 2],
+        "loaded": [name for name in deferred if name in loaded],
+    }
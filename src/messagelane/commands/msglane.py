@@ -17,18 +17,17 @@
 ##########################################################################
 
 from datetime import datetime, timezone
+from pathlib import Path
+import csv
 import functools
+import json
 import sys
 import uuid
 
 import click
-import prefixed
-import texttable as tt
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-import messagelane
+# SQLAlchemy, messagelane, texttable and prefixed are imported where they
+# are used, so that startup only pays for what a command needs.
 
 # Utility functions ------------------------------------------------------
 
@@ -47,9 +46,19 @@ def format_bytes(num):
     if num is None:
         return ""
 
+    import prefixed
+
     return f"{prefixed.Float(num):!.2h}B"
     
 
+def format_count(num):
+    """Format count"""
+
+    if num is None:
+        return ""
+
+    return str(num)
+
 def as_datetime(ts):
     """Datetime from ISO string"""
 
@@ -60,16 +69,72 @@ def as_datetime(ts):
 
     return dt
 
+def expand_filenames(paths):
+    """Expand directories into the sorted list of files they contain"""
+
+    filenames = []
+
+    for path in map(Path, paths):
+        if path.is_dir():
+            filenames.extend(sorted(p for p in path.iterdir() if p.is_file()))
+        else:
+            filenames.append(path)
+
+    return filenames
+
+def format_ratio(size, stored):
+    """Format compression ratio"""
+
+    if not size or not stored:
+        return ""
+
+    return f"{size / stored:.2f}"
+
+def echo_payload(result):
+    """Write a message payload, raw bytes for binary messages"""
+
+    if result.payload_binary:
+        stdout = click.get_binary_stream("stdout")
+        stdout.write(result.payload_bytes)
+        stdout.flush()
+    else:
+        click.echo(result.payload)
+
+def new_table():
+    """Return a new texttable"""
+
+    import texttable
+
+    return texttable.Texttable()
+
 def values(result, keys):
     """Return values for keys in result"""
 
     return [getattr(result, key) for key in keys]
 
 class ContextObject:
+    """Session and MessageLane for the commands, created on first use"""
 
-    def __init__(self, session):
-        self.session = session
-        self.msglane = messagelane.MessageLane(session)
+    def __init__(self, ctx, database, debug):
+        self.ctx = ctx
+        self.database = database
+        self.debug = debug
+
+    @functools.cached_property
+    def session(self):
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from messagelane import db
+
+        engine = create_engine(self.database, echo=self.debug, **db.pool_options())
+
+        return self.ctx.with_resource(sessionmaker(engine).begin())
+
+    @functools.cached_property
+    def msglane(self):
+        from messagelane import MessageLane
+
+        return MessageLane(self.session)
 
 def pass_msglane(func):
     @click.pass_obj
@@ -88,19 +153,26 @@ def pass_msglane(func):
 def cli(ctx, database, debug):
     """Base command group"""
 
-    engine = create_engine(database, echo=debug)
-    session = ctx.with_resource(sessionmaker(engine).begin())
-    ctx.obj = ContextObject(session) 
+    ctx.obj = ContextObject(ctx, database, debug)
 
 @cli.command()
 @click.option("--as_bytes/--no-as_bytes", default=False, help="Display size as bytes")
+@click.option(
+    "--exact/--no-exact",
+    default=False,
+    help="Count messages instead of using lane stats",
+)
 @pass_msglane
-def overview(msglane, as_bytes):
+def overview(msglane, as_bytes, exact):
     """MessageLane overview"""
 
-    results = msglane.overview()
+    if not exact and not msglane.has_lane_stats():
+        click.echo("No lane statistics (run msglane db upgrade), counting", err=True)
+        exact = True
+
+    results = msglane.overview(exact=exact)
 
-    tb = tt.Texttable()
+    tb = new_table()
 
     tb.set_deco(tb.HEADER)
 
@@ -109,24 +181,45 @@ def overview(msglane, as_bytes):
     else:
         format_size = format_bytes
 
-    tb.header(["Stream", "Min", "Max", "Count", "Start (UTC)", "Stop (UTC)", "Total Size"])
-    tb.set_cols_dtype(["t", "i", "i", "i", format_ts, format_ts, format_size])
-    tb.set_cols_align(["l", "r", "r", "r", "c", "c", "r"])
-    tb.set_header_align(["c", "r", "r", "r", "c", "c", "c"])
+    tb.header(
+        [
+            "Lane",
+            "Min",
+            "Max",
+            "Count",
+            "Start (UTC)",
+            "Stop (UTC)",
+            "Total Size",
+            "Stored",
+            "Ratio",
+        ]
+    )
+    tb.set_cols_dtype(
+        ["t", "i", "i", "i", format_ts, format_ts, format_size, format_size, "t"]
+    )
+    tb.set_cols_align(["l", "r", "r", "r", "c", "c", "r", "r", "r"])
+    tb.set_header_align(["c", "r", "r", "r", "c", "c", "c", "c", "c"])
     tb.set_max_width(0)
 
     for result in results:
-        tb.add_row(result.values())
+        ratio = format_ratio(result["size"], result["stored_size"])
+        tb.add_row([*result.values(), ratio])
 
     click.echo(tb.draw())
 
 @cli.command()
 @click.option("--as_bytes/--no-as_bytes", default=False, help="Display size as bytes")
+@click.option(
+    "--exact/--no-exact", default=False, help="Count rows instead of using estimates"
+)
 @pass_msglane
-def status(msglane, as_bytes):
+def status(msglane, as_bytes, exact):
     """MessageLane status"""
 
-    results = msglane.status()
+    if not msglane.has_lane_stats():
+        raise click.ClickException("No lane statistics, run msglane db upgrade")
+
+    results = msglane.status(exact=exact)
 
     if as_bytes:
         format_size = "i"
@@ -135,9 +228,9 @@ def status(msglane, as_bytes):
 
     # Database table
 
-    dbtb = tt.Texttable()
+    dbtb = new_table()
 
-    dbtb.set_deco(tt.Texttable.HEADER)
+    dbtb.set_deco(dbtb.HEADER)
 
     dbtb.header(["Database", "Size"])
     dbtb.set_cols_dtype(["t", format_size])
@@ -147,14 +240,29 @@ def status(msglane, as_bytes):
 
     dbtb.add_row([results["database"]["name"], results["database"]["size"]])
 
+    # Payload table
+
+    pltb = new_table()
+
+    pltb.set_deco(pltb.HEADER)
+
+    pltb.header(["Payload Size", "Stored", "Ratio"])
+    pltb.set_cols_dtype([format_size, format_size, "t"])
+    pltb.set_cols_align(["r", "r", "r"])
+    pltb.set_header_align(["c", "c", "c"])
+
+    payload = results["payload"]
+    ratio = format_ratio(payload["size"], payload["stored"])
+    pltb.add_row([payload["size"], payload["stored"], ratio])
+
     # Tables table
 
-    tb = tt.Texttable()
+    tb = new_table()
 
-    tb.set_deco(tt.Texttable.HEADER)
+    tb.set_deco(tb.HEADER)
 
-    tb.header(["Table", "Rows", "Size"])
-    tb.set_cols_dtype(["t", "i", format_size])
+    tb.header(["Table", "Rows" if exact else "Rows (est)", "Size"])
+    tb.set_cols_dtype(["t", format_count, format_size])
     tb.set_cols_align(["l", "r", "r"])
     tb.set_header_align(["c", "c", "c"])
     tb.set_max_width(0)
@@ -164,9 +272,9 @@ def status(msglane, as_bytes):
 
     # Index table
 
-    ixtb = tt.Texttable()
+    ixtb = new_table()
 
-    ixtb.set_deco(tt.Texttable.HEADER)
+    ixtb.set_deco(ixtb.HEADER)
 
     ixtb.header(["Table", "Index", "Size"])
     ixtb.set_cols_dtype(["t", "t", format_size])
@@ -183,6 +291,8 @@ def status(msglane, as_bytes):
     click.echo()
     click.echo(dbtb.draw())
     click.echo()
+    click.echo(pltb.draw())
+    click.echo()
     click.echo(tb.draw())
     click.echo()
     click.echo(ixtb.draw())
@@ -190,27 +300,149 @@ def status(msglane, as_bytes):
 
 
 
-# Stream commands --------------------------------------------------------
+# Stats commands ---------------------------------------------------------
+
+
+@cli.group()
+def stats():
+    """Lane statistics command group"""
+
+
+@stats.command("rebuild")
+@pass_msglane
+def rebuild_stats(msglane):
+    """Recompute lane statistics from the messages"""
+
+    result = msglane.rebuild_lane_stats()
+
+    click.echo(f"Rebuilt statistics for {result} lanes")
+
+
+# Database commands ------------------------------------------------------
+
+
+@cli.group()
+def db():
+    """Database command group"""
+
+
+@db.command("create")
+@click.option(
+    "--partition",
+    type=click.Choice(["daily", "weekly"]),
+    help="Partition the message table by timestamp",
+)
+@click.pass_obj
+def create_db(opt, partition):
+    """Create the database tables"""
+
+    from messagelane import models
+
+    models.create_all(opt.session.get_bind(), partition)
+
+    click.echo("Created tables")
+
+
+@db.command("upgrade")
+@click.pass_obj
+def upgrade_db(opt):
+    """Add missing columns and functions to an older database"""
+
+    from messagelane import models
+
+    models.upgrade(opt.session.get_bind())
+
+    result = opt.msglane.rebuild_lane_stats()
+
+    click.echo(f"Upgraded tables, rebuilt statistics for {result} lanes")
+
+
+# Partition commands -----------------------------------------------------
+
+
+@cli.group()
+def partition():
+    """Message partition command group"""
+
+
+@partition.command("list")
+@click.option("--as_bytes/--no-as_bytes", default=False, help="Display size as bytes")
+@click.pass_obj
+def list_partitions(opt, as_bytes):
+    """List the message table partitions"""
+
+    from messagelane import partitions
+
+    tb = new_table()
+
+    tb.set_deco(tb.HEADER)
+
+    tb.header(["Partition", "Start", "End", "Rows (est)", "Size"])
+    tb.set_cols_dtype(["t", "t", "t", "t", "t"])
+    tb.set_cols_align(["l", "l", "l", "r", "r"])
+    tb.set_header_align(["c", "c", "c", "c", "c"])
+    tb.set_max_width(0)
+
+    for entry in partitions.list_partitions(opt.session.connection()):
+        size = entry["size"] if as_bytes else format_bytes(entry["size"])
+        tb.add_row(
+            [
+                entry["name"],
+                format_ts(entry["start"]) if entry["start"] else "-",
+                format_ts(entry["end"]) if entry["end"] else "-",
+                format_count(entry["rows"]),
+                size,
+            ]
+        )
+
+    click.echo(tb.draw())
+
+
+@partition.command("create")
+@click.option(
+    "--interval",
+    type=click.Choice(["daily", "weekly"]),
+    help="Partition interval (default: same as the latest partition)",
+)
+@click.option("--ahead", default=7, help="Number of future partitions to keep")
+@click.pass_obj
+def create_partitions(opt, interval, ahead):
+    """Create future message table partitions"""
+
+    from messagelane import partitions
+
+    conn = opt.session.connection()
+
+    if not partitions.is_partitioned(conn):
+        raise click.ClickException("The message table is not partitioned")
+
+    created = partitions.create_partitions(conn, interval, ahead)
+
+    for name in created:
+        click.echo(f"Created {name}")
+
+
+# Lane commands ----------------------------------------------------------
 
 
 @cli.group()
-def stream():
-    """Stream command group"""
+def lane():
+    """Lane command group"""
 
 
 
-@stream.command("list")
+@lane.command("list")
 @pass_msglane
-def list_streams(msglane):
-    """List stream names"""
+def list_lanes(msglane):
+    """List lane names"""
 
-    results = msglane.list_streams()
+    results = msglane.list_lanes()
 
-    tb = tt.Texttable()
+    tb = new_table()
 
     tb.set_deco(tb.HEADER)
 
-    tb.header(["Stream"])
+    tb.header(["Lane"])
     tb.set_cols_dtype(["t"])
     tb.set_cols_align(["l"])
     tb.set_header_align(["c"])
@@ -222,34 +454,116 @@ def list_streams(msglane):
     click.echo(tb.draw())
 
 
-@stream.command("create")
+@lane.command("create")
 @click.argument("name")
 @pass_msglane
-def create_stream(msglane, name):
-    """Create a new stream"""
+def create_lane(msglane, name):
+    """Create a new lane"""
 
-    if msglane.has_stream(name):
-        click.echo("The stream already exists")
+    if msglane.has_lane(name):
+        click.echo("The lane already exists")
         return
 
-    msglane.create_stream(name)
+    msglane.create_lane(name)
 
-    click.echo(f"Created stream {name}")
+    click.echo(f"Created lane {name}")
 
 
-@stream.command("del")
+@lane.command("del")
 @click.argument("name")
 @pass_msglane
-def del_stream(msglane, name):
-    """Delete a stream"""
+def del_lane(msglane, name):
+    """Delete a lane"""
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
-    msglane.del_stream(name)
+    msglane.del_lane(name)
+
+    click.echo(f"Removed lane {name}")
+
+
+@lane.command("recompress")
+@click.argument("name")
+@click.option(
+    "--codec", help="Compression codec (default: MESSAGELANE_CODEC or none)"
+)
+@click.option("--level", type=int, help="Compression level")
+@click.option("--batch-size", default=1000, help="Messages per transaction")
+@click.pass_obj
+def recompress_lane(opt, name, codec, level, batch_size):
+    """Recompress the messages in a lane"""
+
+    from sqlalchemy.orm import Session
+    from messagelane import compression, MessageLane
+
+    if codec and codec not in compression.available():
+        raise click.BadParameter(f"{codec} is not one of {compression.available()}")
+
+    # Commit after each batch in a session of our own
+
+    with Session(opt.session.get_bind()) as session:
+        msglane = MessageLane(session, codec, level)
+
+        if not msglane.has_lane(name):
+            click.echo("The lane does not exist")
+            return
+
+        total = 0
 
-    click.echo(f"Removed stream {name}")
+        for position, count in msglane.recompress_messages(name, batch_size):
+            session.commit()
+            total += count
+            click.echo(f"Position {position}: {count} messages recompressed")
+
+    click.echo(f"Recompressed {total} messages with {msglane.codec}")
+
+
+@lane.command("export")
+@click.argument("name")
+@click.option("--since", type=as_datetime, help="Only messages at or after this time")
+@click.option(
+    "--after", "after_position", default=0, help="Only messages after this position"
+)
+@click.option("--codec", default="none", help="Archive compression codec")
+@click.option(
+    "--output",
+    default="-",
+    type=click.File("wb"),
+    help="Archive file (default: stdout)",
+)
+@pass_msglane
+def export_lane(msglane, name, since, after_position, codec, output):
+    """Write the messages of a lane to an archive"""
+
+    from messagelane import compression
+
+    if codec not in compression.available():
+        raise click.BadParameter(f"{codec} is not one of {compression.available()}")
+
+    if not msglane.has_lane(name):
+        raise click.ClickException("The lane does not exist")
+
+    count = msglane.export_messages(name, output, since, after_position, codec)
+    output.flush()
+
+    click.echo(f"Exported {count} messages from {name}", err=True)
+
+
+@lane.command("import")
+@click.argument("archive", type=click.File("rb"))
+@click.option("--lane", "name", help="Lane to load into (default: the exported lane)")
+@pass_msglane
+def import_lane(msglane, archive, name):
+    """Load the messages of an archive into a lane"""
+
+    try:
+        name, count, skipped = msglane.import_messages(archive, name)
+    except ValueError as err:
+        raise click.ClickException(str(err)) from None
+
+    click.echo(f"Imported {count} messages into {name}, skipped {skipped} existing")
 
 
 # Messages commands ------------------------------------------------------
@@ -263,67 +577,175 @@ def messages():
 @messages.command("list")
 @click.argument("name")
 @click.option("--as_bytes/--no-as_bytes", default=False, help="Display size as bytes")
+@click.option(
+    "--format", "output_format",
+    type=click.Choice(["table", "csv", "jsonl"]),
+    default="table",
+    help="Output format (csv and jsonl are written as rows arrive)"
+)
 @pass_msglane
-def list_messages(msglane, name, as_bytes):
-    """List messages in a stream"""
+def list_messages(msglane, name, as_bytes, output_format):
+    """List messages in a lane"""
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
     results = msglane.list_messages(name)
 
-    tb = tt.Texttable()
+    echo_messages(name, results, as_bytes, output_format)
+
+
+def echo_messages(name, results, as_bytes, output_format):
+    """Write a list of messages as a table, csv or jsonl"""
+
+    keys = ["lane", "position", "ts", "size", "message_uuid"]
+
+    rows = (
+        [
+            name,
+            result.lane_position,
+            result.ts,
+            result.payload_size,
+            result.message_uuid,
+        ]
+        for result in results
+    )
+
+    if output_format == "csv":
+        writer = csv.writer(click.get_text_stream("stdout"))
+        writer.writerow(keys)
+        for row in rows:
+            writer.writerow(row)
+        return
+
+    if output_format == "jsonl":
+        for row in rows:
+            row[2] = row[2].isoformat()
+            row[4] = str(row[4])
+            click.echo(json.dumps(dict(zip(keys, row))))
+        return
+
+    tb = new_table()
 
     tb.set_deco(tb.HEADER)
 
     format_size = "i" if as_bytes else format_bytes
 
-    tb.header(["Stream", "Position", "Timestamp (UTC)", "Size", "Message UUID"])
+    tb.header(["Lane", "Position", "Timestamp (UTC)", "Size", "Message UUID"])
     tb.set_cols_dtype(["t", "i", format_ts, format_size, "t"])
     tb.set_cols_align(["l", "r", "l", "r", "l"])
     tb.set_header_align(["c", "r", "c", "c", "c"])
     tb.set_max_width(0)
 
-    for result in results:
-        tb.add_row([
-            result.stream.name,
-            result.stream_position,
-            result.ts,
-            result.payload_size,
-            result.message_uuid
-            ])
+    for row in rows:
+        tb.add_row(row)
             
     click.echo(tb.draw())
 
 
+@messages.command("find")
+@click.argument("name")
+@click.option("--filename", help="Attachment filename pattern (* and ?)")
+@click.option("--content-type", help="Attachment content type pattern, such as image/*")
+@click.option(
+    "--header",
+    "headers",
+    multiple=True,
+    help="NAME=PATTERN header match, may be repeated",
+)
+@click.option("--since", type=as_datetime, help="Only messages at or after this time")
+@click.option("--until", type=as_datetime, help="Only messages at or before this time")
+@click.option("--as_bytes/--no-as_bytes", default=False, help="Display size as bytes")
+@click.option(
+    "--format", "output_format",
+    type=click.Choice(["table", "csv", "jsonl"]),
+    default="table",
+    help="Output format",
+)
+@pass_msglane
+def find_messages(
+    msglane,
+    name,
+    filename,
+    content_type,
+    headers,
+    since,
+    until,
+    as_bytes,
+    output_format,
+):
+    """Find messages by their attachments and headers"""
+
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
+        return
+
+    header = {}
+
+    for entry in headers:
+        key, sep, value = entry.partition("=")
+        if not sep:
+            raise click.BadParameter(
+                f"{entry} is not NAME=PATTERN", param_hint="--header"
+            )
+        header[key] = value
+
+    results = msglane.find_messages(name, filename, content_type, header, since, until)
+
+    echo_messages(name, results, as_bytes, output_format)
+
+
+@messages.command("index")
+@click.argument("name")
+@click.option(
+    "--after", "after_position", default=0, help="Only messages after this position"
+)
+@pass_msglane
+def index_messages(msglane, name, after_position):
+    """Record the attachment manifests of the messages in a lane"""
+
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
+        return
+
+    total = 0
+    emails = 0
+
+    for _, found in msglane.index_messages(name, after_position):
+        total += 1
+        emails += found
+
+    click.echo(f"Indexed {total} messages, {emails} with manifests")
+
+
 @messages.command("new")
 @click.argument("name")
 @click.argument("ts")
 @pass_msglane
 def new_messages(msglane, name, ts):
-    """List new messages in a stream"""
+    """List new messages in a lane"""
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
     dt = as_datetime(ts) 
 
-    results = msglane.list_messages_ts(name, dt)
+    results = msglane.list_messages_after_ts(name, dt)
 
-    tb = tt.Texttable()
+    tb = new_table()
 
     tb.set_deco(tb.HEADER)
 
-    tb.header(["Stream", "Position", "Timestamp (UTC)", "Message ID"])
+    tb.header(["Lane", "Position", "Timestamp (UTC)", "Message ID"])
     tb.set_cols_dtype(["t", "i", format_ts, "t"])
     tb.set_cols_align(["l", "r", "l", "l"])
     tb.set_header_align(["c", "r", "c", "c"])
     tb.set_max_width(0)
 
     for result in results:
-        tb.add_row(result.values())
+        tb.add_row(list(result))
 
     click.echo(tb.draw())
 
@@ -338,7 +760,7 @@ def del_messages(msglane, name, ts):
     dt = as_datetime(ts)
 
     result = msglane.del_messages(name, dt)
-    click.echo(result)
+    click.echo(f"Deleted {result} messages")
 
 # Single message commands ------------------------------------------------
 
@@ -353,16 +775,21 @@ def message():
 @click.argument("position", type=int)
 @pass_msglane
 def get_message(msglane, name, position):
-    """Return a message at a given position in a stream"""
+    """Return a message at a given position in a lane"""
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
-    result = msglane.get_message(name, position)
+    result = msglane.get_message(name, position, payload=False)
 
     if result:
-        click.echo(result.payload)
+        stdout = click.get_binary_stream("stdout")
+        for chunk in msglane.iter_message_bytes(name, position):
+            stdout.write(chunk)
+        if not result.payload_binary:
+            stdout.write(b"\n")
+        stdout.flush()
     else:
         click.echo("No message found")
 
@@ -375,7 +802,7 @@ def get_message_from_uuid(msglane, message_uuid):
     result = msglane.get_message_from_uuid(message_uuid)
 
     if result:
-        click.echo(result.payload)
+        echo_payload(result)
     else:
         click.echo("No message found")
 
@@ -385,16 +812,16 @@ def get_message_from_uuid(msglane, message_uuid):
 @click.argument("position", type=int)
 @pass_msglane
 def next_message(msglane, name, position):
-    """Return the next message from a stream"""
+    """Return the next message from a lane"""
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
     result = msglane.next_message(name, position)
 
     if result:
-        click.echo(result.stream_position)
+        click.echo(result.lane_position)
     else:
         click.echo("At end, no more messages")
 
@@ -402,45 +829,153 @@ def next_message(msglane, name, position):
 @click.argument("name")
 @pass_msglane
 def first_message(msglane, name):
-    """Return the first message from a stream"""
+    """Return the first message from a lane"""
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
     result = msglane.first_message(name)
 
     if result:
-        click.echo(result.stream_position)
+        click.echo(result.lane_position)
     else:
         click.echo("No messages found")
 
+@message.command("follow")
+@click.argument("name")
+@click.option("--position", type=int, help="Start after this position (default: now)")
+@click.option("--payload/--no-payload", default=True, help="Show payloads or positions")
+@click.pass_obj
+def follow_messages(opt, name, position, payload):
+    """Stream new messages from a lane as they are posted"""
+
+    from sqlalchemy.orm import Session
+    from messagelane import MessageLane
+
+    # Commit after each batch in a session of our own, so no transaction
+    # is held open while waiting for messages
+
+    with Session(opt.session.get_bind()) as session:
+        msglane = MessageLane(session)
+
+        if not msglane.has_lane(name):
+            click.echo("The lane does not exist")
+            return
+
+        if position is None:
+            position = msglane.committed_position(name)
+
+        with msglane.listen([name]) as listener:
+            session.commit()
+
+            while True:
+                last = listener.wait_for_messages({name: position})[name]
+
+                for result in msglane.get_messages(name, position + 1, last):
+                    if payload:
+                        echo_payload(result)
+                    else:
+                        click.echo(result.lane_position)
+
+                session.commit()
+                position = last
+
 @message.command("post")
 @click.argument("name")
-@click.argument("payload_filename")
+@click.argument(
+    "payload_filenames",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, allow_dash=True),
+)
+@click.option(
+    "--binary/--text", default=False, help="Post raw bytes instead of UTF-8 text"
+)
+@click.option(
+    "--dedup/--no-dedup",
+    default=None,
+    help="Store payloads in the shared payload table, except streamed ones",
+)
 @pass_msglane
-def post_message(msglane, name, payload_filename):
-    """Post a new message to a stream"""
+def post_message(msglane, name, payload_filenames, binary, dedup):
+    """Post new messages from files or directories (- for stdin) to a lane"""
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    msglane.dedup = msglane.dedup if dedup is None else dedup
+
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
-    result = msglane.post_message_from_file(name, payload_filename)
+    if payload_filenames == ("-",):
+        stdin = click.get_binary_stream("stdin")
+        click.echo(msglane.post_message_from_stream(name, stdin, binary=binary))
+        return
 
-    click.echo(result)
+    filenames = expand_filenames(payload_filenames)
+
+    results = msglane.post_messages_from_files(name, filenames, binary=binary)
+
+    for result in results:
+        click.echo(result)
+
+@message.command("fanout")
+@click.argument("names")
+@click.argument("payload_filename")
+@click.option(
+    "--binary/--no-binary", default=False, help="Post the file as a binary message"
+)
+@click.option(
+    "--dedup/--no-dedup",
+    default=None,
+    help="Store the payload once in the shared payload table",
+)
+@pass_msglane
+def fanout_message(msglane, names, payload_filename, binary, dedup):
+    """Post a message to several lanes (comma separated names or a pattern)"""
+
+    msglane.dedup = msglane.dedup if dedup is None else dedup
+
+    if "," in names:
+        names = [name.strip() for name in names.split(",") if name.strip()]
+
+    mode = "rb" if binary else "r"
+
+    encoding = None if binary else "utf8"
+
+    with click.open_file(payload_filename, mode, encoding=encoding) as f:
+        payload = f.read()
+
+    try:
+        results = msglane.post_message_to_lanes(names, payload)
+    except ValueError as err:
+        raise click.ClickException(str(err)) from None
+
+    if not results:
+        click.echo("No lanes matched")
+        return
+
+    for name, message_uuid in sorted(results.items()):
+        click.echo(f"{name} {message_uuid}")
 
 @message.command("forward")
 @click.argument("name")
 @click.argument("ts", type=datetime.fromisoformat)
 @click.argument("message_uuid", type=uuid.UUID)
 @click.argument("payload_filename")
+@click.option(
+    "--dedup/--no-dedup",
+    default=None,
+    help="Store payloads in the shared payload table",
+)
 @pass_msglane
-def post_message(msglane, name, ts, message_uuid, payload_filename):
-    """Post an existing message to a stream"""
+def post_message(msglane, name, ts, message_uuid, payload_filename, dedup):
+    """Post an existing message to a lane"""
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    msglane.dedup = msglane.dedup if dedup is None else dedup
+
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
     result = msglane.post_message_from_file(name, payload_filename, ts=ts, message_uuid=message_uuid)
@@ -455,10 +990,10 @@ def post_message(msglane, name, ts, message_uuid, payload_filename):
 @click.argument("endposition", required=False, type=int)
 @pass_msglane
 def del_message(msglane, name, position, endposition):
-    """Delete a messages from a stream""" 
+    """Delete a messages from a lane""" 
 
-    if not msglane.has_stream(name):
-        click.echo("The stream does not exist")
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
         return
 
     if endposition:
@@ -469,18 +1004,623 @@ def del_message(msglane, name, position, endposition):
         click.echo(f"Deleted message at {name}:{position}")
 
 @message.command("has")
-@click.argument("message_uuid", type=uuid.UUID)
+@click.argument("message_uuids", nargs=-1)
+@click.option("--missing", is_flag=True, help="List the uuids that do not exist")
 @pass_msglane
-def has_message(msglane, message_uuid):
-    """Check if a message with message_uuid exists""" 
+def has_message(msglane, message_uuids, missing):
+    """Check if messages exist, reading uuids from stdin for none or -
 
-    result = msglane.has_message(message_uuid)
+    With one uuid, print True or False. With several, list those that
+    exist, or with --missing those that do not, exiting 1 if there are
+    any.
+    """
 
-    if result:
-        click.echo('True')
+    if message_uuids in ((), ("-",)):
+        message_uuids = click.get_text_stream("stdin").read().split()
+        single = False
+    else:
+        single = len(message_uuids) == 1
+
+    try:
+        message_uuids = [uuid.UUID(value) for value in message_uuids]
+    except ValueError as err:
+        raise click.BadParameter(str(err)) from None
+
+    found = msglane.has_messages(message_uuids)
+
+    if single:
+        click.echo(str(message_uuids[0] in found))
     else:
-        click.echo('False')
-        sys.exit(1) 
+        for message_uuid in message_uuids:
+            if (message_uuid in found) != missing:
+                click.echo(message_uuid)
+
+    if missing and not single and len(found) < len(set(message_uuids)):
+        sys.exit(1)
+
+# Consumer commands ------------------------------------------------------
+
+
+@cli.group()
+def consumer():
+    """Consumer command group"""
+
+
+@consumer.command("list")
+@click.argument("name", required=False)
+@pass_msglane
+def list_consumers(msglane, name):
+    """List consumers and their offsets"""
+
+    results = msglane.list_consumers(name)
+
+    tb = new_table()
+
+    tb.set_deco(tb.HEADER)
+
+    tb.header(["Lane", "Consumer", "Position", "Updated (UTC)"])
+    tb.set_cols_dtype(["t", "t", "i", format_ts])
+    tb.set_cols_align(["l", "l", "r", "l"])
+    tb.set_header_align(["c", "c", "r", "c"])
+    tb.set_max_width(0)
+
+    for result in results:
+        tb.add_row([result.lane.name, result.name, result.position, result.updated])
+
+    click.echo(tb.draw())
+
+
+@consumer.command("subscribe")
+@click.argument("name")
+@click.argument("consumer_name")
+@click.option("--position", default=0, help="Start after this position")
+@pass_msglane
+def subscribe(msglane, name, consumer_name, position):
+    """Subscribe a consumer to a lane"""
+
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
+        return
+
+    result = msglane.subscribe(name, consumer_name, position)
+
+    click.echo(f"Consumer {consumer_name} at {name}:{result}")
+
+
+@consumer.command("del")
+@click.argument("name")
+@click.argument("consumer_name")
+@pass_msglane
+def unsubscribe(msglane, name, consumer_name):
+    """Remove a consumer from a lane"""
+
+    msglane.unsubscribe(name, consumer_name)
+
+    click.echo(f"Removed consumer {consumer_name} from {name}")
+
+
+@consumer.command("ack")
+@click.argument("name")
+@click.argument("consumer_name")
+@click.argument("position", type=int)
+@pass_msglane
+def ack(msglane, name, consumer_name, position):
+    """Advance a consumer offset"""
+
+    result = msglane.ack(name, consumer_name, position)
+
+    if result is None:
+        click.echo("The consumer does not exist")
+        sys.exit(1)
+
+    click.echo(f"Consumer {consumer_name} at {name}:{result}")
+
+
+# Work queue commands ----------------------------------------------------
+
+
+@cli.group()
+def queue():
+    """Work queue command group"""
+
+
+@queue.command("list")
+@click.argument("name", required=False)
+@pass_msglane
+def list_queues(msglane, name):
+    """List work queues and their pending and claimed items"""
+
+    results = msglane.list_queues(name)
+
+    tb = new_table()
+
+    tb.set_deco(tb.HEADER)
+
+    tb.header(["Lane", "Queue", "Pending", "Claimed"])
+    tb.set_cols_dtype(["t", "t", "i", "i"])
+    tb.set_cols_align(["l", "l", "r", "r"])
+    tb.set_header_align(["c", "c", "r", "r"])
+    tb.set_max_width(0)
+
+    for result in results:
+        tb.add_row(result)
+
+    click.echo(tb.draw())
+
+
+@queue.command("create")
+@click.argument("name")
+@click.argument("queue_name", default="default")
+@click.option("--position", default=0, help="Only queue messages after this position")
+@pass_msglane
+def create_queue(msglane, name, queue_name, position):
+    """Create a work queue on a lane"""
+
+    if not msglane.has_lane(name):
+        click.echo("The lane does not exist")
+        return
+
+    result = msglane.create_queue(name, queue_name, position)
+
+    click.echo(f"Created queue {queue_name} on {name} with {result} items")
+
+
+@queue.command("del")
+@click.argument("name")
+@click.argument("queue_name", default="default")
+@pass_msglane
+def del_queue(msglane, name, queue_name):
+    """Remove a work queue from a lane"""
+
+    msglane.del_queue(name, queue_name)
+
+    click.echo(f"Removed queue {queue_name} from {name}")
+
+
+@queue.command("claim")
+@click.argument("name")
+@click.argument("worker")
+@click.option("--queue", "queue_name", default="default", help="Work queue name")
+@click.option("--count", default=1, help="Maximum number of messages to claim")
+@click.option("--lease", default=60, help="Lease time in seconds")
+@pass_msglane
+def claim(msglane, name, worker, queue_name, count, lease):
+    """Claim messages from a work queue, printing their positions"""
+
+    results = msglane.claim(name, worker, count, lease, queue_name)
+
+    for result in results:
+        click.echo(result.lane_position)
+
+
+@queue.command("complete")
+@click.argument("name")
+@click.argument("worker")
+@click.argument("positions", nargs=-1, type=int, required=True)
+@click.option("--queue", "queue_name", default="default", help="Work queue name")
+@pass_msglane
+def complete(msglane, name, worker, positions, queue_name):
+    """Complete claimed messages in a work queue"""
+
+    result = msglane.complete(name, worker, positions, queue_name)
+
+    click.echo(f"Completed {result} of {len(positions)} messages")
+
+    if result < len(positions):
+        # Keep the completed ones, exiting would roll back the session
+        msglane.session.commit()
+        sys.exit(1)
+
+
+@queue.command("release")
+@click.argument("name")
+@click.argument("worker")
+@click.argument("positions", nargs=-1, type=int, required=True)
+@click.option("--queue", "queue_name", default="default", help="Work queue name")
+@pass_msglane
+def release(msglane, name, worker, positions, queue_name):
+    """Return claimed messages to a work queue"""
+
+    result = msglane.release(name, worker, positions, queue_name)
+
+    click.echo(f"Released {result} of {len(positions)} messages")
+
+
+# Consume command --------------------------------------------------------
+
+
+@cli.command("consume")
+@click.argument("name")
+@click.option(
+    "--exec",
+    "command",
+    required=True,
+    help="Shell command run with each payload on stdin",
+)
+@click.option("--workers", default=4, help="Number of commands run at once")
+@click.option(
+    "--consumer", "consumer_name", help="Start after and advance this consumer's offset"
+)
+@click.option("--from-position", type=int, help="Start after this position")
+@click.option("--batch-size", default=100, help="Messages read per query")
+@click.option(
+    "--max-bytes", default=64 * 1024 * 1024, help="Payload bytes held in flight"
+)
+@click.option(
+    "--follow/--no-follow", default=False, help="Wait for new messages when caught up"
+)
+@click.option(
+    "--timeout", type=float, help="With --follow, stop after this many idle seconds"
+)
+@click.pass_obj
+def consume(
+    opt,
+    name,
+    command,
+    workers,
+    consumer_name,
+    from_position,
+    batch_size,
+    max_bytes,
+    follow,
+    timeout,
+):
+    """Run a command on each message of a lane in parallel
+
+    The lane, position, uuid and timestamp of each message are passed in
+    the MESSAGELANE_LANE, MESSAGELANE_POSITION, MESSAGELANE_UUID and
+    MESSAGELANE_TS environment variables. Progress is committed to the
+    consumer offset in position order, and a failed command stops the run.
+    """
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from messagelane import consume, db
+
+    engine = create_engine(opt.database, echo=opt.debug, **db.pool_options())
+
+    log = functools.partial(click.echo, err=True) if opt.debug else None
+
+    try:
+        runner = consume.Consumer(
+            sessionmaker(engine),
+            name,
+            consume.run_command(command),
+            workers=workers,
+            consumer=consumer_name,
+            position=from_position,
+            batch_size=batch_size,
+            max_bytes=max_bytes,
+            log=log,
+        )
+    except ValueError:
+        click.echo("The lane does not exist")
+        return
+
+    try:
+        handled = runner.run(follow, timeout)
+    except Exception as err:
+        failed = runner.progress.failed
+        if failed is None:
+            raise
+        raise click.ClickException(
+            f"Failed at {name}:{failed.position}, "
+            f"completed up to {name}:{runner.progress.position}: {err}"
+        ) from err
+    finally:
+        engine.dispose()
+
+    click.echo(
+        f"Handled {handled} messages, "
+        f"completed up to {name}:{runner.progress.position}",
+        err=True,
+    )
+
+
+# Metrics commands -------------------------------------------------------
+
+
+@cli.command(
+    "metrics",
+    context_settings={"ignore_unknown_options": True, "allow_interspersed_args": False},
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["table", "prometheus", "json"]),
+    default="table",
+    help="Report format, written to stderr",
+)
+@click.option(
+    "--textfile", type=click.Path(dir_okay=False), help="Write a Prometheus text file"
+)
+@click.argument("args", nargs=-1, required=True, type=click.UNPROCESSED)
+@click.pass_obj
+def run_metrics(opt, output_format, textfile, args):
+    """Run a msglane command and report its MessageLane calls"""
+
+    from messagelane import metrics
+
+    metrics.enable()
+
+    options = ["--database", opt.database]
+
+    if opt.debug:
+        options.append("--debug")
+
+    try:
+        cli.main([*options, *args], prog_name="msglane", standalone_mode=False)
+    finally:
+        results = metrics.snapshot()
+
+        if textfile:
+            metrics.write_textfile(textfile, results)
+
+        if not results:
+            pass
+        elif output_format == "prometheus":
+            click.echo(metrics.format_prometheus(results), nl=False, err=True)
+        elif output_format == "json":
+            click.echo(json.dumps(results, indent=2), err=True)
+        else:
+            click.echo(format_metrics(results), err=True)
+
+
+def format_metrics(results):
+    """Return a table of metrics"""
+
+    tb = new_table()
+
+    tb.set_deco(tb.HEADER)
+
+    tb.header(
+        [
+            "Method",
+            "Calls",
+            "Errors",
+            "Statements",
+            "Rows",
+            "Bytes",
+            "Total (ms)",
+            "Mean (ms)",
+            "Max (ms)",
+            "SQL (ms)",
+        ]
+    )
+    tb.set_cols_dtype(["t", "i", "i", "i", "i", "i", "f", "f", "f", "f"])
+    tb.set_cols_align(["l", "r", "r", "r", "r", "r", "r", "r", "r", "r"])
+    tb.set_header_align(["c", "c", "c", "c", "c", "c", "c", "c", "c", "c"])
+    tb.set_precision(2)
+    tb.set_max_width(0)
+
+    for method, entry in sorted(results.items()):
+        tb.add_row(
+            [
+                method,
+                entry["calls"],
+                entry["errors"],
+                entry["statements"],
+                entry["rows"],
+                entry["bytes"],
+                entry["seconds"] * 1000,
+                entry["seconds"] / entry["calls"] * 1000,
+                entry["max_seconds"] * 1000,
+                entry["statement_seconds"] * 1000,
+            ]
+        )
+
+    return tb.draw()
+
+
+# Benchmark commands -----------------------------------------------------
+
+
+@cli.group()
+def bench():
+    """Benchmark command group"""
+
+
+@bench.command("contention")
+@click.option("--producers", default="1,2,4,8,16,32", help="Producer process counts")
+@click.option("--mode", type=click.Choice(["lock", "reserve", "all"]), default="all")
+@click.option("--messages", default=1000, help="Messages per producer")
+@click.option("--batch", default=1, help="Messages per post")
+@click.option("--payload-size", default=256, help="Payload size in bytes")
+@click.pass_obj
+def bench_contention(opt, producers, mode, messages, batch, payload_size):
+    """Measure posting throughput with concurrent producers on one lane"""
+
+    from messagelane.bench import contention
+
+    url = opt.session.get_bind().url.render_as_string(hide_password=False)
+    counts = [int(count) for count in producers.split(",")]
+    modes = contention.MODES if mode == "all" else [mode]
+
+    tb = new_table()
+
+    tb.set_deco(tb.HEADER)
+
+    tb.header(
+        ["Mode", "Producers", "Batch", "Messages", "Seconds", "Rate (msg/s)", "Dense"]
+    )
+    tb.set_cols_dtype(["t", "i", "i", "i", "f", "f", "t"])
+    tb.set_cols_align(["l", "r", "r", "r", "r", "r", "c"])
+    tb.set_header_align(["c", "c", "c", "c", "c", "c", "c"])
+    tb.set_precision(1)
+    tb.set_max_width(0)
+
+    results = contention.run(
+        url, counts, modes, messages=messages, batch=batch, payload_size=payload_size
+    )
+
+    for result in results:
+        tb.add_row(result.values())
+
+    click.echo(tb.draw())
+
+@bench.command("ops")
+@click.option("--sizes", default="1000,10000,100000", help="Lane sizes in messages")
+@click.option("--payload-sizes", default="256", help="Payload sizes in bytes")
+@click.option(
+    "--operation",
+    "operations",
+    multiple=True,
+    help="Operation to measure (default: all, may be repeated)",
+)
+@click.option("--ops", default=1000, help="Calls measured per operation")
+@click.option(
+    "--output", type=click.Path(dir_okay=False), help="Write the results as JSON"
+)
+@click.pass_obj
+def bench_ops(opt, sizes, payload_sizes, operations, ops, output):
+    """Measure the latency of each operation on seeded lanes"""
+
+    from messagelane.bench import operations as bench_operations
+
+    for operation in operations:
+        if operation not in bench_operations.OPERATIONS:
+            raise click.BadParameter(
+                f"{operation} is not one of {bench_operations.OPERATIONS}"
+            )
+
+    url = opt.session.get_bind().url.render_as_string(hide_password=False)
+    sizes = [int(float(size)) for size in sizes.split(",")]
+    payload_sizes = [int(size) for size in payload_sizes.split(",")]
+
+    tb = new_table()
+
+    tb.set_deco(tb.HEADER)
+
+    tb.header(
+        [
+            "Operation",
+            "Messages",
+            "Payload",
+            "Ops",
+            "Rate (op/s)",
+            "p50 (ms)",
+            "p99 (ms)",
+        ]
+    )
+    tb.set_cols_dtype(["t", "i", "i", "i", "f", "f", "f"])
+    tb.set_cols_align(["l", "r", "r", "r", "r", "r", "r"])
+    tb.set_header_align(["c", "c", "c", "c", "c", "c", "c"])
+    tb.set_precision(2)
+    tb.set_max_width(0)
+
+    results = list(
+        bench_operations.run(
+            url,
+            sizes,
+            payload_sizes,
+            operations=operations or None,
+            ops=ops,
+            log=functools.partial(click.echo, err=True),
+        )
+    )
+
+    keys = ["operation", "messages", "payload_size", "ops", "rate", "p50_ms", "p99_ms"]
+
+    for result in results:
+        tb.add_row([result[key] for key in keys])
+
+    click.echo(tb.draw())
+
+    if output:
+        report = bench_operations.report(
+            results, url, sizes=sizes, payload_sizes=payload_sizes, ops=ops
+        )
+        Path(output).write_text(json.dumps(report, indent=2))
+
+
+@bench.command("compare")
+@click.argument("old", type=click.File())
+@click.argument("new", type=click.File())
+@click.option(
+    "--threshold", default=10.0, help="Percent p50 slowdown counted as a regression"
+)
+def bench_compare(old, new, threshold):
+    """Compare two bench ops results, failing on regressions"""
+
+    from messagelane.bench import operations as bench_operations
+
+    tb = new_table()
+
+    tb.set_deco(tb.HEADER)
+
+    tb.header(
+        [
+            "Operation",
+            "Messages",
+            "Payload",
+            "p50 old",
+            "p50 new",
+            "p99 old",
+            "p99 new",
+            "Change",
+            "",
+        ]
+    )
+    tb.set_cols_dtype(["t", "i", "i", "f", "f", "f", "f", "t", "t"])
+    tb.set_cols_align(["l", "r", "r", "r", "r", "r", "r", "r", "l"])
+    tb.set_header_align(["c", "c", "c", "c", "c", "c", "c", "c", "c"])
+    tb.set_precision(2)
+    tb.set_max_width(0)
+
+    rows = list(bench_operations.compare(json.load(old), json.load(new), threshold))
+
+    for row in rows:
+        tb.add_row(
+            [
+                row["operation"],
+                row["messages"],
+                row["payload_size"],
+                row["old_p50_ms"],
+                row["new_p50_ms"],
+                row["old_p99_ms"],
+                row["new_p99_ms"],
+                f"{row['change']:+.1f}%",
+                "REGRESSION" if row["regression"] else "",
+            ]
+        )
+
+    click.echo(tb.draw())
+
+    regressions = sum(row["regression"] for row in rows)
+
+    if regressions:
+        raise click.ClickException(
+            f"{regressions} operations slower by over {threshold}%"
+        )
+
+
+@bench.command("startup")
+@click.option(
+    "--module", default="messagelane.commands.msglane", help="Module to import"
+)
+@click.option("--repeat", default=5, help="Number of fresh interpreters to time")
+@click.option(
+    "--budget", type=float, help="Fail if the best import time exceeds this (ms)"
+)
+def bench_startup(module, repeat, budget):
+    """Measure the import time of the command line program"""
+
+    from messagelane.bench import startup
+
+    result = startup.run(module, repeat)
+
+    best = result["best"] * 1000
+    median = result["median"] * 1000
+
+    click.echo(f"Import {module}: best {best:.1f} ms, median {median:.1f} ms")
+
+    if result["loaded"]:
+        raise click.ClickException(
+            f"Deferred modules loaded at import: {', '.join(result['loaded'])}"
+        )
+
+    if budget is not None and best > budget:
+        raise click.ClickException(f"Import time {best:.1f} ms exceeds {budget} ms")
 
 def main():
     """Main command starting point"""
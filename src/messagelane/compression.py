@@ -0,0 +1,151 @@
+"""Payload compression codecs.
+
+Payloads are compressed on post with a named codec and stored in the
+payload_data column, with the codec recorded in payload_codec. Payloads
+that do not get smaller are stored uncompressed with no codec, as text
+or, for binary payloads, as data.
+
+The zlib and lzma codecs are always available, zstd needs the optional
+zstandard package (pip install messagelane[zstd]).
+
+Example:
+-------
+>>> data = compression.compress(b"hello" * 100, "zlib")
+>>> compression.decompress(data, "zlib")
+
+"""
+
+##########################################################################
+#
+#   Payload compression
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import lzma
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+NONE = "none"
+
+
+def zstd_compress(data, level):
+    """Compress data with zstd."""
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def zstd_decompress(data):
+    """Decompress zstd data."""
+    # Streamed frames do not record their size, so use a decompressobj
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+def lzma_compress(data, level):
+    """Compress data with lzma."""
+    return lzma.compress(data, preset=level)
+
+
+# name: (compress, decompress, default level)
+
+CODECS = {
+    "zlib": (zlib.compress, zlib.decompress, 6),
+    "lzma": (lzma_compress, lzma.decompress, 6),
+}
+
+if zstandard is not None:
+    CODECS["zstd"] = (zstd_compress, zstd_decompress, 3)
+
+
+def available():
+    """Return the names of the available codecs."""
+    return [NONE, *CODECS]
+
+
+def get_codec(name):
+    """Return the (compress, decompress, level) functions of a codec."""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown or unavailable codec: {name}") from None
+
+
+def compress(data, codec, level=None):
+    """Return data compressed with codec."""
+    func, _, default_level = get_codec(codec)
+
+    return func(data, default_level if level is None else level)
+
+
+def decompress(data, codec):
+    """Return data decompressed with codec."""
+    _, func, _ = get_codec(codec)
+
+    return func(data)
+
+
+def compressor(codec, level=None):
+    """Return an incremental compressor with compress() and flush()."""
+    _, _, default_level = get_codec(codec)
+
+    if level is None:
+        level = default_level
+
+    if codec == "zlib":
+        return zlib.compressobj(level)
+
+    if codec == "lzma":
+        return lzma.LZMACompressor(preset=level)
+
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+def decompressor(codec):
+    """Return an incremental decompressor with decompress()."""
+    get_codec(codec)
+
+    if codec == "zlib":
+        return zlib.decompressobj()
+
+    if codec == "lzma":
+        return lzma.LZMADecompressor()
+
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def encode(payload, codec, level=None):
+    """Return the (text, data, codec) columns to store a payload.
+
+    Payloads may be str or bytes. When codec is none or compression does
+    not make them smaller, str payloads are kept as text and bytes
+    payloads as uncompressed data.
+    """
+    binary = isinstance(payload, bytes)
+
+    if codec not in (None, NONE):
+        raw = payload if binary else payload.encode()
+        data = compress(raw, codec, level)
+
+        if len(data) < len(raw):
+            return None, data, codec
+
+    if binary:
+        return None, payload, None
+
+    return payload, None, None
+
+
+def decode(text, data, codec, binary):
+    """Return the payload stored in the (text, data, codec) columns."""
+    if data is None:
+        return text.encode() if binary else text
+
+    if codec is not None:
+        data = decompress(data, codec)
+
+    return data if binary else data.decode()
@@ -0,0 +1,312 @@
+"""Parallel lane consumer.
+
+Run a handler on each message of a lane in a pool of worker threads.
+Messages are read in batches after a starting position or a consumer's
+stored offset, with their payloads, in short transactions on one engine.
+The payloads held for messages in flight are bounded by max_bytes.
+
+Handlers may finish in any order, but progress is committed in order:
+the consumer offset only advances past a message once it and every
+message before it are done. After a failure or interruption, the
+messages after the offset are handled again on the next run.
+
+Example:
+-------
+>>> from messagelane import consume, db
+>>> handler = consume.run_command("process-file")
+>>> consume.consume(db.Session, "telemetry", handler, workers=8, consumer="proc")
+
+"""
+
+##########################################################################
+#
+#   Parallel lane consumer
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import collections
+import concurrent.futures
+import os
+import subprocess
+import time
+
+from typing import NamedTuple
+
+from .messagelane import MessageLane
+
+# Seconds between consumer offset commits while messages are in flight
+
+ACK_INTERVAL = 1.0
+
+
+class Job(NamedTuple):
+    """A message handed to a handler."""
+
+    lane: str
+    position: int
+    message_uuid: object
+    ts: object
+    payload: bytes
+
+
+def run_command(command, shell=True):
+    """Return a handler piping each payload to command on stdin.
+
+    The lane, position, uuid and timestamp of the message are passed in
+    the MESSAGELANE_LANE, MESSAGELANE_POSITION, MESSAGELANE_UUID and
+    MESSAGELANE_TS environment variables. A non-zero exit status raises
+    CalledProcessError.
+    """
+
+    def handler(job):
+        env = {
+            **os.environ,
+            "MESSAGELANE_LANE": job.lane,
+            "MESSAGELANE_POSITION": str(job.position),
+            "MESSAGELANE_UUID": str(job.message_uuid),
+            "MESSAGELANE_TS": job.ts.isoformat(),
+        }
+        subprocess.run(command, shell=shell, input=job.payload, env=env, check=True)
+
+    return handler
+
+
+class Progress:
+    """Track the jobs in flight and the in order progress."""
+
+    def __init__(self, position):
+        """Initialize Progress instance."""
+        self.position = position
+        self.pending = collections.deque()
+        self.inflight_bytes = 0
+        self.handled = 0
+        self.error = None
+        self.failed = None
+
+    def add(self, job, future):
+        """Add a submitted job."""
+        self.pending.append((job, future))
+        self.inflight_bytes += len(job.payload)
+
+    def advance(self):
+        """Move past the finished jobs at the front, stopping at an error."""
+        while self.error is None and self.pending:
+            job, future = self.pending[0]
+
+            if not future.done() or future.cancelled():
+                return
+
+            self.pending.popleft()
+            self.inflight_bytes -= len(job.payload)
+
+            if future.exception() is not None:
+                self.error = future.exception()
+                self.failed = job
+                return
+
+            self.position = job.position
+            self.handled += 1
+
+    def running(self):
+        """Return the futures of the unfinished jobs."""
+        return [future for _, future in self.pending if not future.done()]
+
+
+class Consumer:
+    """Handle the messages of a lane in parallel."""
+
+    def __init__(
+        self,
+        Session,
+        name,
+        handler,
+        workers=4,
+        consumer=None,
+        position=None,
+        batch_size=100,
+        max_bytes=64 * 1024 * 1024,
+        max_messages=1000,
+        log=None,
+    ):
+        """Initialize Consumer instance.
+
+        With a consumer name, the lane is read after the consumer's stored
+        offset (subscribing it at position if needed), or after position
+        when one is given, and the offset is advanced as messages are
+        handled. Otherwise the lane is read after position, default 0.
+
+        Messages are read batch_size at a time. At most twice the number
+        of workers run at once, and at most max_messages holding max_bytes
+        of payloads (or a single larger one) wait to be committed.
+        """
+        self.Session = Session
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.log = log
+        self.last_ack = time.monotonic()
+
+        with Session.begin() as session:
+            msglane = MessageLane(session)
+
+            if not msglane.has_lane(name):
+                raise ValueError(f"Unknown lane: {name}")
+
+            if consumer is not None:
+                offset = msglane.subscribe(name, consumer, position or 0)
+                if position is None:
+                    position = offset
+
+        self.progress = Progress(position or 0)
+        self.acked = self.progress.position
+        self.read_position = self.progress.position
+        self.committed = self.read_position
+
+    def read(self):
+        """Return the next batch of jobs after the last read position."""
+        with self.Session() as session:
+            messages = MessageLane(session).fetch_after(
+                self.name, self.read_position, self.batch_size, self.max_bytes
+            )
+            jobs = [
+                Job(
+                    self.name,
+                    message.lane_position,
+                    message.message_uuid,
+                    message.ts,
+                    message.payload_bytes,
+                )
+                for message in messages
+            ]
+
+        if jobs:
+            self.read_position = jobs[-1].position
+
+        return jobs
+
+    def ack(self):
+        """Commit the in order progress to the consumer offset."""
+        self.last_ack = time.monotonic()
+
+        if self.consumer is None or self.progress.position == self.acked:
+            return
+
+        with self.Session.begin() as session:
+            MessageLane(session).ack(self.name, self.consumer, self.progress.position)
+
+        self.acked = self.progress.position
+
+        if self.log:
+            self.log(f"Acked {self.name}:{self.acked}")
+
+    def wait(self, needed=None):
+        """Wait for room for a job of needed bytes, or for all jobs.
+
+        Returns False if a handler failed.
+        """
+        progress = self.progress
+
+        while True:
+            progress.advance()
+
+            if time.monotonic() - self.last_ack >= ACK_INTERVAL:
+                self.ack()
+
+            if progress.error is not None:
+                return False
+
+            if needed is None:
+                if not progress.pending:
+                    return True
+            elif (
+                len(progress.running()) < self.workers * 2
+                and len(progress.pending) < self.max_messages
+                and (
+                    not progress.pending
+                    or progress.inflight_bytes + needed <= self.max_bytes
+                )
+            ):
+                return True
+
+            concurrent.futures.wait(
+                progress.running(),
+                timeout=ACK_INTERVAL,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+
+    def handle(self, executor, listener, timeout):
+        """Submit the jobs until drained, or the wait for more times out."""
+        while True:
+            jobs = self.read()
+
+            if not jobs:
+                # Positions up to the committed one can hold no message,
+                # after a tail delete or a released reservation
+                self.read_position = max(self.read_position, self.committed)
+
+                if listener is None or not self.wait():
+                    return
+
+                self.ack()
+
+                positions = {self.name: self.read_position}
+                advanced = listener.wait_for_messages(positions, timeout)
+
+                if not advanced:
+                    return
+
+                self.committed = advanced[self.name]
+                continue
+
+            for job in jobs:
+                if not self.wait(len(job.payload)):
+                    return
+                self.progress.add(job, executor.submit(self.handler, job))
+
+    def run(self, follow=False, timeout=None):
+        """Handle messages until the lane is drained.
+
+        With follow, wait for new messages instead, until timeout seconds
+        pass without any (forever if None). Returns the number of messages
+        handled. A handler error stops the run once the running handlers
+        finish, and is raised after the progress before it is committed.
+        """
+        listener = None
+
+        if follow:
+            with self.Session() as session:
+                listener = MessageLane(session).listen([self.name])
+
+        executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+
+        try:
+            if listener is None:
+                self.handle(executor, None, timeout)
+            else:
+                with listener:
+                    self.handle(executor, listener, timeout)
+
+            self.wait()
+
+        finally:
+            # Let the running handlers finish, dropping the queued ones
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.progress.advance()
+            self.ack()
+
+        if self.progress.error is not None:
+            raise self.progress.error
+
+        return self.progress.handled
+
+
+def consume(Session, name, handler, follow=False, timeout=None, **kw):
+    """Handle the messages of a lane in parallel, see Consumer."""
+    return Consumer(Session, name, handler, **kw).run(follow, timeout)
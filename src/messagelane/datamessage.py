@@ -1,5 +1,19 @@
 #!/usr/bin/env python
-"""Data Messsage."""
+"""Data Messsage.
+
+DataMessage builds email formatted messages with files attached. Calling
+it returns an EmailMessage holding every attachment in memory, while
+open() and generate() produce the same text as its as_string()
+incrementally, reading each file in blocks, for posting large bundles
+with MessageLane.post_message_from_stream().
+
+Example:
+-------
+>>> datamessage = DataMessage(Subject="Camera images")
+>>> with datamessage.open(filenames) as stream:
+...     msglane.post_message_from_stream("images", stream, binary=False)
+
+"""
 
 ##########################################################################
 #
@@ -10,14 +24,114 @@
 #   2023-01-07  Todd Valentic
 #               Initial implementation
 #
+#   2026-10-18  Todd Valentic
+#               Add streaming message generation
+#
 ##########################################################################
 
+import binascii
+import hashlib
 import mimetypes
+import random
+import sys
 
 from email.message import EmailMessage
 from email.policy import SMTP
 from pathlib import Path
 
+# Base64 lines per block read from an attachment
+
+BLOCK_LINES = 1024
+
+
+def attachments(filenames):
+    """Yield the (path, maintype, subtype) of each existing file."""
+    for filename in filenames or []:
+        path = Path(filename)
+
+        if not path.exists():
+            continue
+
+        ctype, encoding = mimetypes.guess_type(path)
+
+        if ctype is None or encoding is not None:
+            ctype = "application/octet-stream"
+
+        maintype, subtype = ctype.split("/", 1)
+
+        yield path, maintype, subtype
+
+
+def make_boundary():
+    """Return a random multipart boundary in the email generator format."""
+    width = len(repr(sys.maxsize - 1))
+
+    return "=" * 15 + f"{random.randrange(sys.maxsize):0{width}d}" + "=="
+
+
+def encode_file(path, linesep, max_line_length):
+    """Yield the base64 body of a file as the email generator writes it."""
+    line_size = max_line_length // 4 * 3
+
+    with open(path, "rb") as fp:
+        while True:
+            data = fp.read(line_size * BLOCK_LINES)
+
+            if not data:
+                break
+
+            yield "".join(
+                binascii.b2a_base64(data[i : i + line_size], newline=False).decode()
+                + linesep
+                for i in range(0, len(data), line_size)
+            ).encode()
+
+
+class MessageReader:
+    """Binary file-like object reading generated message chunks.
+
+    The MD5 digest and size of what has been read are kept up to date.
+    """
+
+    def __init__(self, chunks):
+        """Initialize MessageReader instance."""
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def read(self, size=-1):
+        """Return up to size bytes, or everything left for -1."""
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+
+            if chunk is None:
+                break
+
+            self.buffer += chunk
+
+        if size < 0:
+            data, self.buffer = self.buffer, b""
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+
+        self.md5.update(data)
+        self.size += len(data)
+
+        return data
+
+    def close(self):
+        """Stop generating the message."""
+        getattr(self.chunks, "close", lambda: None)()
+
+    def __enter__(self):
+        """Enter the context."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit the context, closing the reader."""
+        self.close()
+
 
 class DataMessage:
     """Data Transport Message."""
@@ -36,11 +150,8 @@ class DataMessage:
         """Set cached headers."""
         self.headers.update(kw)
 
-    def __call__(self, filenames=None, comment=None, date=None, headers=None):
-        """Generate an email formatted message."""
-        if filenames is None:
-            filenames = []
-
+    def message(self, comment=None, date=None, headers=None):
+        """Return an email message with the headers and no attachments."""
         msg = EmailMessage(policy=SMTP)
         msg.preamble = comment
 
@@ -54,22 +165,64 @@ class DataMessage:
             for key, value in headers.items():
                 msg[key] = value
 
-        for filename in filenames:
-            path = Path(filename)
-
-            if not path.exists():
-                continue
-
-            ctype, encoding = mimetypes.guess_type(path)
-
-            if ctype is None or encoding is not None:
-                ctype = "application/octet-stream"
+        return msg
 
-            maintype, subtype = ctype.split("/", 1)
+    def __call__(self, filenames=None, comment=None, date=None, headers=None):
+        """Generate an email formatted message."""
+        msg = self.message(comment, date, headers)
 
+        for path, maintype, subtype in attachments(filenames):
             with open(path, "rb") as fp:
                 msg.add_attachment(
                     fp.read(), maintype=maintype, subtype=subtype, filename=path.name
                 )
 
         return msg
+
+    def generate(
+        self, filenames=None, comment=None, date=None, headers=None, boundary=None
+    ):
+        """Yield the text of the message as encoded bytes chunks.
+
+        The chunks join to the same text as the as_string() of the
+        message from __call__ with the same boundary. Only one block of
+        an attachment is held in memory at a time.
+        """
+        msg = self.message(comment, date, headers)
+        files = list(attachments(filenames))
+
+        # A skeleton with empty attachments gives the headers and
+        # boundaries, the attachment bodies are encoded into it
+
+        for path, maintype, subtype in files:
+            msg.add_attachment(
+                b"", maintype=maintype, subtype=subtype, filename=path.name
+            )
+
+        if files:
+            while boundary is None or boundary in (comment or ""):
+                boundary = make_boundary()
+            msg.set_boundary(boundary)
+
+        policy = msg.policy
+        skeleton = msg.as_string()
+        cursor = 0
+
+        for part, (path, _, _) in zip(msg.iter_parts(), files):
+            head = f"--{boundary}{policy.linesep}{part.as_string()}"
+            end = skeleton.index(head, cursor) + len(head)
+
+            yield skeleton[cursor:end].encode()
+            yield from encode_file(path, policy.linesep, policy.max_line_length)
+
+            cursor = end
+
+        yield skeleton[cursor:].encode()
+
+    def open(
+        self, filenames=None, comment=None, date=None, headers=None, boundary=None
+    ):
+        """Return a binary file-like object reading the generated message."""
+        return MessageReader(
+            self.generate(filenames, comment, date, headers, boundary)
+        )
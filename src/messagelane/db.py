@@ -1,5 +1,21 @@
 #!/usr/bin/env python3
-"""Database Interaction."""
+"""Database Interaction.
+
+The engine and Session factory are created on first use from the
+environment (and a .env file), so importing messagelane does not connect
+or load SQLAlchemy until a database is needed.
+
+Environment:
+-------
+MESSAGELANE_URL             database URL (postgresql:///messagelane)
+MESSAGELANE_DEBUG           echo SQL statements (0)
+MESSAGELANE_POOL_SIZE       connections kept in the pool
+MESSAGELANE_MAX_OVERFLOW    connections allowed beyond the pool size
+MESSAGELANE_POOL_TIMEOUT    seconds to wait for a pooled connection
+MESSAGELANE_POOL_RECYCLE    seconds before a pooled connection is replaced
+MESSAGELANE_POOL_PRE_PING   test connections when checked out (0)
+
+"""
 
 ###########################################################################
 #
@@ -13,18 +29,71 @@
 #   2027-07-01  Todd Valentic
 #               Convert to MessageLane
 #
+#   2026-10-18  Todd Valentic
+#               Create the engine on first use, pool settings
+#
 ###########################################################################
 
+import functools
 import os
 
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
-load_dotenv(".env")
+def as_bool(value):
+    """Return True for the environment flag values 1 and true."""
+    return value.lower() in ["1", "true"]
+
+
+# option: (environment variable, type)
+
+POOL_OPTIONS = {
+    "pool_size": ("MESSAGELANE_POOL_SIZE", int),
+    "max_overflow": ("MESSAGELANE_MAX_OVERFLOW", int),
+    "pool_timeout": ("MESSAGELANE_POOL_TIMEOUT", float),
+    "pool_recycle": ("MESSAGELANE_POOL_RECYCLE", int),
+    "pool_pre_ping": ("MESSAGELANE_POOL_PRE_PING", as_bool),
+}
+
+
+def pool_options():
+    """Return the create_engine pool arguments set in the environment."""
+    options = {}
+
+    for option, (name, convert) in POOL_OPTIONS.items():
+        value = os.environ.get(name)
+        if value:
+            options[option] = convert(value)
+
+    return options
+
+
+@functools.lru_cache(maxsize=None)
+def get_engine():
+    """Return the engine, creating it on first use."""
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+
+    load_dotenv(".env")
+
+    debug = as_bool(os.environ.get("MESSAGELANE_DEBUG", "0"))
+    url = os.environ.get("MESSAGELANE_URL", "postgresql:///messagelane")
+
+    return create_engine(url, echo=debug, **pool_options())
+
+
+@functools.lru_cache(maxsize=None)
+def get_sessionmaker():
+    """Return the Session factory bound to the engine."""
+    from sqlalchemy.orm import sessionmaker
+
+    return sessionmaker(get_engine())
+
+
+def __getattr__(name):
+    """Create the module engine and Session attributes on first use."""
+    if name == "engine":
+        return get_engine()
 
-debug = os.environ.get("MESSAGELANE_DEBUG", "0").lower() in ["1", "true"]
+    if name == "Session":
+        return get_sessionmaker()
 
-url = os.environ.get("MESSAGELANE_URL", "postgresql:///messagelane")
-engine = create_engine(url, echo=debug)
-Session = sessionmaker(engine)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
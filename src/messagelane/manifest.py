@@ -0,0 +1,296 @@
+"""Message attachment manifests.
+
+A manifest lists the attachments of an email formatted message (as made
+by DataMessage) with their filename, content type and size, along with
+selected headers of the message. It is extracted from the header blocks
+alone while the message text passes through a Scanner, so the bodies are
+never decoded or parsed and the cost stays low for large payloads. The
+parts of nested multiparts are listed in place of their container.
+
+The selected headers are the MANIFEST_HEADERS (MESSAGELANE_MANIFEST_HEADERS,
+comma separated) and any X- header.
+
+Example:
+-------
+>>> scanner = manifest.Scanner()
+>>> scanner.feed(text.encode())
+>>> scanner.manifest()
+{'headers': [('subject', 'Camera images'), ...],
+ 'attachments': [{'filename': 'image.png', 'content_type': 'image/png', ...}]}
+
+"""
+
+##########################################################################
+#
+#   Message attachment manifests
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import email.policy
+import os
+import re
+
+from email.parser import BytesHeaderParser
+
+MANIFEST_HEADERS = [
+    name.strip().lower()
+    for name in os.environ.get(
+        "MESSAGELANE_MANIFEST_HEADERS", "From,To,Subject,Date,Message-ID"
+    ).split(",")
+    if name.strip()
+]
+
+# Longest header value stored, to fit in an index entry
+
+MAX_VALUE = 1000
+
+# Give up on text that does not start with a header block this size
+
+MAX_HEADERS = 64 * 1024
+
+HEADER_LINE = re.compile(rb"[!-9;-~]+:")
+
+TOP, PREAMBLE, PART, BODY, DONE = range(5)
+
+parser = BytesHeaderParser(policy=email.policy.default)
+
+
+def selected(name):
+    """Return True if a header is kept in the manifest."""
+    name = name.lower()
+
+    return name in MANIFEST_HEADERS or name.startswith("x-")
+
+
+class Scanner:
+    """Extract a manifest from message text fed in chunks."""
+
+    def __init__(self):
+        """Initialize Scanner instance."""
+        self.state = TOP
+        self.buffer = b""
+        self.block = []
+        self.block_size = 0
+        self.delimiters = []
+        self.is_email = None
+        self.headers = []
+        self.attachments = []
+        self.part = None
+
+    def feed(self, data):
+        """Scan the next chunk of the message text."""
+        if self.state == DONE:
+            return
+
+        self.buffer += data
+
+        while self.state != DONE:
+            if self.state in (PREAMBLE, BODY):
+                if not self.scan_body():
+                    break
+            elif not self.scan_header_line():
+                break
+
+    def scan_header_line(self):
+        """Add the next line to the header block, False if incomplete."""
+        end = self.buffer.find(b"\n")
+
+        if end < 0:
+            if self.state == TOP and len(self.buffer) > MAX_HEADERS:
+                self.stop()
+            return False
+
+        line = self.buffer[: end + 1]
+        self.buffer = self.buffer[end + 1 :]
+
+        if self.state == TOP and self.is_email is None:
+            self.is_email = bool(HEADER_LINE.match(line))
+            if not self.is_email:
+                self.stop()
+                return False
+
+        if line.strip():
+            self.block.append(line)
+            self.block_size += len(line)
+            if self.state == TOP and self.block_size > MAX_HEADERS:
+                self.is_email = False
+                self.stop()
+            return True
+
+        headers = parser.parsebytes(b"".join(self.block))
+        self.block = []
+        self.block_size = 0
+
+        if self.state == TOP:
+            self.top_headers(headers)
+        else:
+            self.part_headers(headers)
+
+        return True
+
+    def top_headers(self, headers):
+        """Keep the selected message headers and find the boundary."""
+        for name, value in headers.items():
+            if selected(name):
+                self.headers.append((name.lower(), str(value)[:MAX_VALUE]))
+
+        boundary = None
+
+        if headers.get_content_maintype() == "multipart":
+            boundary = headers.get_boundary()
+
+        if boundary is None:
+            self.stop()
+            return
+
+        self.start_multipart(boundary)
+
+    def start_multipart(self, boundary):
+        """Look for the parts of a multipart body with boundary."""
+        # Treat the start of the preamble as the start of a line
+        self.delimiters.append(b"\n--" + boundary.encode())
+        self.buffer = b"\n" + self.buffer
+        self.state = PREAMBLE
+
+    def part_headers(self, headers):
+        """Start the attachment entry of a part, or descend into it."""
+        if headers.get_content_maintype() == "multipart":
+            boundary = headers.get_boundary()
+            if boundary is not None:
+                self.start_multipart(boundary)
+                return
+
+        filename = headers.get_filename()
+
+        self.part = {
+            "filename": filename[:MAX_VALUE] if filename else None,
+            "content_type": headers.get_content_type(),
+            "size": 0,
+            "base64": headers.get("content-transfer-encoding", "").lower()
+            == "base64",
+            "tail": b"",
+        }
+        self.attachments.append(self.part)
+        self.state = BODY
+
+    def scan_body(self):
+        """Count body text up to the next delimiter, False if not found."""
+        delimiter = self.delimiters[-1]
+        index = self.buffer.find(delimiter)
+
+        if index < 0:
+            # Keep enough to match a delimiter split across chunks
+            keep = len(delimiter)
+            self.count(self.buffer[:-keep])
+            self.buffer = self.buffer[-keep:]
+            return False
+
+        self.count(self.buffer[:index])
+        self.finish_part()
+
+        end = self.buffer.find(b"\n", index + 1)
+
+        if end < 0:
+            # Wait for the rest of the delimiter line, which is found
+            # again at the start of the buffer
+            self.buffer = self.buffer[index:]
+            return False
+
+        line = self.buffer[index + 1 : end + 1]
+        self.buffer = self.buffer[end + 1 :]
+
+        if not line.rstrip().endswith(b"--"):
+            self.state = PART
+            return True
+
+        self.delimiters.pop()
+
+        if self.delimiters:
+            # Skip the epilogue of a nested multipart up to the next
+            # delimiter of its parent, as if it were a preamble
+            self.buffer = b"\n" + self.buffer
+            self.state = PREAMBLE
+        else:
+            self.stop()
+
+        return True
+
+    def count(self, data):
+        """Add body text to the size of the current part."""
+        if self.part is None or not data:
+            return
+
+        self.part["size"] += len(data) - data.count(b"\n") - data.count(b"\r")
+        self.part["tail"] = (self.part["tail"] + data.rstrip())[-2:]
+
+    def finish_part(self):
+        """Complete the size of the current part."""
+        part = self.part
+
+        if part is None:
+            return
+
+        if part["base64"]:
+            padding = part["tail"].count(b"=")
+            part["size"] = max(0, part["size"] * 3 // 4 - padding)
+
+        self.part = None
+
+    def stop(self):
+        """Stop scanning."""
+        self.finish_part()
+        self.state = DONE
+        self.buffer = b""
+
+    def manifest(self):
+        """Return the manifest, or None if the text is not an email."""
+        if not self.is_email:
+            return None
+
+        attachments = [
+            {
+                "filename": part["filename"],
+                "content_type": part["content_type"],
+                "size": part["size"],
+            }
+            for part in self.attachments
+        ]
+
+        return {"headers": self.headers, "attachments": attachments}
+
+
+class ScanningReader:
+    """Binary file-like object feeding what is read to a Scanner."""
+
+    def __init__(self, stream, scanner):
+        """Initialize ScanningReader instance."""
+        self.stream = stream
+        self.scanner = scanner
+
+    def read(self, size=-1):
+        """Read from the stream, scanning the data."""
+        data = self.stream.read(size)
+        self.scanner.feed(data)
+
+        return data
+
+
+def scan(chunks):
+    """Return the manifest of message text given as bytes chunks."""
+    scanner = Scanner()
+
+    for chunk in chunks:
+        scanner.feed(chunk)
+
+    return scanner.manifest()
+
+
+def scan_text(text, chunk_size=1024 * 1024):
+    """Return the manifest of message text given as str."""
+    return scan(
+        text[start : start + chunk_size].encode()
+        for start in range(0, len(text), chunk_size)
+    )
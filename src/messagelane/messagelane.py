@@ -29,30 +29,416 @@ Example:
 #
 ##########################################################################
 
+import binascii
+import codecs
+import collections
 import hashlib
+import json
+import os
+import select
+import time
+import uuid
+
 import sqlalchemy as sa
 
-from .models import Lane, Message
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import defer
+
+from .models import Attachment, Consumer, Lane, LaneStats, Message, MessageHeader
+from .models import Payload, Reservation, WorkItem, WorkQueue
+from .models import notify_channel
+from . import compression, manifest, partitions
+
+
+class LaneCache:
+    """Process wide cache of lane names to lane ids.
+
+    Entries are dropped when a lane is created or deleted through this
+    process, and expire after ttl seconds to pick up changes made by
+    other processes. A ttl of zero disables the cache.
+    """
+
+    def __init__(self, ttl):
+        """Initialize LaneCache instance."""
+        self.ttl = ttl
+        self.entries = {}
+
+    def get(self, key, name):
+        """Return the cached lane id or None."""
+        entry = self.entries.get((key, name))
+
+        if entry is None:
+            return None
+
+        lane_id, expires = entry
+
+        if time.monotonic() >= expires:
+            self.entries.pop((key, name), None)
+            return None
+
+        return lane_id
+
+    def set(self, key, name, lane_id):
+        """Cache a lane id."""
+        if self.ttl > 0:
+            self.entries[(key, name)] = (lane_id, time.monotonic() + self.ttl)
+
+    def invalidate(self, key, name):
+        """Drop a cached lane id."""
+        self.entries.pop((key, name), None)
+
+    def clear(self):
+        """Drop all cached lane ids."""
+        self.entries.clear()
+
+
+lane_cache = LaneCache(float(os.environ.get("MESSAGELANE_LANE_CACHE_TTL", "60")))
+
+# Payload compression defaults, see compression.py
+
+DEFAULT_CODEC = os.environ.get("MESSAGELANE_CODEC", compression.NONE)
+DEFAULT_LEVEL = os.environ.get("MESSAGELANE_CODEC_LEVEL")
+
+# Store payloads once in the shared payload table, see share_payloads()
+
+DEFAULT_DEDUP = os.environ.get("MESSAGELANE_DEDUP", "").lower() in ("1", "true", "yes")
+
+# Files at least this large are streamed instead of read into memory
+
+STREAM_SIZE = int(os.environ.get("MESSAGELANE_STREAM_SIZE", 8 * 1024 * 1024))
+CHUNK_SIZE = 1024 * 1024
+
+# Limits on the files read into one batch by post_messages_from_files()
+
+BATCH_FILES = 1000
+BATCH_BYTES = 32 * 1024 * 1024
+
+# Keys per query in the set-based lookups
+
+LOOKUP_CHUNK = 10000
+
+
+def committed_position():
+    """Return an expression for the committed position of Lane."""
+    reserved = (
+        sa.select(sa.func.min(Reservation.first_position) - 1)
+        .where(Reservation.lane_id == Lane.lane_id)
+        .where(Reservation.expires > sa.func.now())
+        .scalar_subquery()
+    )
+
+    return sa.func.least(Lane.marker, reserved)
+
+
+class ChunkReader:
+    """File-like object reading from an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        """Initialize ChunkReader instance."""
+        self.chunks = iter(chunks)
+
+    def read(self, size=-1):
+        """Return the next chunk, or b"" at the end."""
+        return next(self.chunks, b"")
+
+
+def copy_in(connection, sql, chunks):
+    """Run a COPY FROM STDIN statement, sending the chunks as its data."""
+    cursor = connection.connection.dbapi_connection.cursor()
+
+    try:
+        if hasattr(cursor, "copy"):
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                for chunk in chunks:
+                    copy.write(chunk)
+        else:
+            # psycopg2
+            cursor.copy_expert(sql, ChunkReader(chunks))
+    finally:
+        cursor.close()
+
+
+def like_pattern(pattern):
+    """Return a LIKE pattern (escaped with backslash) for a glob pattern."""
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    return escaped.replace("*", "%").replace("?", "_")
+
+
+def copy_out(connection, sql, output):
+    """Run a COPY TO STDOUT statement, writing its data to output.
+
+    Returns the number of rows copied.
+    """
+    cursor = connection.connection.dbapi_connection.cursor()
+
+    try:
+        if hasattr(cursor, "copy"):
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                for chunk in copy:
+                    output.write(bytes(chunk))
+        else:
+            # psycopg2
+            cursor.copy_expert(sql, output)
+
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+class CompressedWriter:
+    """File-like object compressing what is written to another file."""
+
+    def __init__(self, output, codec, level=None):
+        """Initialize CompressedWriter instance."""
+        self.output = output
+        self.packer = compression.compressor(codec, level)
+
+    def write(self, data):
+        """Compress and write data."""
+        self.output.write(self.packer.compress(bytes(data)))
+
+    def flush(self):
+        """Write the end of the compressed data."""
+        self.output.write(self.packer.flush())
+
+
+# Lane archives, see export_messages(). The columns are copied in the
+# PostgreSQL binary COPY format with these types.
+
+ARCHIVE_FORMAT = "messagelane-lane"
+ARCHIVE_VERSION = 1
+
+ARCHIVE_COLUMNS = [
+    ("lane_position", sa.BigInteger()),
+    ("message_uuid", sa.Uuid()),
+    ("ts", sa.TIMESTAMP(timezone=True)),
+    ("payload", sa.Text()),
+    ("payload_data", sa.LargeBinary()),
+    ("payload_codec", sa.Text()),
+    ("payload_binary", sa.Boolean()),
+    ("payload_hash", sa.LargeBinary()),
+    ("payload_size", sa.BigInteger()),
+    ("stored_size", sa.BigInteger()),
+]
+
+
+class LaneListener:
+    """Wait for messages to be posted to a set of lanes.
+
+    The listener holds its own autocommit connection, subscribed to the
+    notification channels of the lanes, for as long as it is open.
+    """
+
+    def __init__(self, engine, lanes):
+        """Initialize LaneListener instance."""
+        self.engine = engine
+        self.lanes = lanes
+        self.connection = None
+
+    def __enter__(self):
+        """Open the connection and start listening."""
+        self.connection = self.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        )
+
+        for lane_id in self.lanes.values():
+            self.connection.exec_driver_sql(f'LISTEN "{notify_channel(lane_id)}"')
+
+        return self
+
+    def __exit__(self, *args):
+        """Stop listening and close the connection."""
+        self.connection.exec_driver_sql("UNLISTEN *")
+        self.connection.close()
+        self.connection = None
+
+    def positions(self):
+        """Return the committed position of each lane."""
+        stmt = sa.select(Lane.name, committed_position()).where(
+            Lane.lane_id.in_(self.lanes.values())
+        )
+
+        return dict(self.connection.execute(stmt).all())
+
+    def poll(self, timeout=None):
+        """Wait up to timeout seconds for a notification.
+
+        Returns True if any notifications arrived.
+        """
+        dbapi_connection = self.connection.connection.driver_connection
+
+        if hasattr(dbapi_connection, "poll"):
+            # psycopg2
+            if not dbapi_connection.notifies:
+                ready, _, _ = select.select([dbapi_connection], [], [], timeout)
+                if ready:
+                    dbapi_connection.poll()
+            notifies = bool(dbapi_connection.notifies)
+            dbapi_connection.notifies.clear()
+        else:
+            # psycopg 3
+            notifies = any(
+                dbapi_connection.notifies(timeout=timeout, stop_after=1)
+            )
+
+        return notifies
+
+    def wait_for_messages(self, after_positions=None, timeout=None):
+        """Wait for messages past the given positions.
+
+        The after_positions map lane names to the last position seen. Lanes
+        that are missing start from their current position. Returns the
+        committed positions of the lanes that have advanced, which is
+        empty if the timeout expires first.
+        """
+        positions = self.positions()
+
+        if after_positions is None:
+            after_positions = {}
+
+        after_positions = {
+            name: position if after_positions.get(name) is None
+            else after_positions[name]
+            for name, position in positions.items()
+        }
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            advanced = {
+                name: position
+                for name, position in positions.items()
+                if position > after_positions[name]
+            }
+
+            if advanced:
+                return advanced
+
+            remaining = None
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {}
+
+            if self.poll(remaining):
+                positions = self.positions()
 
 
 class MessageLane:
     """The MessageLane API."""
 
-    def __init__(self, session):
-        """Initialize MessageLane instance."""
+    def __init__(self, session, codec=None, level=None, dedup=None):
+        """Initialize MessageLane instance.
+
+        Posted payloads are compressed with codec at level, by default
+        MESSAGELANE_CODEC (none) and MESSAGELANE_CODEC_LEVEL. With dedup
+        True (default MESSAGELANE_DEDUP) they are stored in the shared
+        payload table.
+        """
         self.session = session
+        self.codec = codec or DEFAULT_CODEC
+        self.level = level if level is not None else DEFAULT_LEVEL
+        self.dedup = DEFAULT_DEDUP if dedup is None else dedup
+
+        if self.level is not None:
+            self.level = int(self.level)
+
+    @property
+    def cache_key(self):
+        """Return the key identifying this database in the lane cache."""
+        return str(self.session.get_bind().url)
 
     def has_lane(self, name):
         """Test if lane exists."""
-        return self.get_lane(name) is not None
+        return self.get_lane_id(name) is not None
+
+    def get_lane_id(self, name):
+        """Return the id of the lane matching name, or None."""
+        lane_id = lane_cache.get(self.cache_key, name)
+
+        if lane_id is None:
+            stmt = sa.select(Lane.lane_id).where(Lane.name == name)
+            lane_id = self.session.scalar(stmt)
+
+            if lane_id is not None:
+                lane_cache.set(self.cache_key, name, lane_id)
+
+        return lane_id
 
     def get_lane(self, name):
         """Return lane entry matching name."""
         stmt = sa.select(Lane).where(Lane.name == name)
         return self.session.scalar(stmt)
 
-    def overview(self):
-        """Return messagelane summary overview."""
+    def has_lane_stats(self):
+        """Test if the database has the lane_stats table.
+
+        Older databases need msglane db upgrade before overview() without
+        exact or status() can be used.
+        """
+        stmt = sa.select(sa.func.to_regclass(LaneStats.__tablename__).is_not(None))
+        return self.session.scalar(stmt)
+
+    def overview(self, exact=False):
+        """Return messagelane summary overview.
+
+        The counts and sizes are read from the lane_stats table and the
+        position and time ranges from index lookups, so the cost grows
+        with the number of lanes rather than messages. With exact True the
+        summary is aggregated from the message table instead.
+        """
+        if exact:
+            return self.overview_exact()
+
+        stats = (
+            sa.select(
+                LaneStats.lane_id,
+                sa.cast(sa.func.sum(LaneStats.count), sa.BigInteger).label("count"),
+                sa.cast(sa.func.sum(LaneStats.size), sa.BigInteger).label("size"),
+                sa.cast(sa.func.sum(LaneStats.stored), sa.BigInteger).label("stored"),
+            )
+            .group_by(LaneStats.lane_id)
+            .subquery()
+        )
+
+        def lookup(func, column):
+            return (
+                sa.select(func(column))
+                .where(Message.lane_id == Lane.lane_id)
+                .scalar_subquery()
+            )
+
+        count = sa.func.coalesce(stats.c.count, 0)
+
+        stmt = (
+            sa.select(
+                Lane.name,
+                sa.func.coalesce(lookup(sa.func.min, Message.lane_position), 0).label(
+                    "min_position"
+                ),
+                sa.func.coalesce(lookup(sa.func.max, Message.lane_position), 0).label(
+                    "max_position"
+                ),
+                count.label("count"),
+                lookup(sa.func.min, Message.ts).label("min_ts"),
+                lookup(sa.func.max, Message.ts).label("max_ts"),
+                sa.case((count == 0, None), else_=stats.c.size).label("size"),
+                sa.case((count == 0, None), else_=stats.c.stored).label(
+                    "stored_size"
+                ),
+            )
+            .outerjoin(stats, stats.c.lane_id == Lane.lane_id)
+            .order_by(Lane.name)
+        )
+
+        return [row._mapping for row in self.session.execute(stmt)]
+
+    def overview_exact(self):
+        """Return messagelane summary overview from the message table."""
         messages = sa.select(Message).lateral()
 
         stmt = (
@@ -67,7 +453,10 @@ class MessageLane:
                 sa.func.count(messages.c.lane_position).label("count"),
                 sa.func.min(messages.c.ts).label("min_ts"),
                 sa.func.max(messages.c.ts).label("max_ts"),
-                sa.func.sum(messages.c.payload_size).label("size")
+                sa.func.sum(messages.c.payload_size).label("size"),
+                sa.func.sum(
+                    sa.func.coalesce(messages.c.stored_size, messages.c.payload_size)
+                ).label("stored_size"),
             )
             .outerjoin(messages)
             .group_by(Lane.lane_id)
@@ -76,56 +465,96 @@ class MessageLane:
 
         return [row._mapping for row in self.session.execute(stmt)]
 
-    def status(self):
-        """Return messagelane database status."""
-
-        engine = self.session.bind
-        dbname = engine.url.database
-
-        dbsize_sql = sa.text("SELECT pg_database_size(:name)")
+    def status(self, exact=False):
+        """Return messagelane database status.
+
+        The sizes of the database, tables and indexes are collected in a
+        single catalog query. Table row counts are the planner estimates
+        from the last ANALYZE (None if never analyzed) unless exact is
+        True, in which case the tables are counted in one more query.
+        """
+        catalog_sql = sa.text(
+            "WITH db AS ("
+            "  SELECT current_database() AS name,"
+            "         pg_database_size(current_database()) AS size,"
+            "         (SELECT sum(size)::bigint FROM lane_stats) AS payload,"
+            "         (SELECT sum(stored)::bigint FROM lane_stats) AS stored"
+            ") "
+            "SELECT db.name AS dbname, db.size AS dbsize,"
+            "       db.payload, db.stored,"
+            "       c.relname AS name, c.relkind AS kind,"
+            "       coalesce(t.relname, c.relname) AS tablename,"
+            "       pg_total_relation_size(c.oid) AS size,"
+            "       c.reltuples AS rows "
+            "FROM db, pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "LEFT JOIN pg_index i ON i.indexrelid = c.oid "
+            "LEFT JOIN pg_class t ON t.oid = i.indrelid "
+            "WHERE n.nspname = current_schema() "
+            "AND c.relkind IN ('r', 'p', 'i') "
+            "ORDER BY tablename, c.relkind DESC, name"
+        )
 
-        dbsize = self.session.scalar(dbsize_sql, {"name": dbname})
+        results = self.session.execute(catalog_sql).all()
 
-        table_size_sql = sa.text("SELECT pg_total_relation_size(:name)")
+        database = {}
+        payload = {}
+        table_results = {}
+        index_sizes = {}
 
-        tables = ["lane", "message"]
+        for row in results:
+            database = {"name": row.dbname, "size": row.dbsize}
+            payload = {"size": row.payload, "stored": row.stored}
 
-        table_results = {}
+            if row.kind == "i":
+                index_sizes.setdefault(row.tablename, {})[row.name] = row.size
+            else:
+                rows = int(row.rows) if row.rows >= 0 else None
+                table_results[row.name] = {"size": row.size, "rows": rows}
 
-        for name in tables:
+        if exact and table_results:
             # We can only pass values as parameters, not table names.
             # So dynamically create sql here
-            table_rows_sql = sa.text(f"SELECT count(*) from {name}")
-
-            size = self.session.scalar(table_size_sql, {"name": name})
-            rows = self.session.scalar(table_rows_sql)
-            table_results[name] = { "size": size, "rows": rows } 
-
-        indexes_sql = sa.text(
-                        "select tablename, indexname from pg_indexes "
-                        "where schemaname = 'public' "
-                        "order by tablename, indexname"
-                    )
-
-        indexes = self.session.execute(indexes_sql).all()
+            quote = self.session.get_bind().dialect.identifier_preparer.quote
+            counts = ", ".join(
+                f"(SELECT count(*) FROM {quote(name)})" for name in table_results
+            )
 
-        index_sizes = {}
+            rows = self.session.execute(sa.text(f"SELECT {counts}")).one()
 
-        for tablename, indexname in indexes:
-            if not tablename in index_sizes:
-                index_sizes[tablename] = {}
-            size = self.session.scalar(table_size_sql, {"name": indexname})
-            index_sizes[tablename][indexname] = size
+            for name, count in zip(table_results, rows):
+                table_results[name]["rows"] = count
 
         return {
-            "database": {
-                "name": dbname,
-                "size": dbsize
-            },
+            "database": database,
+            "payload": payload,
             "table": table_results,
             "index": index_sizes,
         }
 
+    def rebuild_lane_stats(self):
+        """Recompute the lane_stats table from the message table.
+
+        Posts and deletes wait until the rebuild commits.
+        """
+        self.session.execute(sa.text("LOCK TABLE lane_stats IN EXCLUSIVE MODE"))
+
+        self.session.execute(sa.delete(LaneStats))
+
+        select = sa.select(
+            Message.lane_id,
+            sa.func.count(),
+            sa.func.sum(Message.payload_size),
+            sa.func.sum(sa.func.coalesce(Message.stored_size, Message.payload_size)),
+        ).group_by(Message.lane_id)
+
+        stmt = sa.insert(LaneStats).from_select(
+            ["lane_id", "count", "size", "stored"], select
+        )
+
+        # Core execution, the ORM result does not report the rowcount
+        return self.session.connection().execute(stmt).rowcount
+
     # Lane commands ----------------------------------------------------
 
     def list_lanes(self):
@@ -134,11 +563,15 @@ class MessageLane:
 
     def create_lane(self, name):
         """Create a new lane."""
+        lane_cache.invalidate(self.cache_key, name)
+
         lane = Lane(name=name)
         self.session.add(lane)
 
     def del_lane(self, name):
         """Delete a lane."""
+        lane_cache.invalidate(self.cache_key, name)
+
         stmt = sa.select(Lane).where(Lane.name == name)
         lane = self.session.scalar(stmt)
 
@@ -148,15 +581,27 @@ class MessageLane:
 
     # Messages commands --------------------------------------------------
 
-    def list_messages(self, name):
-        """List messages in a lane."""
+    def list_messages(self, name, payload=False, batch_size=1000):
+        """List messages in a lane.
+
+        The messages are streamed from a server side cursor in batches of
+        batch_size, so the result must be consumed while the session is
+        open. Unless payload is True, the payload columns are deferred and
+        only loaded for messages where they are accessed.
+        """
         stmt = (
             sa.select(Message)
             .join(Message.lane)
             .where(Lane.name == name)
             .order_by(Message.lane_position)
+            .execution_options(yield_per=batch_size)
         )
 
+        if not payload:
+            stmt = stmt.options(
+                defer(Message.payload_text), defer(Message.payload_data)
+            )
+
         return self.session.scalars(stmt)
 
     def list_messages_after_ts(self, name, ts):
@@ -171,39 +616,300 @@ class MessageLane:
             .order_by(Message.lane_position)
         )
 
-        return self.session.scalars(stmt)
+        return self.session.execute(stmt)
 
     def del_messages(self, name_pattern, ts):
-        """Delete messages from lanes since ts."""
+        """Delete messages from lanes up to ts, returning the count.
+
+        On a partitioned message table, when the pattern covers every
+        lane, partitions entirely at or before ts are dropped and only
+        the remaining rows are deleted.
+        """
         lane_ids = sa.select(Lane.lane_id).where(Lane.name.like(name_pattern))
 
+        removed = 0
+
+        if self.is_partitioned() and self.covers_all_lanes(name_pattern):
+            removed += partitions.drop_partitions(self.session.connection(), ts)
+
         stmt = (
             sa.delete(Message)
             .where(Message.lane_id.in_(lane_ids))
             .where(Message.ts <= ts)
         )
 
-        return self.session.execute(stmt)
+        removed += self.session.execute(stmt).rowcount
+
+        return removed
+
+    def is_partitioned(self):
+        """Return True if the message table is partitioned."""
+        return partitions.is_partitioned(self.session.connection())
+
+    def covers_all_lanes(self, name_pattern):
+        """Return True if the name pattern matches every lane."""
+        stmt = sa.select(sa.func.count()).where(sa.not_(Lane.name.like(name_pattern)))
+
+        return self.session.scalar(stmt) == 0
+
+    # Manifest commands --------------------------------------------------
+
+    def add_manifest(self, name, position, entries):
+        """Record the manifest of a message, replacing any existing."""
+        lane_id = self.get_lane_id(name)
+
+        message_id = self.session.execute(
+            sa.select(Message.message_id)
+            .where(Message.lane_id == lane_id)
+            .where(Message.lane_position == position)
+        ).scalar_one()
+
+        for model in (Attachment, MessageHeader):
+            self.session.execute(sa.delete(model).where(model.message_id == message_id))
+
+        if entries is None:
+            return
+
+        keys = {"message_id": message_id, "lane_id": lane_id}
+
+        if entries["attachments"]:
+            self.session.execute(
+                sa.insert(Attachment),
+                [{**keys, **attachment} for attachment in entries["attachments"]],
+            )
+
+        if entries["headers"]:
+            self.session.execute(
+                sa.insert(MessageHeader),
+                [
+                    {**keys, "name": header, "value": value}
+                    for header, value in entries["headers"]
+                ],
+            )
+
+    def get_manifest(self, name, position):
+        """Return the recorded headers and attachments of a message."""
+        message_id = (
+            sa.select(Message.message_id)
+            .where(Message.lane_id == self.get_lane_id(name))
+            .where(Message.lane_position == position)
+            .scalar_subquery()
+        )
+
+        headers = self.session.execute(
+            sa.select(MessageHeader.name, MessageHeader.value)
+            .where(MessageHeader.message_id == message_id)
+            .order_by(MessageHeader.message_header_id)
+        ).all()
+
+        attachments = self.session.scalars(
+            sa.select(Attachment)
+            .where(Attachment.message_id == message_id)
+            .order_by(Attachment.attachment_id)
+        ).all()
+
+        return {"headers": headers, "attachments": attachments}
+
+    def find_messages(
+        self,
+        name,
+        filename=None,
+        content_type=None,
+        header=None,
+        since=None,
+        until=None,
+    ):
+        """Return the messages of a lane matching their manifest.
+
+        filename and content_type are glob patterns (* and ?) matched
+        against the attachments, and header a dict of header names and
+        value patterns. Messages must match every criterion given, and
+        fall between since and until when they are given. The payload
+        columns are deferred.
+        """
+        lane_id = self.get_lane_id(name)
+
+        stmt = (
+            sa.select(Message)
+            .where(Message.lane_id == lane_id)
+            .order_by(Message.lane_position)
+            .options(defer(Message.payload_text), defer(Message.payload_data))
+        )
+
+        if filename is not None or content_type is not None:
+            match = (
+                sa.select(Attachment.attachment_id)
+                .where(Attachment.message_id == Message.message_id)
+                .where(Attachment.lane_id == lane_id)
+            )
+            if filename is not None:
+                match = match.where(
+                    Attachment.filename.like(like_pattern(filename), escape="\\")
+                )
+            if content_type is not None:
+                pattern = like_pattern(content_type)
+                match = match.where(Attachment.content_type.like(pattern, escape="\\"))
+            stmt = stmt.where(match.exists())
+
+        for header_name, value in (header or {}).items():
+            match = (
+                sa.select(MessageHeader.message_header_id)
+                .where(MessageHeader.message_id == Message.message_id)
+                .where(MessageHeader.lane_id == lane_id)
+                .where(MessageHeader.name == header_name.lower())
+                .where(MessageHeader.value.like(like_pattern(value), escape="\\"))
+            )
+            stmt = stmt.where(match.exists())
+
+        if since is not None:
+            stmt = stmt.where(Message.ts >= since)
+
+        if until is not None:
+            stmt = stmt.where(Message.ts <= until)
+
+        return self.session.scalars(stmt)
+
+    def index_messages(self, name, after_position=0):
+        """Record the manifests of the messages already in a lane.
+
+        Each message payload is streamed through the manifest scanner,
+        replacing any manifest it has. Yields the position of each
+        message and whether it is an email with a manifest.
+        """
+        lane_id = self.get_lane_id(name)
+
+        stmt = (
+            sa.select(Message.lane_position)
+            .where(Message.lane_id == lane_id)
+            .where(Message.lane_position > after_position)
+            .order_by(Message.lane_position)
+        )
+
+        for position in self.session.scalars(stmt).all():
+            scanner = manifest.Scanner()
+
+            for chunk in self.iter_message_bytes(name, position):
+                scanner.feed(chunk)
+                if scanner.state == manifest.DONE:
+                    break
+
+            entries = scanner.manifest()
+            self.add_manifest(name, position, entries)
+
+            yield position, entries is not None
 
     # Single message commands --------------------------------------------
 
-    def get_message(self, name, position):
-        """Return a message from a lane."""
-        lane = self.get_lane(name)
+    def get_message(self, name, position, payload=True):
+        """Return a message from a lane.
+
+        Unless payload is True, the payload columns are deferred.
+        """
+        lane_id = self.get_lane_id(name)
         stmt = (
             sa.select(Message)
             .where(Message.lane_position == position)
-            .where(Message.lane == lane)
+            .where(Message.lane_id == lane_id)
         )
 
+        if not payload:
+            stmt = stmt.options(
+                defer(Message.payload_text), defer(Message.payload_data)
+            )
+
         return self.session.scalar(stmt)
 
+    def get_message_bytes(self, name, position):
+        """Return the payload of a message from a lane as bytes."""
+        message = self.get_message(name, position)
+
+        return message.payload_bytes if message is not None else None
+
+    def iter_message_bytes(self, name, position, chunk_size=CHUNK_SIZE):
+        """Yield the payload of a message from a lane in chunks of bytes.
+
+        The payload is read in slices of chunk_size and decompressed as
+        it goes, so memory use does not grow with the payload size.
+        Payloads no larger than chunk_size are read in one go. Rows written
+        before db upgrade set the payload columns to EXTERNAL storage may
+        be compressed by the database, which then loads them in full to
+        read each slice.
+        """
+        lane_id = self.get_lane_id(name)
+
+        where = sa.and_(Message.lane_id == lane_id, Message.lane_position == position)
+
+        stmt = sa.select(
+            Message.payload_shared,
+            Message.payload_hash,
+            sa.func.coalesce(Message.stored_size, Message.payload_size),
+        ).where(where)
+        row = self.session.execute(stmt).one_or_none()
+
+        if row is None:
+            return
+
+        shared, payload_hash, stored_size = row
+
+        if shared:
+            source = Payload
+            where = Payload.payload_hash == payload_hash
+        else:
+            source = Message
+
+        if stored_size <= chunk_size:
+            stmt = sa.select(
+                source.payload_codec, source.payload_text, source.payload_data
+            ).where(where)
+            codec, text, data = self.session.execute(stmt).one()
+
+            if data is None:
+                yield text.encode()
+            elif codec:
+                yield compression.decompress(data, codec)
+            else:
+                yield data
+
+            return
+
+        stmt = sa.select(source.payload_codec, source.payload_data.is_(None)).where(
+            where
+        )
+
+        codec, is_text = self.session.execute(stmt).one()
+
+        column = source.payload_text if is_text else source.payload_data
+        unpacker = compression.decompressor(codec) if codec else None
+
+        offset = 1
+
+        while True:
+            stmt = sa.select(sa.func.substring(column, offset, chunk_size)).where(where)
+            chunk = self.session.scalar(stmt)
+
+            if not chunk:
+                return
+
+            offset += len(chunk)
+            last = len(chunk) < chunk_size
+
+            if is_text:
+                chunk = chunk.encode()
+
+            if unpacker:
+                chunk = unpacker.decompress(chunk)
+
+            yield chunk
+
+            if last:
+                return
+
     def first_message(self, name):
         """Return the first message from a lane."""
-        lane = self.get_lane(name)
+        lane_id = self.get_lane_id(name)
         stmt = (
             sa.select(Message)
-            .where(Message.lane == lane)
+            .where(Message.lane_id == lane_id)
             .order_by(Message.lane_position)
             .limit(1)
         )
@@ -212,113 +918,1540 @@ class MessageLane:
 
     def next_message(self, name, position):
         """Return the next message from a lane."""
-        lane = self.get_lane(name)
+        lane_id = self.get_lane_id(name)
         stmt = (
             sa.select(Message)
-            .where(Message.lane == lane)
+            .where(Message.lane_id == lane_id)
             .where(Message.lane_position > position)
+            .order_by(Message.lane_position)
             .limit(1)
         )
 
         return self.session.scalar(stmt)
 
-    def post_message_from_email(self, name, email, **kw):
-        """Post a new message from a file to a lane."""
-        return self.post_message(name, email.as_string(), **kw)
+    def get_messages(self, name, first_position, last_position):
+        """Return the messages from a lane between positions."""
+        lane_id = self.get_lane_id(name)
+        stmt = (
+            sa.select(Message)
+            .where(Message.lane_id == lane_id)
+            .where(Message.lane_position >= first_position)
+            .where(Message.lane_position <= last_position)
+            .order_by(Message.lane_position)
+        )
 
-    def post_message_from_file(self, name, filename, **kw):
-        """Post a new message from a file to a lane."""
-        with open(filename, "r", encoding="utf8") as f:
-            payload = f.read()
+        return self.session.scalars(stmt).all()
+
+    def iter_messages(self, name, after_position=0, batch_size=1000, payload=True):
+        """Iterate over the messages in a lane after a position.
+
+        Messages are read in pages of batch_size with keyset queries on
+        (lane_id, lane_position), so each page is a single index range
+        scan regardless of how far into the lane it is. With payload
+        False, lightweight rows of message metadata are yielded instead
+        of Message objects.
+        """
+        lane_id = self.get_lane_id(name)
+
+        if lane_id is None:
+            return
+
+        if payload:
+            stmt = sa.select(Message)
+        else:
+            stmt = sa.select(
+                Message.lane_position,
+                Message.ts,
+                Message.message_uuid,
+                Message.payload_size,
+                Message.payload_hash,
+            )
 
-        return self.post_message(name, payload, **kw)
+        stmt = (
+            stmt.where(Message.lane_id == lane_id)
+            .order_by(Message.lane_position)
+            .limit(batch_size)
+        )
 
-    def post_message(self, name, payload, ts=None, message_uuid=None):
-        """Post a message to a lane."""
-        payload_hash = hashlib.md5(payload.encode()).digest()
+        position = after_position
 
-        return_args = [
-            Lane.lane_id,
-            Lane.marker,
-            sa.cast(payload, sa.String).label("payload"),
-            sa.cast(payload_hash, sa.LargeBinary).label("hash"),
-            sa.cast(len(payload), sa.Integer).label("payload_size")
-        ]
+        while True:
+            page = stmt.where(Message.lane_position > position)
 
-        cols = [
-            "lane_id", 
-            "lane_position", 
-            "payload", 
-            "payload_hash", 
-            "payload_size"
-        ]
+            if payload:
+                rows = self.session.scalars(page).all()
+            else:
+                rows = self.session.execute(page).all()
 
-        if ts:
-            return_args.append(sa.cast(ts, sa.TIMESTAMP(timezone=True)).label("ts"))
-            cols.append("ts")
+            yield from rows
 
-        if message_uuid:
-            return_args.append(sa.cast(message_uuid, sa.Uuid).label("message_uuid"))
-            cols.append("message_uuid")
+            if len(rows) < batch_size:
+                return
 
-        cte = (
-            sa.update(Lane)
-            .where(Lane.name == name)
-            .values(marker=Lane.marker + 1)
-            .returning(*return_args)
-            .cte()
-        )
+            position = rows[-1].lane_position
 
-        stmt = sa.insert(Message).from_select(cols, cte).returning(Message.message_uuid)
+    def post_message_from_email(self, name, email, **kw):
+        """Post a new message from an email message to a lane.
+
+        The email may also be a binary file-like object reading a message,
+        such as DataMessage.open(), which is streamed. The attachment
+        manifest is recorded from the headers as the text is posted.
+        """
+        if hasattr(email, "read"):
+            scanner = manifest.Scanner()
+            message_uuid = self.post_message_from_stream(
+                name, manifest.ScanningReader(email, scanner), binary=False, **kw
+            )
+            entries = scanner.manifest()
+        else:
+            text = email.as_string()
+            message_uuid = self.post_message(name, text, **kw)
+            entries = manifest.scan_text(text)
+
+        if message_uuid is not None:
+            # The same uuid may be in other lanes, or posted to this one
+            # before, so take the latest position it has in the lane
+            position = self.session.scalar(
+                sa.select(sa.func.max(Message.lane_position))
+                .where(Message.lane_id == self.get_lane_id(name))
+                .where(Message.message_uuid == message_uuid)
+            )
+            self.add_manifest(name, position, entries)
 
-        return self.session.scalar(stmt)
+        return message_uuid
 
-    def del_message(self, name, position):
-        """Delete a message from a lane at a given position."""
-        lane = self.get_lane(name)
+    def post_message_from_file(self, name, filename, binary=False, **kw):
+        """Post a new message from a file to a lane.
 
-        stmt = (
-            sa.delete(Message)
-            .where(Message.lane == lane)
-            .where(Message.lane_position == position)
-        )
+        Files of at least MESSAGELANE_STREAM_SIZE bytes are streamed.
+        """
+        if os.path.getsize(filename) >= STREAM_SIZE:
+            with open(filename, "rb") as f:
+                return self.post_message_from_stream(name, f, binary=binary, **kw)
 
-        self.session.execute(stmt)
+        if binary:
+            with open(filename, "rb") as f:
+                payload = f.read()
+        else:
+            with open(filename, "r", encoding="utf8") as f:
+                payload = f.read()
 
-    def del_message_range(self, name, first_position, last_position):
-        """Delete a message from a lane between positions."""
-        lane = self.get_lane(name)
+        return self.post_message(name, payload, **kw)
 
-        stmt = (
-            sa.delete(Message)
-            .where(Message.lane == lane)
-            .where(Message.lane_position >= first_position)
-            .where(Message.lane_position <= last_position)
-        )
+    def post_messages_from_files(self, name, filenames, binary=False, **kw):
+        """Post new messages from a list of files to a lane.
+
+        Files are posted in batches of up to BATCH_FILES files and
+        BATCH_BYTES bytes, except that files of at least
+        MESSAGELANE_STREAM_SIZE bytes are streamed one at a time, and so
+        are not deduplicated.
+        """
+        results = []
+        payloads = []
+        batch_bytes = 0
+
+        def flush():
+            nonlocal payloads, batch_bytes
+            results.extend(self.post_messages(name, payloads, **kw))
+            payloads = []
+            batch_bytes = 0
+
+        for filename in filenames:
+            size = os.path.getsize(filename)
+
+            if size >= STREAM_SIZE:
+                flush()
+                with open(filename, "rb") as f:
+                    results.append(
+                        self.post_message_from_stream(name, f, binary=binary, **kw)
+                    )
+                continue
 
-        self.session.execute(stmt)
+            if len(payloads) >= BATCH_FILES or batch_bytes + size > BATCH_BYTES:
+                flush()
 
-    def get_message_from_uuid(self, message_uuid):
-        """Return message with matching uuid."""
-        stmt = sa.select(Message).where(Message.message_uuid == message_uuid)
+            if binary:
+                with open(filename, "rb") as f:
+                    payloads.append(f.read())
+            else:
+                with open(filename, "r", encoding="utf8") as f:
+                    payloads.append(f.read())
 
-        return self.session.scalar(stmt)
+            batch_bytes += size
 
-    def has_message_uuid(self, message_uuid):
-        """Check if message with uuid is in database."""
-        return self.get_message_from_uuid(message_uuid) is not None
+        flush()
 
-    def get_message_from_hash(self, ts, payload_hash):
-        """Return message with matching timestamp and payload hash."""
-        stmt = (
-            sa.select(Message)
-            .where(Message.payload_hash == payload_hash)
-            .where(Message.ts == ts)
-        )
+        return results
 
-        return self.session.scalar(stmt)
+    def post_message_from_stream(
+        self,
+        name,
+        stream,
+        binary=True,
+        ts=None,
+        message_uuid=None,
+        chunk_size=CHUNK_SIZE,
+    ):
+        """Post a message read in chunks from a binary file object.
 
-    def has_message_hash(self, ts, payload_hash):
+        The payload is hashed, compressed and sent to the database with
+        COPY as it is read, so memory use does not grow with its size.
+        With binary False the stream must hold UTF-8 text. Unlike
+        post_messages(), the payload is kept compressed even when that
+        does not make it smaller. The lane is only locked once the
+        payload has been received. Streamed payloads are always stored in
+        the message row and are not deduplicated, even with dedup set.
+
+        Returns the message uuid.
+        """
+        codec = None if self.codec == compression.NONE else self.codec
+
+        packer = compression.compressor(codec, self.level) if codec else None
+        decoder = None if binary else codecs.getincrementaldecoder("utf-8")()
+        md5 = hashlib.md5()
+        sizes = {"payload": 0, "stored": 0}
+
+        def chunks():
+            # bytea hex format, with the backslash escaped for COPY
+            yield b"\\\\x"
+
+            while True:
+                data = stream.read(chunk_size)
+
+                if not data:
+                    break
+
+                md5.update(data)
+
+                if decoder:
+                    sizes["payload"] += len(decoder.decode(data))
+                else:
+                    sizes["payload"] += len(data)
+
+                if packer:
+                    data = packer.compress(data)
+
+                sizes["stored"] += len(data)
+                yield binascii.hexlify(data)
+
+            if decoder:
+                decoder.decode(b"", final=True)
+
+            if packer:
+                data = packer.flush()
+                sizes["stored"] += len(data)
+                yield binascii.hexlify(data)
+
+            yield b"\n"
+
+        self.session.execute(
+            sa.text(
+                "CREATE TEMP TABLE IF NOT EXISTS messagelane_upload "
+                "(payload_data BYTEA) ON COMMIT DROP"
+            )
+        )
+
+        connection = self.session.connection()
+        copy_in(connection, "COPY messagelane_upload FROM STDIN", chunks())
+
+        upload_table = sa.table(
+            "messagelane_upload", sa.column("payload_data", sa.LargeBinary)
+        )
+
+        upload = (
+            sa.delete(upload_table).returning(upload_table.c.payload_data).cte("upload")
+        )
+
+        lane = self.allocate_positions(name, 1)
+
+        select = sa.select(
+            lane.c.lane_id,
+            lane.c.base + 1,
+            upload.c.payload_data,
+            sa.literal(codec, sa.String),
+            sa.literal(binary),
+            sa.literal(md5.digest(), sa.LargeBinary),
+            sa.literal(sizes["payload"]),
+            sa.literal(sizes["stored"]),
+            sa.func.coalesce(
+                sa.literal(ts, sa.TIMESTAMP(timezone=True)), sa.func.now()
+            ),
+            sa.func.coalesce(
+                sa.literal(message_uuid, sa.Uuid), sa.func.gen_random_uuid()
+            ),
+        ).select_from(lane.join(upload, sa.true()))
+
+        cols = [
+            "lane_id",
+            "lane_position",
+            "payload_data",
+            "payload_codec",
+            "payload_binary",
+            "payload_hash",
+            "payload_size",
+            "stored_size",
+            "ts",
+            "message_uuid",
+        ]
+
+        stmt = (
+            sa.insert(Message)
+            .from_select(cols, select)
+            .returning(Message.message_uuid)
+        )
+
+        return self.session.scalar(stmt)
+
+    def post_message(self, name, payload, ts=None, message_uuid=None):
+        """Post a message to a lane."""
+        results = self.post_messages(
+            name, [payload], timestamps=[ts], message_uuids=[message_uuid]
+        )
+
+        return results[0] if results else None
+
+    def post_message_bytes(self, name, data, **kw):
+        """Post a binary message to a lane."""
+        return self.post_message(name, bytes(data), **kw)
+
+    def post_messages(
+        self, name, payloads, timestamps=None, message_uuids=None, reservation=None
+    ):
+        """Post a batch of messages to a lane.
+
+        The lane marker is advanced once by the number of payloads and all
+        of the messages are inserted in a single statement, taking
+        consecutive lane positions in the order given. Payloads given as
+        bytes are stored as binary messages, str as text. The optional
+        timestamps and message_uuids are sequences parallel to payloads,
+        where a None entry selects the database default.
+
+        If a reservation from reserve_positions() is given, the messages
+        take the reserved positions instead and the lane row is not
+        locked. The number of payloads must match the reserved block, so
+        the positions stay dense. The reservation is consumed by the post,
+        and ValueError is raised if it is missing, used or expired.
+
+        Returns a list of message uuids in lane position order.
+        """
+        payloads = list(payloads)
+        count = len(payloads)
+
+        if not count:
+            return []
+
+        if timestamps is None:
+            timestamps = [None] * count
+
+        if message_uuids is None:
+            message_uuids = [None] * count
+
+        timestamps = list(timestamps)
+        message_uuids = list(message_uuids)
+
+        if len(timestamps) != count or len(message_uuids) != count:
+            raise ValueError("timestamps and message_uuids must match payloads")
+
+        if reservation is not None:
+            self.check_reservation(name, count, reservation)
+
+        binary = [isinstance(payload, bytes) for payload in payloads]
+        raw = [
+            payload if is_binary else payload.encode()
+            for payload, is_binary in zip(payloads, binary)
+        ]
+        hashes = [hashlib.md5(data).digest() for data in raw]
+
+        if self.dedup:
+            # Take the payload references only once the post is sure to
+            # insert the messages. The lane is locked against deletion, and
+            # a reservation was already locked by check_reservation().
+            if reservation is None and not self.lock_lane(name):
+                return []
+            stored = self.share_payloads(payloads, hashes)
+            texts = blobs = payload_codecs = [None] * count
+            stored_sizes = [stored[payload_hash] for payload_hash in hashes]
+        else:
+            encoded = [
+                compression.encode(payload, self.codec, self.level)
+                for payload in payloads
+            ]
+            texts, blobs, payload_codecs = zip(*encoded)
+            stored_sizes = [
+                len(data) if data is not None else len(text.encode())
+                for text, data, _ in encoded
+            ]
+
+        shared = [self.dedup] * count
+
+        # Pass each column as a single array parameter and expand them
+        # server side, so the statement size does not grow with the batch.
+
+        rows = sa.func.unnest(
+            sa.bindparam("payloads", list(texts), type_=ARRAY(sa.String)),
+            sa.bindparam("payload_data", list(blobs), type_=ARRAY(sa.LargeBinary)),
+            sa.bindparam(
+                "payload_codecs", list(payload_codecs), type_=ARRAY(sa.String)
+            ),
+            sa.bindparam("payload_binary", binary, type_=ARRAY(sa.Boolean)),
+            sa.bindparam("payload_shared", shared, type_=ARRAY(sa.Boolean)),
+            sa.bindparam("hashes", hashes, type_=ARRAY(sa.LargeBinary)),
+            sa.bindparam(
+                "sizes",
+                [len(payload) for payload in payloads],
+                type_=ARRAY(sa.Integer),
+            ),
+            sa.bindparam("stored_sizes", stored_sizes, type_=ARRAY(sa.Integer)),
+            sa.bindparam(
+                "timestamps", timestamps, type_=ARRAY(sa.TIMESTAMP(timezone=True))
+            ),
+            sa.bindparam("message_uuids", message_uuids, type_=ARRAY(sa.Uuid)),
+        ).table_valued(
+            "payload",
+            "payload_data",
+            "payload_codec",
+            "payload_binary",
+            "payload_shared",
+            "payload_hash",
+            "payload_size",
+            "stored_size",
+            "ts",
+            "message_uuid",
+            with_ordinality="ordinal",
+        ).render_derived()
+
+        lane = self.allocate_positions(name, count, reservation)
+
+        select = sa.select(
+            lane.c.lane_id,
+            lane.c.base + rows.c.ordinal,
+            rows.c.payload,
+            rows.c.payload_data,
+            rows.c.payload_codec,
+            rows.c.payload_binary,
+            rows.c.payload_shared,
+            rows.c.payload_hash,
+            rows.c.payload_size,
+            rows.c.stored_size,
+            sa.func.coalesce(rows.c.ts, sa.func.now()),
+            sa.func.coalesce(rows.c.message_uuid, sa.func.gen_random_uuid()),
+        ).select_from(lane.join(rows, sa.true()))
+
+        cols = [
+            "lane_id",
+            "lane_position",
+            "payload",
+            "payload_data",
+            "payload_codec",
+            "payload_binary",
+            "payload_shared",
+            "payload_hash",
+            "payload_size",
+            "stored_size",
+            "ts",
+            "message_uuid",
+        ]
+
+        stmt = (
+            sa.insert(Message)
+            .from_select(cols, select)
+            .returning(Message.lane_position, Message.message_uuid)
+        )
+
+        results = self.session.execute(stmt).all()
+
+        if reservation is not None and len(results) != count:
+            raise ValueError("The reservation has expired")
+
+        return [message_uuid for _, message_uuid in sorted(results)]
+
+    def lock_lane(self, name):
+        """Lock a lane against deletion, returning its lane_id or None."""
+        stmt = (
+            sa.select(Lane.lane_id)
+            .where(Lane.name == name)
+            .with_for_update(key_share=True)
+        )
+
+        return self.session.scalar(stmt)
+
+    def check_reservation(self, name, count, reservation):
+        """Lock a reservation of a lane for a post of count messages.
+
+        Raises ValueError if count does not fill the reserved block, or
+        the reservation is missing, used or expired. Expiry is checked
+        against the clock rather than the transaction start.
+        """
+        size = reservation.last_position - reservation.first_position + 1
+
+        if count != size:
+            raise ValueError(f"{count} payloads for {size} reserved positions")
+
+        stmt = (
+            sa.select(Reservation.expires > sa.func.clock_timestamp())
+            .join(Reservation.lane)
+            .where(Reservation.reservation_id == reservation.reservation_id)
+            .where(Lane.name == name)
+            .with_for_update(of=Reservation)
+        )
+
+        valid = self.session.scalar(stmt)
+
+        if valid is None:
+            raise ValueError("The reservation does not exist")
+
+        if not valid:
+            raise ValueError("The reservation has expired")
+
+    def post_message_to_lanes(self, names, payload, ts=None):
+        """Post a message to several lanes in a single statement.
+
+        names is a list of lane names or a LIKE pattern. The payload is
+        hashed and compressed once, the lanes are locked in lane_id order
+        so concurrent fan-outs do not deadlock, each lane marker is
+        advanced in one UPDATE and the copies are inserted with one
+        INSERT ... SELECT. Each copy has its own message uuid.
+
+        Raises ValueError, posting nothing, if a lane in a list of names
+        does not exist. Returns a dict of the new message uuid by lane
+        name.
+        """
+        if isinstance(names, str):
+            match = Lane.name.like(names)
+        else:
+            match = Lane.name.in_(list(names))
+
+        binary = isinstance(payload, bytes)
+        payload_hash = hashlib.md5(payload if binary else payload.encode()).digest()
+
+        locked = (
+            sa.select(Lane.lane_id, Lane.name)
+            .where(match)
+            .order_by(Lane.lane_id)
+            .with_for_update()
+            .cte("locked")
+        )
+
+        lane = (
+            sa.update(Lane)
+            .where(Lane.lane_id == locked.c.lane_id)
+            .values(marker=Lane.marker + 1)
+            .returning(Lane.lane_id, Lane.marker.label("position"))
+            .cte("lane")
+        )
+
+        # Lock the lanes first, so a missing one fails the post before
+        # anything is written and share_payloads takes one reference per lane
+        found = self.session.scalars(sa.select(locked.c.name)).all()
+
+        if not isinstance(names, str):
+            missing = sorted(set(names) - set(found))
+            if missing:
+                raise ValueError(f"Lanes do not exist: {', '.join(missing)}")
+
+        if not found:
+            return {}
+
+        if self.dedup:
+            count = len(found)
+            stored = self.share_payloads([payload] * count, [payload_hash] * count)
+            text = data = codec = None
+            stored_size = stored[payload_hash]
+        else:
+            text, data, codec = compression.encode(payload, self.codec, self.level)
+            stored_size = len(data) if data is not None else len(text.encode())
+
+        select = sa.select(
+            lane.c.lane_id,
+            lane.c.position,
+            sa.bindparam("payload", text, type_=sa.String),
+            sa.bindparam("payload_data", data, type_=sa.LargeBinary),
+            sa.bindparam("payload_codec", codec, type_=sa.String),
+            sa.bindparam("payload_binary", binary, type_=sa.Boolean),
+            sa.bindparam("payload_shared", self.dedup, type_=sa.Boolean),
+            sa.bindparam("payload_hash", payload_hash, type_=sa.LargeBinary),
+            sa.bindparam("payload_size", len(payload), type_=sa.Integer),
+            sa.bindparam("stored_size", stored_size, type_=sa.Integer),
+            sa.func.coalesce(
+                sa.bindparam("ts", ts, type_=sa.TIMESTAMP(timezone=True)),
+                sa.func.now(),
+            ),
+            sa.func.gen_random_uuid(),
+        )
+
+        cols = [
+            "lane_id",
+            "lane_position",
+            "payload",
+            "payload_data",
+            "payload_codec",
+            "payload_binary",
+            "payload_shared",
+            "payload_hash",
+            "payload_size",
+            "stored_size",
+            "ts",
+            "message_uuid",
+        ]
+
+        posted = (
+            sa.insert(Message)
+            .from_select(cols, select)
+            .returning(Message.lane_id, Message.message_uuid)
+            .cte("posted")
+        )
+
+        stmt = sa.select(locked.c.name, posted.c.message_uuid).join(
+            posted, posted.c.lane_id == locked.c.lane_id
+        )
+
+        return dict(self.session.execute(stmt).all())
+
+    def share_payloads(self, payloads, hashes):
+        """Take references to shared payloads, storing the new ones.
+
+        Payloads already in the payload table only have their refcount
+        raised and are not sent again. Rows are locked in hash order so
+        concurrent posts do not deadlock. Returns the stored size of
+        each payload by hash.
+        """
+        counts = collections.Counter(hashes)
+        unique = sorted(counts)
+
+        lock = (
+            sa.select(Payload.payload_hash)
+            .where(Payload.payload_hash.in_(unique))
+            .order_by(Payload.payload_hash)
+            .with_for_update()
+        )
+
+        self.session.execute(lock)
+
+        refs = (
+            sa.func.unnest(
+                sa.bindparam("ref_hashes", unique, type_=ARRAY(sa.LargeBinary)),
+                sa.bindparam(
+                    "ref_counts",
+                    [counts[payload_hash] for payload_hash in unique],
+                    type_=ARRAY(sa.BigInteger),
+                ),
+            )
+            .table_valued("payload_hash", "refs")
+            .render_derived()
+        )
+
+        stmt = (
+            sa.update(Payload)
+            .where(Payload.payload_hash == refs.c.payload_hash)
+            .values(refcount=Payload.refcount + refs.c.refs)
+            .returning(Payload.payload_hash, Payload.stored_size)
+        )
+
+        stored = dict(self.session.execute(stmt).all())
+
+        missing = [
+            payload_hash for payload_hash in unique if payload_hash not in stored
+        ]
+
+        if not missing:
+            return stored
+
+        first = {}
+
+        for payload, payload_hash in zip(payloads, hashes):
+            first.setdefault(payload_hash, payload)
+
+        values = []
+
+        for payload_hash in missing:
+            payload = first[payload_hash]
+            text, data, codec = compression.encode(payload, self.codec, self.level)
+            values.append(
+                {
+                    "payload_hash": payload_hash,
+                    "payload": text,
+                    "payload_data": data,
+                    "payload_codec": codec,
+                    "payload_binary": isinstance(payload, bytes),
+                    "payload_size": len(payload),
+                    "stored_size": (
+                        len(data) if data is not None else len(text.encode())
+                    ),
+                    "refcount": counts[payload_hash],
+                }
+            )
+
+        stmt = insert(Payload).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Payload.payload_hash],
+            set_={"refcount": Payload.refcount + stmt.excluded.refcount},
+        ).returning(Payload.payload_hash, Payload.stored_size)
+
+        stored.update(self.session.execute(stmt).all())
+
+        return stored
+
+    def allocate_positions(self, name, count, reservation=None):
+        """Return a CTE allocating count positions in a lane.
+
+        The CTE yields the lane_id and the base position, one before the
+        first allocated position. Without a reservation the lane marker
+        is advanced, locking the lane row, otherwise the reservation,
+        checked with check_reservation(), is consumed.
+        """
+        if reservation is None:
+            return (
+                sa.update(Lane)
+                .where(Lane.name == name)
+                .values(marker=Lane.marker + count)
+                .returning(Lane.lane_id, (Lane.marker - count).label("base"))
+                .cte()
+            )
+
+        lane_id = sa.select(Lane.lane_id).where(Lane.name == name)
+
+        return (
+            sa.delete(Reservation)
+            .where(Reservation.reservation_id == reservation.reservation_id)
+            .where(Reservation.lane_id == lane_id.scalar_subquery())
+            .where(Reservation.expires > sa.func.clock_timestamp())
+            .returning(
+                Reservation.lane_id,
+                (Reservation.first_position - 1).label("base"),
+            )
+            .cte()
+        )
+
+    # Transfer commands --------------------------------------------------
+
+    def export_messages(
+        self, name, output, since=None, after_position=0, codec=None, level=None
+    ):
+        """Write the messages of a lane to a binary file as an archive.
+
+        The archive is a JSON header line followed by the messages after
+        after_position (and at or after since) in PostgreSQL binary COPY
+        format, compressed with codec if given. Payloads are copied as
+        stored, shared payloads included, without recompressing them.
+
+        Returns the number of messages written.
+        """
+        if codec == compression.NONE:
+            codec = None
+
+        def source(attr):
+            return sa.case(
+                (Message.payload_shared, getattr(Payload, attr)),
+                else_=getattr(Message, attr),
+            )
+
+        exprs = [
+            Message.lane_position,
+            Message.message_uuid,
+            Message.ts,
+            source("payload_text"),
+            source("payload_data"),
+            source("payload_codec"),
+            source("payload_binary"),
+            Message.payload_hash,
+            Message.payload_size,
+            source("stored_size"),
+        ]
+
+        stmt = (
+            sa.select(
+                *[
+                    sa.cast(expr, sqltype).label(column)
+                    for expr, (column, sqltype) in zip(exprs, ARCHIVE_COLUMNS)
+                ]
+            )
+            .select_from(Message)
+            .outerjoin(
+                Payload,
+                sa.and_(
+                    Message.payload_shared,
+                    Payload.payload_hash == Message.payload_hash,
+                ),
+            )
+            .where(Message.lane_id == self.get_lane_id(name))
+            .where(Message.lane_position > after_position)
+            .order_by(Message.lane_position)
+        )
+
+        if since is not None:
+            stmt = stmt.where(Message.ts >= since)
+
+        connection = self.session.connection()
+        query = stmt.compile(connection, compile_kwargs={"literal_binds": True})
+
+        header = {
+            "format": ARCHIVE_FORMAT,
+            "version": ARCHIVE_VERSION,
+            "lane": name,
+            "codec": codec or compression.NONE,
+            "columns": [column for column, _ in ARCHIVE_COLUMNS],
+        }
+
+        output.write(json.dumps(header).encode() + b"\n")
+
+        writer = CompressedWriter(output, codec, level) if codec else output
+
+        count = copy_out(
+            connection, f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", writer
+        )
+
+        if codec:
+            writer.flush()
+
+        return count
+
+    def import_messages(self, stream, name=None, chunk_size=CHUNK_SIZE):
+        """Load the messages of an archive from a binary file into a lane.
+
+        The messages keep their uuid, timestamp and payload and are given
+        new positions at the end of the lane, in their archived order.
+        Messages with a uuid already in the database are skipped. The
+        lane defaults to the one exported and is created if missing.
+
+        Returns the lane name and the number of messages imported and
+        skipped.
+        """
+        try:
+            header = json.loads(stream.readline())
+        except ValueError:
+            header = {}
+
+        if (
+            not isinstance(header, dict)
+            or header.get("format") != ARCHIVE_FORMAT
+            or header.get("version") != ARCHIVE_VERSION
+        ):
+            raise ValueError("Not a MessageLane lane archive")
+
+        name = name or header["lane"]
+        codec = header["codec"]
+        unpacker = None
+
+        if codec != compression.NONE:
+            unpacker = compression.decompressor(codec)
+
+        def chunks():
+            while True:
+                data = stream.read(chunk_size)
+
+                if not data:
+                    break
+
+                yield unpacker.decompress(data) if unpacker else data
+
+            if hasattr(unpacker, "flush"):
+                yield unpacker.flush()
+
+        if not self.has_lane(name):
+            self.create_lane(name)
+            self.session.flush()
+
+        connection = self.session.connection()
+        dialect = connection.dialect
+
+        columns = ", ".join(
+            f"{column} {sqltype.compile(dialect=dialect)}"
+            for column, sqltype in ARCHIVE_COLUMNS
+        )
+
+        self.session.execute(
+            sa.text(
+                "CREATE TEMP TABLE IF NOT EXISTS messagelane_import "
+                f"({columns}) ON COMMIT DROP"
+            )
+        )
+
+        copy_in(
+            connection,
+            "COPY messagelane_import FROM STDIN WITH (FORMAT binary)",
+            chunks(),
+        )
+
+        # Skip messages already present, or repeated in the archive
+
+        skipped = self.session.execute(
+            sa.text(
+                "DELETE FROM messagelane_import i USING message m "
+                "WHERE m.message_uuid = i.message_uuid"
+            )
+        ).rowcount
+
+        skipped += self.session.execute(
+            sa.text(
+                "DELETE FROM messagelane_import a USING messagelane_import b "
+                "WHERE a.message_uuid = b.message_uuid AND a.ctid > b.ctid"
+            )
+        ).rowcount
+
+        count = self.session.scalar(sa.text("SELECT count(*) FROM messagelane_import"))
+
+        if not count:
+            return name, 0, skipped
+
+        import_table = sa.table(
+            "messagelane_import",
+            *[sa.column(column, sqltype) for column, sqltype in ARCHIVE_COLUMNS],
+        )
+
+        upload = sa.delete(import_table).returning(*import_table.c).cte("upload")
+        lane = self.allocate_positions(name, count)
+
+        position = sa.func.row_number().over(order_by=upload.c.lane_position)
+
+        select = sa.select(
+            lane.c.lane_id,
+            lane.c.base + position,
+            *[upload.c[column] for column, _ in ARCHIVE_COLUMNS[1:]],
+        ).select_from(lane.join(upload, sa.true()))
+
+        cols = ["lane_id", *[column for column, _ in ARCHIVE_COLUMNS]]
+
+        self.session.execute(sa.insert(Message).from_select(cols, select))
+
+        return name, count, skipped
+
+    # Compression commands -----------------------------------------------
+
+    def recompress_messages(
+        self, name, batch_size=1000, after_position=0, max_bytes=64 * 1024 * 1024
+    ):
+        """Recompress the payloads of a lane with the current codec.
+
+        The lane is rewritten in batches of up to batch_size messages and
+        max_bytes of payloads (or a single larger one), yielding the last
+        position and number of messages changed after each batch so the
+        caller can commit between them. Messages already stored with the
+        codec are skipped and the lane statistics are adjusted for the
+        change in stored size. Also used to fill in the stored size of
+        messages posted before compression was added. Shared payloads are
+        left as they are.
+        """
+        lane_id = self.get_lane_id(name)
+
+        if lane_id is None:
+            return
+
+        codec = None if self.codec == compression.NONE else self.codec
+
+        batch = (
+            sa.select(
+                Message.message_id,
+                sa.func.sum(Message.payload_size)
+                .over(order_by=Message.lane_position)
+                .label("total"),
+            )
+            .where(Message.lane_id == lane_id)
+            .where(Message.lane_position > sa.bindparam("position"))
+            .where(~Message.payload_shared)
+            .where(
+                sa.or_(
+                    Message.payload_codec.is_distinct_from(codec),
+                    Message.stored_size.is_(None),
+                )
+            )
+            .order_by(Message.lane_position)
+            .limit(batch_size)
+            .subquery()
+        )
+
+        stmt = (
+            sa.select(
+                Message.message_id,
+                Message.lane_position,
+                Message.payload_text,
+                Message.payload_data,
+                Message.payload_codec,
+                Message.payload_binary,
+                Message.payload_size,
+                Message.stored_size,
+            )
+            .join(batch, Message.message_id == batch.c.message_id)
+            .where(batch.c.total - Message.payload_size < max_bytes)
+            .order_by(Message.lane_position)
+        )
+
+        position = after_position
+
+        while True:
+            rows = self.session.execute(stmt, {"position": position}).all()
+
+            if not rows:
+                return
+
+            updates = []
+            stored_delta = 0
+
+            for row in rows:
+                payload = compression.decode(
+                    row.payload_text,
+                    row.payload_data,
+                    row.payload_codec,
+                    row.payload_binary,
+                )
+
+                text, data, new_codec = compression.encode(payload, codec, self.level)
+
+                stored_size = len(data) if data is not None else len(text.encode())
+
+                if new_codec == row.payload_codec and stored_size == row.stored_size:
+                    continue
+
+                stored_delta += stored_size - (row.stored_size or row.payload_size)
+
+                updates.append(
+                    {
+                        "message_id": row.message_id,
+                        "payload_text": text,
+                        "payload_data": data,
+                        "payload_codec": new_codec,
+                        "stored_size": stored_size,
+                    }
+                )
+
+            if updates:
+                # Bulk update by primary key, which loads no objects
+                self.session.execute(sa.update(Message), updates)
+                self.session.execute(
+                    sa.select(
+                        sa.func.messagelane_stats_add(lane_id, 0, 0, stored_delta)
+                    )
+                )
+
+            position = rows[-1].lane_position
+
+            yield position, len(updates)
+
+    # Notification commands ----------------------------------------------
+
+    def listen(self, lanes):
+        """Return a listener for messages posted to lanes."""
+        stmt = sa.select(Lane.name, Lane.lane_id).where(Lane.name.in_(lanes))
+
+        lanes = dict(self.session.execute(stmt).all())
+
+        return LaneListener(self.session.get_bind(), lanes)
+
+    def wait_for_messages(self, lanes, after_positions=None, timeout=None):
+        """Block until new messages are posted to any of the lanes.
+
+        The after_positions are a sequence parallel to lanes, or a map of
+        lane names, giving the last position already seen. Lanes without
+        one wait for messages after their current position. Returns a map
+        of the lanes that advanced to their new committed positions, or an
+        empty map if the timeout (in seconds) expires first.
+        """
+        if isinstance(lanes, str):
+            lanes = [lanes]
+
+        if after_positions is not None and not isinstance(after_positions, dict):
+            after_positions = dict(zip(lanes, after_positions))
+
+        with self.listen(lanes) as listener:
+            return listener.wait_for_messages(after_positions, timeout)
+
+    # Position reservation ---------------------------------------------
+
+    def reserve_positions(self, name, count, lease=60):
+        """Reserve a block of positions in a lane for a later post.
+
+        The lane marker is advanced in a separate, immediately committed
+        transaction, so the lane row is only locked for that one statement
+        rather than for the whole of the caller's transaction. Pass the
+        result to post_messages() to fill the block. A reservation that is
+        neither posted nor released within lease seconds expires, and its
+        positions are left as a gap.
+
+        Returns the reservation, or None if the lane does not exist.
+        """
+        lane = (
+            sa.update(Lane)
+            .where(Lane.name == name)
+            .values(marker=Lane.marker + count)
+            .returning(Lane.lane_id, Lane.marker)
+            .cte()
+        )
+
+        select = sa.select(
+            lane.c.lane_id,
+            lane.c.marker - count + 1,
+            lane.c.marker,
+            sa.func.now() + sa.func.make_interval(0, 0, 0, 0, 0, 0, lease),
+        )
+
+        stmt = (
+            sa.insert(Reservation)
+            .from_select(
+                ["lane_id", "first_position", "last_position", "expires"], select
+            )
+            .returning(
+                Reservation.reservation_id,
+                Reservation.lane_id,
+                Reservation.first_position,
+                Reservation.last_position,
+            )
+        )
+
+        with self.session.get_bind().begin() as conn:
+            return conn.execute(stmt).first()
+
+    def release_positions(self, reservation):
+        """Release an unused reservation, leaving its positions as a gap.
+
+        Any expired reservations left behind in the lane are removed too.
+        """
+        stmt = (
+            sa.delete(Reservation)
+            .where(Reservation.lane_id == reservation.lane_id)
+            .where(
+                (Reservation.reservation_id == reservation.reservation_id)
+                | (Reservation.expires <= sa.func.now())
+            )
+        )
+
+        with self.session.get_bind().begin() as conn:
+            conn.execute(stmt)
+
+    def committed_position(self, name):
+        """Return the highest position below which a lane is complete.
+
+        Every position up to this one is either visible or will never be
+        filled. Positions above it may still be committed by producers
+        holding a reservation, so readers that track their progress by
+        position should not advance past it.
+        """
+        stmt = sa.select(committed_position()).where(Lane.name == name)
+
+        return self.session.scalar(stmt)
+
+    # Consumer commands --------------------------------------------------
+
+    def list_consumers(self, name=None):
+        """List consumers, optionally only those of one lane."""
+        stmt = (
+            sa.select(Consumer)
+            .join(Consumer.lane)
+            .order_by(Lane.name, Consumer.name)
+        )
+
+        if name is not None:
+            stmt = stmt.where(Lane.name == name)
+
+        return self.session.scalars(stmt)
+
+    def get_consumer(self, name, consumer):
+        """Return the consumer of a lane."""
+        stmt = (
+            sa.select(Consumer)
+            .join(Consumer.lane)
+            .where(Lane.name == name)
+            .where(Consumer.name == consumer)
+        )
+
+        return self.session.scalar(stmt)
+
+    def subscribe(self, name, consumer, position=0):
+        """Subscribe a consumer to a lane.
+
+        A new consumer starts after the given position. Subscribing an
+        existing consumer leaves its offset unchanged.
+
+        Returns the consumer's current position.
+        """
+        select = sa.select(
+            Lane.lane_id,
+            sa.literal(consumer),
+            sa.literal(position, sa.BigInteger),
+        ).where(Lane.name == name)
+
+        stmt = (
+            insert(Consumer)
+            .from_select(["lane_id", "name", "position"], select)
+            .on_conflict_do_nothing(index_elements=["lane_id", "name"])
+        )
+
+        self.session.execute(stmt)
+
+        consumer = self.get_consumer(name, consumer)
+
+        return consumer.position if consumer else None
+
+    def unsubscribe(self, name, consumer):
+        """Remove a consumer from a lane."""
+        lane_id = sa.select(Lane.lane_id).where(Lane.name == name)
+
+        stmt = (
+            sa.delete(Consumer)
+            .where(Consumer.lane_id == lane_id.scalar_subquery())
+            .where(Consumer.name == consumer)
+        )
+
+        self.session.execute(stmt)
+
+    def fetch(self, name, consumer, max_messages=100, max_bytes=None):
+        """Return the next batch of messages for a consumer.
+
+        Messages after the consumer's stored offset are returned in
+        position order in a single query, up to max_messages and, if
+        given, until the payload sizes reach max_bytes. At least one
+        message is returned when any are available. The offset does not
+        move until the consumer acks.
+        """
+        offset = (
+            sa.select(
+                Consumer.lane_id,
+                Consumer.position,
+                committed_position().label("committed"),
+            )
+            .join(Consumer.lane)
+            .where(Lane.name == name)
+            .where(Consumer.name == consumer)
+            .cte()
+        )
+
+        return self.fetch_batch(offset, max_messages, max_bytes)
+
+    def fetch_after(self, name, position, max_messages=100, max_bytes=None):
+        """Return the next batch of messages in a lane after position.
+
+        The same as fetch(), for a reader that tracks its own position.
+        """
+        offset = (
+            sa.select(
+                Lane.lane_id,
+                sa.literal(position, sa.BigInteger).label("position"),
+                committed_position().label("committed"),
+            )
+            .where(Lane.name == name)
+            .cte()
+        )
+
+        return self.fetch_batch(offset, max_messages, max_bytes)
+
+    def fetch_batch(self, offset, max_messages, max_bytes):
+        """Return the batch of messages after an offset CTE position."""
+        batch = (
+            sa.select(
+                Message.message_id,
+                sa.func.sum(Message.payload_size)
+                .over(order_by=Message.lane_position)
+                .label("total"),
+            )
+            .join(offset, Message.lane_id == offset.c.lane_id)
+            .where(Message.lane_position > offset.c.position)
+            .where(Message.lane_position <= offset.c.committed)
+            .order_by(Message.lane_position)
+            .limit(max_messages)
+            .subquery()
+        )
+
+        stmt = (
+            sa.select(Message)
+            .join(batch, Message.message_id == batch.c.message_id)
+            .order_by(Message.lane_position)
+        )
+
+        if max_bytes is not None:
+            stmt = stmt.where(batch.c.total - Message.payload_size < max_bytes)
+
+        return self.session.scalars(stmt).all()
+
+    def ack(self, name, consumer, position):
+        """Advance a consumer's offset to position.
+
+        Offsets only move forward, so a late or repeated ack is harmless.
+
+        Returns the consumer's new position, or None if not subscribed.
+        """
+        lane_id = sa.select(Lane.lane_id).where(Lane.name == name)
+
+        stmt = (
+            sa.update(Consumer)
+            .where(Consumer.lane_id == lane_id.scalar_subquery())
+            .where(Consumer.name == consumer)
+            .values(position=sa.func.greatest(Consumer.position, position))
+            .returning(Consumer.position)
+        )
+
+        return self.session.scalar(stmt)
+
+    # Work queue commands ------------------------------------------------
+
+    def list_queues(self, name=None):
+        """List work queues with their pending and claimed item counts."""
+        claimed = WorkItem.expires > sa.func.now()
+
+        stmt = (
+            sa.select(
+                Lane.name.label("lane"),
+                WorkQueue.name,
+                sa.func.count(WorkItem.work_item_id).label("pending"),
+                sa.func.count(WorkItem.work_item_id).filter(claimed).label("claimed"),
+            )
+            .join(Lane, WorkQueue.lane_id == Lane.lane_id)
+            .outerjoin(WorkItem, WorkItem.work_queue_id == WorkQueue.work_queue_id)
+            .group_by(Lane.name, WorkQueue.name)
+            .order_by(Lane.name, WorkQueue.name)
+        )
+
+        if name is not None:
+            stmt = stmt.where(Lane.name == name)
+
+        return self.session.execute(stmt).all()
+
+    def create_queue(self, name, queue="default", position=0):
+        """Create a work queue on a lane.
+
+        Work items are added for the messages already in the lane after
+        position, and for each message posted from now on. Creating an
+        existing queue leaves it unchanged.
+
+        Returns the number of items added.
+        """
+        select = sa.select(Lane.lane_id, sa.literal(queue)).where(Lane.name == name)
+
+        stmt = (
+            insert(WorkQueue)
+            .from_select(["lane_id", "name"], select)
+            .on_conflict_do_nothing(index_elements=["lane_id", "name"])
+            .returning(WorkQueue.work_queue_id, WorkQueue.lane_id)
+            .cte()
+        )
+
+        backlog = sa.select(
+            stmt.c.work_queue_id, Message.message_id, Message.lane_position
+        ).join(stmt, Message.lane_id == stmt.c.lane_id).where(
+            Message.lane_position > position
+        )
+
+        stmt = sa.insert(WorkItem).from_select(
+            ["work_queue_id", "message_id", "lane_position"], backlog
+        )
+
+        return self.session.execute(stmt).rowcount
+
+    def del_queue(self, name, queue="default"):
+        """Remove a work queue and its items from a lane."""
+        lane_id = sa.select(Lane.lane_id).where(Lane.name == name)
+
+        stmt = (
+            sa.delete(WorkQueue)
+            .where(WorkQueue.lane_id == lane_id.scalar_subquery())
+            .where(WorkQueue.name == queue)
+        )
+
+        self.session.execute(stmt)
+
+    def work_queue_id(self, name, queue):
+        """Return a scalar subquery for the work_queue_id of a queue."""
+        return (
+            sa.select(WorkQueue.work_queue_id)
+            .join(Lane, WorkQueue.lane_id == Lane.lane_id)
+            .where(Lane.name == name)
+            .where(WorkQueue.name == queue)
+            .scalar_subquery()
+        )
+
+    def claim(self, name, worker, count=1, lease=60, queue="default"):
+        """Claim up to count messages from a work queue for a worker.
+
+        The oldest unclaimed items are leased to the worker for lease
+        seconds, skipping any rows other workers are claiming at the same
+        moment, so many workers can claim in parallel without waiting on
+        each other. Items with an expired lease are claimed again.
+
+        Returns the claimed messages in position order. Pass their
+        positions to complete() when done, or release() to give them up.
+        """
+        items = (
+            sa.select(WorkItem.work_item_id)
+            .where(WorkItem.work_queue_id == self.work_queue_id(name, queue))
+            .where(
+                sa.or_(WorkItem.expires.is_(None), WorkItem.expires <= sa.func.now())
+            )
+            .order_by(WorkItem.lane_position)
+            .limit(count)
+            .with_for_update(skip_locked=True)
+            .cte("items")
+        )
+
+        claimed = (
+            sa.update(WorkItem)
+            .where(WorkItem.work_item_id == items.c.work_item_id)
+            .values(
+                worker=worker,
+                expires=sa.func.now() + sa.func.make_interval(0, 0, 0, 0, 0, 0, lease),
+                attempts=WorkItem.attempts + 1,
+            )
+            .returning(WorkItem.message_id)
+            .cte("claimed")
+        )
+
+        stmt = (
+            sa.select(Message)
+            .join(claimed, Message.message_id == claimed.c.message_id)
+            .order_by(Message.lane_position)
+        )
+
+        return self.session.scalars(stmt).all()
+
+    def complete(self, name, worker, positions, queue="default"):
+        """Complete the work items a worker claimed at positions.
+
+        Items whose lease expired and were claimed by another worker are
+        left to that worker. Returns the number of items completed.
+        """
+        stmt = (
+            sa.delete(WorkItem)
+            .where(WorkItem.work_queue_id == self.work_queue_id(name, queue))
+            .where(WorkItem.lane_position.in_(list(positions)))
+            .where(WorkItem.worker == worker)
+        )
+
+        return self.session.execute(stmt).rowcount
+
+    def release(self, name, worker, positions, queue="default"):
+        """Return the work items a worker claimed at positions to the queue.
+
+        Returns the number of items released.
+        """
+        stmt = (
+            sa.update(WorkItem)
+            .where(WorkItem.work_queue_id == self.work_queue_id(name, queue))
+            .where(WorkItem.lane_position.in_(list(positions)))
+            .where(WorkItem.worker == worker)
+            .values(worker=None, expires=None)
+        )
+
+        return self.session.execute(stmt).rowcount
+
+    def del_message(self, name, position):
+        """Delete a message from a lane at a given position."""
+        lane_id = self.get_lane_id(name)
+
+        stmt = (
+            sa.delete(Message)
+            .where(Message.lane_id == lane_id)
+            .where(Message.lane_position == position)
+        )
+
+        self.session.execute(stmt)
+
+    def del_message_range(self, name, first_position, last_position):
+        """Delete a message from a lane between positions."""
+        lane_id = self.get_lane_id(name)
+
+        stmt = (
+            sa.delete(Message)
+            .where(Message.lane_id == lane_id)
+            .where(Message.lane_position >= first_position)
+            .where(Message.lane_position <= last_position)
+        )
+
+        self.session.execute(stmt)
+
+    def get_message_from_uuid(self, message_uuid):
+        """Return message with matching uuid."""
+        stmt = sa.select(Message).where(Message.message_uuid == message_uuid)
+
+        return self.session.scalar(stmt)
+
+    def has_message_uuid(self, message_uuid):
+        """Check if message with uuid is in database."""
+        stmt = sa.select(sa.exists().where(Message.message_uuid == message_uuid))
+
+        return self.session.scalar(stmt)
+
+    def has_messages(self, message_uuids, chunk_size=LOOKUP_CHUNK):
+        """Return the set of the uuids that are in the database.
+
+        The uuids (UUID or str) are looked up chunk_size at a time with
+        one query per chunk.
+        """
+        message_uuids = [
+            value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+            for value in message_uuids
+        ]
+
+        found = set()
+
+        for start in range(0, len(message_uuids), chunk_size):
+            chunk = message_uuids[start : start + chunk_size]
+            stmt = sa.select(Message.message_uuid).where(
+                Message.message_uuid
+                == sa.any_(sa.bindparam("uuids", chunk, type_=ARRAY(sa.Uuid)))
+            )
+            found.update(self.session.scalars(stmt))
+
+        return found
+
+    def get_message_from_hash(self, ts, payload_hash):
+        """Return message with matching timestamp and payload hash."""
+        stmt = (
+            sa.select(Message)
+            .where(Message.payload_hash == payload_hash)
+            .where(Message.ts == ts)
+        )
+
+        return self.session.scalar(stmt)
+
+    def has_message_hash(self, ts, payload_hash):
         """Check if message with timestamp and hash is in database."""
-        return self.get_message_from_hash(ts, payload_hash) is not None
+        stmt = sa.select(
+            sa.exists()
+            .where(Message.payload_hash == payload_hash)
+            .where(Message.ts == ts)
+        )
+
+        return self.session.scalar(stmt)
+
+    def find_hashes(self, keys, chunk_size=LOOKUP_CHUNK):
+        """Return the set of (ts, payload_hash) keys that are in the database.
+
+        The keys are looked up chunk_size at a time with one query per
+        chunk. Timestamps must be timezone aware to match.
+        """
+        keys = list(keys)
+        found = set()
+
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start : start + chunk_size]
+
+            wanted = (
+                sa.func.unnest(
+                    sa.bindparam(
+                        "timestamps",
+                        [ts for ts, _ in chunk],
+                        type_=ARRAY(sa.TIMESTAMP(timezone=True)),
+                    ),
+                    sa.bindparam(
+                        "hashes",
+                        [bytes(payload_hash) for _, payload_hash in chunk],
+                        type_=ARRAY(sa.LargeBinary),
+                    ),
+                )
+                .table_valued("ts", "payload_hash")
+                .render_derived()
+            )
+
+            stmt = (
+                sa.select(Message.ts, Message.payload_hash)
+                .join(
+                    wanted,
+                    sa.and_(
+                        Message.ts == wanted.c.ts,
+                        Message.payload_hash == wanted.c.payload_hash,
+                    ),
+                )
+                .distinct()
+            )
+
+            rows = self.session.execute(stmt)
+            found.update((ts, bytes(payload_hash)) for ts, payload_hash in rows)
+
+        return {key for key in keys if (key[0], bytes(key[1])) in found}
 
@@ -0,0 +1,348 @@
+"""MessageLane call metrics.
+
+When enabled, each public MessageLane method is wrapped to count its
+calls, errors and latency (as a histogram), and SQLAlchemy cursor events
+count the statements it issues, the rows they return or change and the
+time spent in them. The payload bytes of returned messages are counted
+too. Calls made from inside another MessageLane method are included in
+the outer call.
+
+Nothing is wrapped or listened to until enable() is called, so there is
+no overhead while metrics are disabled.
+
+Example:
+-------
+>>> from messagelane import metrics
+>>> metrics.enable()
+>>> msglane.status()
+>>> metrics.snapshot()["status"]["statements"]
+>>> metrics.write_textfile("/var/lib/node_exporter/messagelane.prom")
+
+"""
+
+##########################################################################
+#
+#   MessageLane call metrics
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import contextvars
+import functools
+import inspect
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .messagelane import MessageLane
+
+# Latency histogram bucket upper bounds in seconds
+
+BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+]
+
+COUNTERS = ["calls", "errors", "statements", "rows", "bytes"]
+
+current_call = contextvars.ContextVar("messagelane_call", default=None)
+
+
+class MethodMetrics:
+    """Totals for one MessageLane method."""
+
+    def __init__(self):
+        """Initialize MethodMetrics instance."""
+        self.calls = 0
+        self.errors = 0
+        self.statements = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.statement_seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def as_dict(self):
+        """Return the totals as a dict."""
+        return {
+            **{name: getattr(self, name) for name in COUNTERS},
+            "seconds": self.seconds,
+            "statement_seconds": self.statement_seconds,
+            "max_seconds": self.max_seconds,
+            "buckets": list(self.buckets),
+        }
+
+
+class Call:
+    """Statements counted during one method call."""
+
+    def __init__(self, name):
+        """Initialize Call instance."""
+        self.name = name
+        self.statements = 0
+        self.rows = 0
+        self.statement_seconds = 0.0
+
+
+class Registry:
+    """Thread safe collection of the method totals."""
+
+    def __init__(self):
+        """Initialize Registry instance."""
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def record(self, call, seconds, size, error):
+        """Add a finished call to the totals."""
+        with self.lock:
+            totals = self.methods.setdefault(call.name, MethodMetrics())
+            totals.calls += 1
+            totals.errors += error
+            totals.statements += call.statements
+            totals.rows += call.rows
+            totals.bytes += size
+            totals.seconds += seconds
+            totals.statement_seconds += call.statement_seconds
+            totals.max_seconds = max(totals.max_seconds, seconds)
+            totals.buckets[bucket_index(seconds)] += 1
+
+    def snapshot(self):
+        """Return the totals of each method as dicts."""
+        with self.lock:
+            return {name: totals.as_dict() for name, totals in self.methods.items()}
+
+    def reset(self):
+        """Clear the totals."""
+        with self.lock:
+            self.methods.clear()
+
+
+registry = Registry()
+
+# Original methods while enabled, by name
+
+originals = {}
+
+
+def bucket_index(seconds):
+    """Return the index of the histogram bucket for seconds."""
+    for index, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            return index
+
+    return len(BUCKETS)
+
+
+def payload_size(result):
+    """Return the payload bytes in a method result."""
+    if isinstance(result, (bytes, str)):
+        return len(result)
+
+    if isinstance(result, (list, tuple)):
+        return sum(payload_size(item) for item in result)
+
+    return getattr(result, "payload_size", None) or 0
+
+
+# SQLAlchemy cursor events -----------------------------------------------
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Note the start time of a statement issued inside a call."""
+    if current_call.get() is not None:
+        conn.info["messagelane_start"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Count a statement issued inside a call."""
+    call = current_call.get()
+    start = conn.info.pop("messagelane_start", None)
+
+    if call is None or start is None:
+        return
+
+    call.statements += 1
+    call.statement_seconds += time.perf_counter() - start
+
+    if cursor.rowcount > 0:
+        call.rows += cursor.rowcount
+
+
+# Method wrappers --------------------------------------------------------
+
+
+def traced_iterator(call, iterator, seconds):
+    """Yield from a method's iterator, timing each step as the call."""
+    size = 0
+    error = False
+
+    try:
+        while True:
+            token = current_call.set(call)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except BaseException:
+                error = True
+                raise
+            finally:
+                seconds += time.perf_counter() - start
+                current_call.reset(token)
+
+            size += payload_size(item)
+            yield item
+    finally:
+        iterator.close()
+        registry.record(call, seconds, size, error)
+
+
+def traced(method):
+    """Return method wrapped to record its metrics."""
+
+    @functools.wraps(method)
+    def wrapper(*args, **kw):
+        if current_call.get() is not None:
+            return method(*args, **kw)
+
+        call = Call(method.__name__)
+        token = current_call.set(call)
+        start = time.perf_counter()
+
+        try:
+            result = method(*args, **kw)
+        except BaseException:
+            registry.record(call, time.perf_counter() - start, 0, True)
+            raise
+        finally:
+            current_call.reset(token)
+
+        seconds = time.perf_counter() - start
+
+        if inspect.isgenerator(result):
+            return traced_iterator(call, result, seconds)
+
+        registry.record(call, seconds, payload_size(result), False)
+
+        return result
+
+    return wrapper
+
+
+def public_methods():
+    """Return the names of the public MessageLane methods."""
+    return [
+        name
+        for name, value in vars(MessageLane).items()
+        if inspect.isfunction(value) and not name.startswith("_")
+    ]
+
+
+def is_enabled():
+    """Return True if metrics are being recorded."""
+    return bool(originals)
+
+
+def enable():
+    """Start recording metrics for all MessageLane instances."""
+    if is_enabled():
+        return
+
+    for name in public_methods():
+        originals[name] = vars(MessageLane)[name]
+        setattr(MessageLane, name, traced(originals[name]))
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+
+def disable():
+    """Stop recording metrics, keeping the totals."""
+    if not is_enabled():
+        return
+
+    event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+    event.remove(Engine, "after_cursor_execute", after_cursor_execute)
+
+    for name, method in originals.items():
+        setattr(MessageLane, name, method)
+
+    originals.clear()
+
+
+def snapshot():
+    """Return the metrics of each method as dicts."""
+    return registry.snapshot()
+
+
+def reset():
+    """Clear the recorded metrics."""
+    registry.reset()
+
+
+# Prometheus export ------------------------------------------------------
+
+
+def format_prometheus(metrics=None, prefix="messagelane"):
+    """Return the metrics in the Prometheus text exposition format."""
+    if metrics is None:
+        metrics = snapshot()
+
+    lines = []
+
+    def family(name, kind, text):
+        lines.append(f"# HELP {prefix}_{name} {text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+    def sample(name, method, value, extra=""):
+        lines.append(f'{prefix}_{name}{{method="{method}"{extra}}} {value}')
+
+    families = [
+        ("calls_total", "calls", "MessageLane method calls"),
+        ("errors_total", "errors", "MessageLane method calls raising an error"),
+        ("statements_total", "statements", "SQL statements issued by method calls"),
+        ("rows_total", "rows", "Rows returned or changed by the statements"),
+        ("bytes_total", "bytes", "Payload bytes returned by method calls"),
+        ("statement_seconds_total", "statement_seconds", "Time spent in statements"),
+    ]
+
+    for name, key, text in families:
+        family(name, "counter", text)
+        for method, values in sorted(metrics.items()):
+            sample(name, method, values[key])
+
+    family("call_seconds", "histogram", "MessageLane method call latency")
+
+    for method, values in sorted(metrics.items()):
+        count = 0
+        for bound, hits in zip([*BUCKETS, "+Inf"], values["buckets"]):
+            count += hits
+            sample("call_seconds_bucket", method, count, f',le="{bound}"')
+        sample("call_seconds_sum", method, values["seconds"])
+        sample("call_seconds_count", method, values["calls"])
+
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, metrics=None):
+    """Write the metrics to a Prometheus node exporter text file.
+
+    The file is replaced atomically so the exporter never reads a
+    partial file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, prefix=".messagelane-", suffix=".tmp", delete=False
+    ) as output:
+        output.write(format_prometheus(metrics))
+
+    os.chmod(output.name, 0o644)
+    os.replace(output.name, path)
@@ -18,27 +18,142 @@
 import datetime
 import uuid
 
+from typing import Optional
+
 from sqlalchemy import ForeignKey, BigInteger, DateTime, Uuid
-from sqlalchemy import Index, func, FetchedValue, text, MetaData
+from sqlalchemy import Index, func, FetchedValue, text, MetaData, false
+from sqlalchemy import UniqueConstraint, DDL, event, Table
 
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.orm import DeclarativeBase
 
-from .db import engine
+from . import compression, db, partitions
 
 # --------------------------------------------------------------------------
 #   Helper functions and types
 # --------------------------------------------------------------------------
 
 
-def create_all():
-    """Create all tables."""
-    Model.metadata.create_all(engine)
+def create_all(bind=None, partition=None):
+    """Create all tables.
+
+    With partition set to "daily" or "weekly", the message table is
+    created partitioned by ts, along with a default partition and a week
+    of partitions ahead.
+    """
+    if bind is None:
+        bind = db.get_engine()
+
+    if partition is None:
+        Model.metadata.create_all(bind)
+        return
+
+    with bind.begin() as conn:
+        Model.metadata.create_all(conn, tables=[Lane.__table__])
+
+        metadata = MetaData(naming_convention=Model.metadata.naming_convention)
+        Lane.__table__.to_metadata(metadata)
+        partitioned_message_table(metadata).create(conn)
+
+        Model.metadata.create_all(conn)
+
+        partitions.create_default_partition(conn)
+        partitions.create_partitions(conn, partition)
 
 
 def drop_all():
     """Drop all tables."""
-    Model.metadata.drop_all(engine)
+    Model.metadata.drop_all(db.get_engine())
+
+
+def upgrade(bind=None):
+    """Add the columns and functions missing from an older database.
+
+    The statements are idempotent. Rebuild the lane statistics afterwards.
+    """
+    if bind is None:
+        bind = db.get_engine()
+
+    with bind.begin() as conn:
+        Model.metadata.create_all(conn)
+        for stmt in UPGRADE:
+            conn.execute(text(stmt))
+        conn.execute(notify_functions)
+        conn.execute(stats_functions)
+        conn.execute(payload_functions)
+        conn.execute(manifest_functions)
+        conn.execute(work_functions)
+
+
+UPGRADE = [
+    # Lane position index
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_message_lane_id_lane_position "
+    "ON message (lane_id, lane_position)",
+    "DROP INDEX IF EXISTS ix_message_lane_id",
+    # Payload compression
+    "ALTER TABLE message ALTER COLUMN payload DROP NOT NULL",
+    "ALTER TABLE message ADD COLUMN IF NOT EXISTS payload_data BYTEA",
+    "ALTER TABLE message ADD COLUMN IF NOT EXISTS payload_codec VARCHAR",
+    "ALTER TABLE message ADD COLUMN IF NOT EXISTS stored_size INTEGER",
+    "ALTER TABLE lane_stats ADD COLUMN IF NOT EXISTS stored BIGINT DEFAULT 0 NOT NULL",
+    "DROP FUNCTION IF EXISTS messagelane_stats_add(BIGINT, BIGINT, BIGINT)",
+    # Binary payloads
+    "ALTER TABLE message ADD COLUMN IF NOT EXISTS "
+    "payload_binary BOOLEAN DEFAULT false NOT NULL",
+    # Streamed payloads
+    "ALTER TABLE message ALTER COLUMN payload_data SET STORAGE EXTERNAL",
+    "ALTER TABLE message ALTER COLUMN payload SET STORAGE EXTERNAL",
+    # Shared payloads
+    "ALTER TABLE message ADD COLUMN IF NOT EXISTS "
+    "payload_shared BOOLEAN DEFAULT false NOT NULL",
+    "ALTER TABLE payload ALTER COLUMN payload SET STORAGE EXTERNAL",
+]
+
+
+def partitioned_message_table(metadata):
+    """Return a copy of the message table partitioned by ts.
+
+    PostgreSQL requires the primary key and any unique index of a
+    partitioned table to include the partition key. The primary key
+    becomes (message_id, ts) and the unique indexes are created as plain
+    indexes, so message_uuid and lane positions are no longer enforced
+    to be unique by the database.
+    """
+    source = Message.__table__
+
+    columns = []
+
+    for column in source.columns:
+        column = column._copy()
+        column.primary_key = column.name in ["message_id", "ts"]
+        column.unique = None
+        column.index = None
+        if column.name == "message_id":
+            column.autoincrement = True
+        columns.append(column)
+
+    indexes = [
+        Index(index.name, *[column.name for column in index.columns])
+        for index in source.indexes
+    ]
+
+    table = Table(
+        source.name,
+        metadata,
+        *columns,
+        *indexes,
+        postgresql_partition_by="RANGE (ts)",
+    )
+
+    for ddl in message_ddl:
+        event.listen(table, "after_create", ddl)
+
+    return table
+
+
+def notify_channel(lane_id):
+    """Return the name of the notification channel for a lane."""
+    return f"messagelane_{lane_id}"
 
 
 class Model(DeclarativeBase):
@@ -62,17 +177,55 @@ class Model(DeclarativeBase):
 # --------------------------------------------------------------------------
 
 
-class Message(Model):
+class PayloadMixin:
+    """Access to the payload columns of messages and shared payloads."""
+
+    @property
+    def payload_source(self):
+        """Return the object holding the payload columns."""
+        return self
+
+    @property
+    def payload(self):
+        """Return the payload, as bytes for binary messages, else str."""
+        if self.payload_binary:
+            return self.payload_bytes
+
+        if self.payload_source.payload_data is None:
+            return self.payload_source.payload_text
+
+        return self.payload_bytes.decode()
+
+    @property
+    def payload_bytes(self):
+        """Return the payload as bytes, decompressing it if needed."""
+        source = self.payload_source
+
+        if source.payload_data is None:
+            return source.payload_text.encode()
+
+        if source.payload_codec is None:
+            return source.payload_data
+
+        return compression.decompress(source.payload_data, source.payload_codec)
+
+
+class Message(PayloadMixin, Model):
     """Message table."""
 
     __tablename__ = "message"
-    __table_args__ = (Index("ix_message_lane_id_ts", "lane_id", "ts"),)
+    __table_args__ = (
+        Index("ix_message_lane_id_ts", "lane_id", "ts"),
+        Index(
+            "ix_message_lane_id_lane_position", "lane_id", "lane_position", unique=True
+        ),
+    )
 
     message_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     message_uuid: Mapped[uuid.UUID] = mapped_column(
         Uuid, server_default=text("gen_random_uuid()"), unique=True, index=True
     )
-    lane_id: Mapped[int] = mapped_column(ForeignKey("lane.lane_id"), index=True)
+    lane_id: Mapped[int] = mapped_column(ForeignKey("lane.lane_id"))
 
     lane_position: Mapped[int] = mapped_column(
         BigInteger, server_default=FetchedValue()
@@ -80,11 +233,25 @@ class Message(Model):
     ts: Mapped[datetime.datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now(), index=True
     )
-    payload: Mapped[str]
+    payload_text: Mapped[Optional[str]] = mapped_column("payload")
+    payload_data: Mapped[Optional[bytes]]
+    payload_codec: Mapped[Optional[str]]
+    payload_binary: Mapped[bool] = mapped_column(server_default=false())
+    payload_shared: Mapped[bool] = mapped_column(server_default=false())
     payload_hash: Mapped[bytes] = mapped_column(index=True)
     payload_size: Mapped[int]
+    stored_size: Mapped[Optional[int]]
 
     lane: Mapped["Lane"] = relationship(back_populates="messages")
+    shared_payload: Mapped[Optional["Payload"]] = relationship(
+        primaryjoin="foreign(Message.payload_hash) == Payload.payload_hash",
+        viewonly=True,
+    )
+
+    @property
+    def payload_source(self):
+        """Return the object holding the payload columns."""
+        return self.shared_payload if self.payload_shared else self
 
     def __repr__(self):
         """Return a string representation of the message."""
@@ -94,6 +261,31 @@ class Message(Model):
         )
 
 
+class Payload(PayloadMixin, Model):
+    """Shared payload table.
+
+    Holds a single copy of each payload posted with deduplication, keyed
+    by its MD5 hash and referenced by every message with that hash. The
+    refcount is the number of referring messages and the row is removed
+    when the last of them is deleted.
+    """
+
+    __tablename__ = "payload"
+
+    payload_hash: Mapped[bytes] = mapped_column(primary_key=True)
+    payload_text: Mapped[Optional[str]] = mapped_column("payload")
+    payload_data: Mapped[Optional[bytes]]
+    payload_codec: Mapped[Optional[str]]
+    payload_binary: Mapped[bool] = mapped_column(server_default=false())
+    payload_size: Mapped[int]
+    stored_size: Mapped[int]
+    refcount: Mapped[int] = mapped_column(BigInteger)
+
+    def __repr__(self):
+        """Return a string representation of the payload."""
+        return f"Payload({self.payload_hash.hex()}, {self.refcount})"
+
+
 class Lane(Model):
     """Lane table."""
 
@@ -106,7 +298,466 @@ class Lane(Model):
     messages: Mapped[list["Message"]] = relationship(
         cascade="all, delete-orphan", back_populates="lane"
     )
+    reservations: Mapped[list["Reservation"]] = relationship(
+        cascade="all, delete-orphan", back_populates="lane"
+    )
+    consumers: Mapped[list["Consumer"]] = relationship(
+        cascade="all, delete-orphan", back_populates="lane"
+    )
 
     def __repr__(self):
         """Return a string representation of the lane."""
         return f"Lane({self.lane_id}, {self.name}, {self.marker})"
+
+
+class Reservation(Model):
+    """Reserved block of lane positions."""
+
+    __tablename__ = "reservation"
+
+    reservation_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    lane_id: Mapped[int] = mapped_column(ForeignKey("lane.lane_id"), index=True)
+    first_position: Mapped[int] = mapped_column(BigInteger)
+    last_position: Mapped[int] = mapped_column(BigInteger)
+    expires: Mapped[datetime.datetime] = mapped_column(DateTime(timezone=True))
+
+    lane: Mapped["Lane"] = relationship(back_populates="reservations")
+
+    def __repr__(self):
+        """Return a string representation of the reservation."""
+        return (
+            f"Reservation({self.reservation_id}, {self.lane_id}, "
+            f"{self.first_position}, {self.last_position})"
+        )
+
+
+class Consumer(Model):
+    """Consumer offset table."""
+
+    __tablename__ = "consumer"
+    __table_args__ = (UniqueConstraint("lane_id", "name"),)
+
+    consumer_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    lane_id: Mapped[int] = mapped_column(ForeignKey("lane.lane_id"))
+    name: Mapped[str]
+    position: Mapped[int] = mapped_column(BigInteger, server_default=text("0"))
+    updated: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    lane: Mapped["Lane"] = relationship(back_populates="consumers")
+
+    def __repr__(self):
+        """Return a string representation of the consumer."""
+        return (
+            f"Consumer({self.consumer_id}, {self.lane_id}, "
+            f"{self.name}, {self.position})"
+        )
+
+
+class LaneStats(Model):
+    """Lane statistics table.
+
+    Holds the message count, total payload size and stored (compressed)
+    size of each lane, kept up
+    to date by triggers on the message table. A lane may have several
+    rows, which are summed, so that concurrent posts never wait on each
+    other to update the totals.
+    """
+
+    __tablename__ = "lane_stats"
+
+    lane_stats_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    lane_id: Mapped[int] = mapped_column(
+        ForeignKey("lane.lane_id", ondelete="CASCADE"), index=True
+    )
+    count: Mapped[int] = mapped_column(BigInteger)
+    size: Mapped[int] = mapped_column(BigInteger)
+    stored: Mapped[int] = mapped_column(BigInteger, server_default="0")
+
+    def __repr__(self):
+        """Return a string representation of the lane statistics."""
+        return f"LaneStats({self.lane_id}, {self.count}, {self.size}, {self.stored})"
+
+
+class Attachment(Model):
+    """Message attachment manifest table.
+
+    One row per attachment of an email formatted message, recorded when
+    it is posted. The rows are removed with their message by a trigger,
+    since a partitioned message table cannot be the target of a foreign
+    key on message_id.
+    """
+
+    __tablename__ = "attachment"
+    __table_args__ = (
+        Index(
+            "ix_attachment_lane_id_filename",
+            "lane_id",
+            "filename",
+            postgresql_ops={"filename": "text_pattern_ops"},
+        ),
+        Index("ix_attachment_lane_id_content_type", "lane_id", "content_type"),
+    )
+
+    attachment_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    message_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    lane_id: Mapped[int] = mapped_column(
+        ForeignKey("lane.lane_id", ondelete="CASCADE")
+    )
+    filename: Mapped[Optional[str]]
+    content_type: Mapped[str]
+    size: Mapped[int] = mapped_column(BigInteger)
+
+    def __repr__(self):
+        """Return a string representation of the attachment."""
+        return (
+            f"Attachment({self.attachment_id}, {self.message_id}, "
+            f"{self.filename}, {self.content_type}, {self.size})"
+        )
+
+
+class MessageHeader(Model):
+    """Message header manifest table.
+
+    The selected headers of an email formatted message, recorded with
+    its attachments. Names are lower case.
+    """
+
+    __tablename__ = "message_header"
+    __table_args__ = (
+        Index(
+            "ix_message_header_lane_id_name_value",
+            "lane_id",
+            "name",
+            "value",
+            postgresql_ops={"value": "text_pattern_ops"},
+        ),
+    )
+
+    message_header_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    message_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    lane_id: Mapped[int] = mapped_column(
+        ForeignKey("lane.lane_id", ondelete="CASCADE")
+    )
+    name: Mapped[str]
+    value: Mapped[str]
+
+    def __repr__(self):
+        """Return a string representation of the header."""
+        return f"MessageHeader({self.message_id}, {self.name}, {self.value})"
+
+
+class WorkQueue(Model):
+    """Work queue table.
+
+    A named queue of a lane whose messages are claimed by parallel
+    workers. Each message posted to the lane gets a work item in each of
+    its queues.
+    """
+
+    __tablename__ = "work_queue"
+    __table_args__ = (UniqueConstraint("lane_id", "name"),)
+
+    work_queue_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    lane_id: Mapped[int] = mapped_column(
+        ForeignKey("lane.lane_id", ondelete="CASCADE")
+    )
+    name: Mapped[str]
+
+    def __repr__(self):
+        """Return a string representation of the work queue."""
+        return f"WorkQueue({self.work_queue_id}, {self.lane_id}, {self.name})"
+
+
+class WorkItem(Model):
+    """Work item table.
+
+    One row per message still to be processed in a work queue. A claimed
+    item holds the worker and lease expiry, and the row is removed when
+    the work is completed. The rows are added and removed with their
+    messages by triggers.
+    """
+
+    __tablename__ = "work_item"
+    __table_args__ = (
+        Index(
+            "ix_work_item_work_queue_id_lane_position", "work_queue_id", "lane_position"
+        ),
+    )
+
+    work_item_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    work_queue_id: Mapped[int] = mapped_column(
+        ForeignKey("work_queue.work_queue_id", ondelete="CASCADE")
+    )
+    message_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    lane_position: Mapped[int] = mapped_column(BigInteger)
+    worker: Mapped[Optional[str]]
+    expires: Mapped[Optional[datetime.datetime]] = mapped_column(
+        DateTime(timezone=True)
+    )
+    attempts: Mapped[int] = mapped_column(server_default=text("0"))
+
+    def __repr__(self):
+        """Return a string representation of the work item."""
+        return (
+            f"WorkItem({self.work_item_id}, {self.work_queue_id}, "
+            f"{self.lane_position}, {self.worker})"
+        )
+
+
+# --------------------------------------------------------------------------
+#   Triggers
+# --------------------------------------------------------------------------
+
+# Notify listeners on each lane's channel when messages are posted. The
+# trigger fires once per statement, so a batch post sends one notification
+# per lane carrying the highest new position. Notifications are delivered
+# when the posting transaction commits.
+
+notify_functions = DDL(
+    """
+    CREATE OR REPLACE FUNCTION messagelane_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('messagelane_' || lane_id, max(lane_position)::text)
+            FROM new_rows
+            GROUP BY lane_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER message_notify
+        AFTER INSERT ON message
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION messagelane_notify();
+    """
+)
+
+message_ddl = [
+    notify_functions,
+    # The payload data is compressed by the client, so store the payloads
+    # out of line without compression, which also lets large payloads be
+    # read back in slices.
+    DDL(
+        "ALTER TABLE message ALTER COLUMN payload SET STORAGE EXTERNAL, "
+        "ALTER COLUMN payload_data SET STORAGE EXTERNAL"
+    ),
+]
+
+# Release shared payloads as the messages referring to them are deleted.
+# The posting side takes its references itself, see share_payloads().
+
+payload_functions = DDL(
+    """
+    CREATE OR REPLACE FUNCTION messagelane_payload_release(
+        hash BYTEA, refs BIGINT
+    ) RETURNS void AS $$
+    BEGIN
+        UPDATE payload SET refcount = refcount - refs WHERE payload_hash = hash;
+        DELETE FROM payload WHERE payload_hash = hash AND refcount <= 0;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION messagelane_payload_delete() RETURNS trigger AS $$
+    BEGIN
+        PERFORM messagelane_payload_release(r.payload_hash, r.refs)
+            FROM (
+                SELECT payload_hash, count(*) AS refs
+                FROM old_rows
+                WHERE payload_shared
+                GROUP BY payload_hash
+                ORDER BY payload_hash
+            ) r;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER message_payload_delete
+        AFTER DELETE ON message
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION messagelane_payload_delete();
+    """
+)
+
+message_ddl.append(payload_functions)
+
+# Remove the manifests of deleted messages
+
+manifest_functions = DDL(
+    """
+    CREATE OR REPLACE FUNCTION messagelane_manifest_delete() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM attachment
+            WHERE message_id IN (SELECT message_id FROM old_rows);
+        DELETE FROM message_header
+            WHERE message_id IN (SELECT message_id FROM old_rows);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER message_manifest_delete
+        AFTER DELETE ON message
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION messagelane_manifest_delete();
+    """
+)
+
+message_ddl.append(manifest_functions)
+
+# Add a work item to each work queue of the lane for posted messages, and
+# remove the work items of deleted messages
+
+work_functions = DDL(
+    """
+    CREATE OR REPLACE FUNCTION messagelane_work_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO work_item (work_queue_id, message_id, lane_position)
+            SELECT work_queue.work_queue_id, new_rows.message_id, new_rows.lane_position
+            FROM new_rows
+            JOIN work_queue ON work_queue.lane_id = new_rows.lane_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION messagelane_work_delete() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM work_item
+            WHERE message_id IN (SELECT message_id FROM old_rows);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE TRIGGER message_work_insert
+        AFTER INSERT ON message
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION messagelane_work_insert();
+
+    CREATE OR REPLACE TRIGGER message_work_delete
+        AFTER DELETE ON message
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION messagelane_work_delete();
+    """
+)
+
+message_ddl.append(work_functions)
+
+event.listen(
+    Payload.__table__,
+    "after_create",
+    DDL(
+        "ALTER TABLE payload ALTER COLUMN payload SET STORAGE EXTERNAL, "
+        "ALTER COLUMN payload_data SET STORAGE EXTERNAL"
+    ),
+)
+
+for ddl in message_ddl:
+    event.listen(Message.__table__, "after_create", ddl)
+
+event.listen(
+    Message.__table__,
+    "after_drop",
+    DDL(
+        """
+        DROP FUNCTION IF EXISTS messagelane_notify();
+        DROP FUNCTION IF EXISTS messagelane_payload_delete();
+        DROP FUNCTION IF EXISTS messagelane_payload_release(BYTEA, BIGINT);
+        DROP FUNCTION IF EXISTS messagelane_manifest_delete();
+        DROP FUNCTION IF EXISTS messagelane_work_insert();
+        DROP FUNCTION IF EXISTS messagelane_work_delete();
+        """
+    ),
+)
+
+# Keep lane_stats current as messages are posted and deleted. Each change
+# is added to a lane_stats row of the lane that no other transaction holds,
+# or to a new row when they are all busy, so the number of rows per lane
+# stays near the number of concurrent writers. The triggers are installed
+# with the lane_stats table, after which rebuild_lane_stats() fills it for
+# an existing database.
+
+stats_functions = DDL(
+    """
+    CREATE OR REPLACE FUNCTION messagelane_stats_add(
+        lane BIGINT, messages BIGINT, bytes BIGINT, stored_bytes BIGINT
+    ) RETURNS void AS $$
+    BEGIN
+        UPDATE lane_stats
+            SET count = count + messages,
+                size = size + bytes,
+                stored = stored + stored_bytes
+            WHERE lane_stats_id = (
+                SELECT lane_stats_id FROM lane_stats
+                    WHERE lane_id = lane
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+            );
+        IF NOT FOUND THEN
+            INSERT INTO lane_stats (lane_id, count, size, stored)
+                VALUES (lane, messages, bytes, stored_bytes);
+        END IF;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION messagelane_stats_insert() RETURNS trigger AS $$
+    BEGIN
+        PERFORM messagelane_stats_add(
+                lane_id,
+                count(*),
+                coalesce(sum(payload_size), 0),
+                coalesce(sum(coalesce(stored_size, payload_size)), 0)
+            )
+            FROM new_rows
+            GROUP BY lane_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION messagelane_stats_delete() RETURNS trigger AS $$
+    BEGIN
+        PERFORM messagelane_stats_add(
+                lane_id,
+                -count(*),
+                -coalesce(sum(payload_size), 0),
+                -coalesce(sum(coalesce(stored_size, payload_size)), 0)
+            )
+            FROM old_rows
+            GROUP BY lane_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+event.listen(LaneStats.__table__, "after_create", stats_functions)
+
+event.listen(
+    LaneStats.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE TRIGGER message_stats_insert
+            AFTER INSERT ON message
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION messagelane_stats_insert();
+
+        CREATE TRIGGER message_stats_delete
+            AFTER DELETE ON message
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION messagelane_stats_delete();
+        """
+    ),
+)
+
+event.listen(
+    LaneStats.__table__,
+    "after_drop",
+    DDL(
+        """
+        DROP TRIGGER IF EXISTS message_stats_insert ON message;
+        DROP TRIGGER IF EXISTS message_stats_delete ON message;
+        DROP FUNCTION IF EXISTS messagelane_stats_insert();
+        DROP FUNCTION IF EXISTS messagelane_stats_delete();
+        DROP FUNCTION IF EXISTS messagelane_stats_add(BIGINT, BIGINT, BIGINT, BIGINT);
+        """
+    ),
+)
@@ -0,0 +1,282 @@
+"""Message table partitions.
+
+When the database is created with a partition interval, the message
+table is range partitioned on ts into daily or weekly partitions named
+message_pYYYYMMDD, plus a default partition that catches anything
+outside of them. Retention that covers whole partitions then becomes a
+table drop instead of a row delete.
+
+Example:
+-------
+>>> with engine.begin() as conn:
+...     partitions.create_partitions(conn, "daily", ahead=7)
+
+"""
+
+##########################################################################
+#
+#   Message table partition maintenance
+#
+#   2026-10-18  Todd Valentic
+#               Initial implementation
+#
+##########################################################################
+
+import datetime
+import re
+
+from sqlalchemy import text
+
+INTERVALS = {
+    "daily": datetime.timedelta(days=1),
+    "weekly": datetime.timedelta(days=7),
+}
+
+DEFAULT_PARTITION = "message_default"
+
+BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+OFFSET = re.compile(r"([+-]\d\d)$")
+
+
+def parse_bound(value):
+    """Return the datetime of a partition bound literal."""
+    # Python < 3.11 needs the offset minutes (+00 -> +00:00)
+    return datetime.datetime.fromisoformat(OFFSET.sub(r"\1:00", value))
+
+
+def period_start(ts, interval):
+    """Return the start of the partition period holding ts."""
+    ts = ts.astimezone(datetime.timezone.utc)
+    start = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if interval == "weekly":
+        start -= datetime.timedelta(days=start.weekday())
+
+    return start
+
+
+def partition_name(start):
+    """Return the name of the partition starting at start."""
+    return f"message_p{start:%Y%m%d}"
+
+
+def is_partitioned(conn):
+    """Return True if the message table is partitioned."""
+    stmt = text("SELECT relkind FROM pg_class WHERE oid = to_regclass('message')")
+
+    return conn.scalar(stmt) == "p"
+
+
+def list_partitions(conn):
+    """Return the message partitions ordered by start."""
+    stmt = text(
+        """
+        SELECT
+            c.relname,
+            pg_get_expr(c.relpartbound, c.oid),
+            greatest(c.reltuples, 0)::bigint,
+            pg_total_relation_size(c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('message')
+        """
+    )
+
+    results = []
+
+    for name, bounds, rows, size in conn.execute(stmt):
+        match = BOUNDS.search(bounds)
+        if match:
+            start, end = [parse_bound(x) for x in match.groups()]
+        else:
+            start, end = None, None
+        results.append(
+            {"name": name, "start": start, "end": end, "rows": rows, "size": size}
+        )
+
+    far_future = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+
+    return sorted(results, key=lambda p: p["start"] or far_future)
+
+
+def infer_interval(partitions):
+    """Return the interval used by the latest ranged partition."""
+    ranged = [p for p in partitions if p["start"]]
+
+    if not ranged:
+        return None
+
+    span = ranged[-1]["end"] - ranged[-1]["start"]
+
+    for interval, length in INTERVALS.items():
+        if span == length:
+            return interval
+
+    return None
+
+
+def create_default_partition(conn):
+    """Create the default partition if it is missing."""
+    conn.execute(
+        text(
+            f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} "
+            "PARTITION OF message DEFAULT"
+        )
+    )
+
+
+def create_partition(conn, name, start, end):
+    """Create a partition, moving its rows out of the default partition.
+
+    PostgreSQL refuses to add a partition for a range that already has
+    rows in the default partition. Those rows are moved into a new table
+    that is then attached as the partition. The move bypasses the
+    statement triggers on message, so the lane statistics and the
+    references held on the rows are left unchanged.
+    """
+    bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    params = {"start": start, "end": end}
+    where = "WHERE ts >= :start AND ts < :end"
+
+    stmt = text(f"SELECT to_regclass('{DEFAULT_PARTITION}') IS NOT NULL")
+    has_default = conn.scalar(stmt)
+
+    if has_default:
+        conn.execute(
+            text(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE")
+        )
+        stmt = text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} {where})")
+
+    if not has_default or not conn.scalar(stmt, params):
+        conn.execute(
+            text(f"CREATE TABLE {name} PARTITION OF message FOR VALUES {bounds}")
+        )
+        return
+
+    conn.execute(
+        text(
+            f"CREATE TABLE {name} "
+            "(LIKE message INCLUDING DEFAULTS INCLUDING STORAGE)"
+        )
+    )
+    conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} {where} RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        params,
+    )
+    conn.execute(
+        text(f"ALTER TABLE message ATTACH PARTITION {name} FOR VALUES {bounds}")
+    )
+
+
+def create_partitions(conn, interval=None, ahead=7, now=None):
+    """Create partitions from the current period through ahead periods.
+
+    The interval is taken from the latest existing partition when not
+    given. Rows already in the default partition that fall in a new
+    partition are moved into it. Returns the names of the partitions
+    created.
+    """
+    partitions = list_partitions(conn)
+
+    if interval is None:
+        interval = infer_interval(partitions) or "daily"
+
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown partition interval: {interval}")
+
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+    step = INTERVALS[interval]
+    start = period_start(now, interval)
+    stop = start + step * (ahead + 1)
+
+    ends = [p["end"] for p in partitions if p["end"]]
+
+    if ends:
+        start = max(start, max(ends))
+
+    created = []
+
+    while start < stop:
+        name = partition_name(start)
+        end = start + step
+        create_partition(conn, name, start, end)
+        created.append(name)
+        start = end
+
+    return created
+
+
+def drop_partitions(conn, ts):
+    """Drop the partitions holding only messages at or before ts.
+
+    The lane statistics, shared payload references, attachment manifests
+    and work items are adjusted for the dropped rows, since a table drop
+    does not fire the message delete triggers. Returns the number of
+    messages removed.
+
+    The ts may be anything PostgreSQL reads as a timestamp with time
+    zone, such as a datetime, an ISO string or "infinity".
+    """
+    removed = 0
+
+    # Compare in the database, which parses ts the same way as the delete
+    stmt = text("SELECT CAST(:end AS timestamptz) <= CAST(:ts AS timestamptz)")
+
+    for partition in list_partitions(conn):
+        if partition["end"] is None:
+            continue
+
+        if not conn.scalar(stmt, {"end": partition["end"], "ts": ts}):
+            continue
+
+        name = partition["name"]
+
+        conn.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+
+        counts = conn.execute(
+            text(
+                "SELECT lane_id, count(*), sum(payload_size), "
+                f"sum(coalesce(stored_size, payload_size)) FROM {name} "
+                "GROUP BY lane_id"
+            )
+        ).all()
+
+        for lane_id, count, size, stored in counts:
+            conn.execute(
+                text(
+                    "SELECT messagelane_stats_add(:lane_id, :count, :size, :stored)"
+                ),
+                {
+                    "lane_id": lane_id,
+                    "count": -count,
+                    "size": -size,
+                    "stored": -stored,
+                },
+            )
+            removed += count
+
+        conn.execute(
+            text(
+                "SELECT messagelane_payload_release(r.payload_hash, r.refs) FROM ("
+                f"SELECT payload_hash, count(*) AS refs FROM {name} "
+                "WHERE payload_shared GROUP BY payload_hash ORDER BY payload_hash"
+                ") r"
+            )
+        )
+
+        for table in ["attachment", "message_header", "work_item"]:
+            conn.execute(
+                text(
+                    f"DELETE FROM {table} "
+                    f"WHERE message_id IN (SELECT message_id FROM {name})"
+                )
+            )
+
+        conn.execute(text(f"DROP TABLE {name}"))
+
+    return removed
@@ -0,0 +1,125 @@
+"""Shared test fixtures.
+
+Tests needing a database run against MESSAGELANE_TEST_URL (or else
+MESSAGELANE_URL), which should name a scratch PostgreSQL database. They
+are skipped when neither is set or the database cannot be reached.
+"""
+
+import os
+import uuid
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def database_url():
+    """Return the URL of the test database, creating any missing tables."""
+    url = os.environ.get("MESSAGELANE_TEST_URL") or os.environ.get("MESSAGELANE_URL")
+
+    if not url:
+        pytest.skip("MESSAGELANE_TEST_URL is not set")
+
+    import sqlalchemy as sa
+
+    from messagelane import models
+
+    engine = sa.create_engine(url)
+
+    try:
+        with engine.connect():
+            pass
+    except sa.exc.OperationalError as err:
+        engine.dispose()
+        pytest.skip(f"Test database unavailable: {err}")
+
+    models.create_all(engine)
+    engine.dispose()
+
+    return url
+
+
+@pytest.fixture
+def Session(database_url):
+    """Return a sessionmaker on the test database."""
+    import sqlalchemy as sa
+    from sqlalchemy.orm import sessionmaker
+
+    engine = sa.create_engine(database_url)
+
+    yield sessionmaker(engine)
+
+    engine.dispose()
+
+
+@pytest.fixture
+def new_lane(Session):
+    """Return a function creating lanes with unique names, deleted afterwards."""
+    from messagelane import MessageLane
+
+    names = []
+
+    def create():
+        name = f"test-{uuid.uuid4().hex[:12]}"
+
+        with Session.begin() as session:
+            MessageLane(session).create_lane(name)
+
+        names.append(name)
+
+        return name
+
+    yield create
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        for name in names:
+            msglane.del_messages(name, "infinity")
+            msglane.del_lane(name)
+
+
+@pytest.fixture
+def lane(new_lane):
+    """Create a lane with a unique name, deleting it afterwards."""
+    return new_lane()
+
+
+@pytest.fixture
+def scratch_url(database_url):
+    """Return the URL of an empty scratch database, dropped afterwards."""
+    import sqlalchemy as sa
+
+    url = sa.engine.make_url(database_url)
+    name = f"{url.database}_scratch_{uuid.uuid4().hex[:8]}"
+
+    admin = sa.create_engine(url, isolation_level="AUTOCOMMIT")
+
+    try:
+        with admin.connect() as conn:
+            conn.exec_driver_sql(f'CREATE DATABASE "{name}"')
+    except sa.exc.DBAPIError as err:
+        admin.dispose()
+        pytest.skip(f"Cannot create a scratch database: {err}")
+
+    try:
+        yield url.set(database=name).render_as_string(hide_password=False)
+    finally:
+        with admin.connect() as conn:
+            conn.exec_driver_sql(f'DROP DATABASE "{name}" WITH (FORCE)')
+        admin.dispose()
+
+
+@pytest.fixture
+def partitioned_Session(scratch_url):
+    """Return a sessionmaker on a scratch database with daily partitions."""
+    import sqlalchemy as sa
+    from sqlalchemy.orm import sessionmaker
+
+    from messagelane import models
+
+    engine = sa.create_engine(scratch_url)
+
+    try:
+        models.create_all(engine, partition="daily")
+        yield sessionmaker(engine)
+    finally:
+        engine.dispose()
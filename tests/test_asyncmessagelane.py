@@ -0,0 +1,95 @@
+"""Tests for AsyncMessageLane against PostgreSQL."""
+
+import asyncio
+import inspect
+
+import pytest
+import sqlalchemy as sa
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from messagelane import AsyncMessageLane, MessageLane
+
+pytest.importorskip("asyncpg")
+
+
+def run(database_url, func):
+    """Run func(session) in a transaction on an asyncpg engine."""
+    url = sa.engine.make_url(database_url).set(drivername="postgresql+asyncpg")
+
+    async def main():
+        engine = create_async_engine(url)
+        try:
+            async with async_sessionmaker(engine).begin() as session:
+                return await func(session)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+def test_wrappers():
+    """Check the coroutine wrappers keep the MessageLane signatures."""
+    assert inspect.iscoroutinefunction(AsyncMessageLane.post_message)
+    assert AsyncMessageLane.post_message.__name__ == "post_message"
+    assert AsyncMessageLane.post_message.__doc__ == MessageLane.post_message.__doc__
+
+
+def test_post_and_get(database_url, lane):
+    """Post and read back a message."""
+    async def main(session):
+        msglane = AsyncMessageLane(session)
+
+        assert await msglane.has_lane(lane)
+        assert not await msglane.has_lane(f"{lane}-missing")
+
+        message_uuid = await msglane.post_message(lane, "hello")
+
+        message = await msglane.get_message(lane, 1)
+        return message_uuid, message.message_uuid, message.payload
+
+    posted_uuid, message_uuid, payload = run(database_url, main)
+
+    assert str(posted_uuid) == str(message_uuid)
+    assert payload == "hello"
+
+
+def test_iterate_batches(database_url, lane, monkeypatch):
+    """Iterate over a lane with one run_sync call per batch."""
+    calls = []
+
+    async def main(session):
+        msglane = AsyncMessageLane(session)
+        await msglane.post_messages(lane, [str(k) for k in range(25)])
+
+        run_sync = session.run_sync
+
+        async def counted(func, *args, **kw):
+            calls.append(func)
+            return await run_sync(func, *args, **kw)
+
+        monkeypatch.setattr(session, "run_sync", counted)
+
+        return [
+            message.payload
+            async for message in msglane.iter_messages(lane, batch_size=10)
+        ]
+
+    payloads = run(database_url, main)
+
+    assert payloads == [str(k) for k in range(25)]
+    assert len(calls) == 4
+
+
+def test_load_shared_payload(database_url, lane):
+    """Load deduplicated payloads before returning messages."""
+    async def main(session):
+        msglane = AsyncMessageLane(session, dedup=True)
+
+        await msglane.post_message(lane, "shared")
+        await msglane.post_message(lane, "shared")
+
+        messages = await msglane.get_messages(lane, 1, 2)
+        return [(message.payload_shared, message.payload) for message in messages]
+
+    assert run(database_url, main) == [(True, "shared"), (True, "shared")]
@@ -0,0 +1,87 @@
+"""Tests for the msglane command line program."""
+
+import sqlalchemy as sa
+
+from click.testing import CliRunner
+from sqlalchemy.orm import sessionmaker
+
+from messagelane import MessageLane, models
+from messagelane.commands.msglane import cli
+from messagelane.models import LaneStats, WorkItem
+
+
+def msglane(database_url, *args):
+    """Run msglane with args on the test database."""
+    return CliRunner().invoke(cli, ["--database", database_url, *args])
+
+
+def test_queue_complete_partial(database_url, Session, lane):
+    """Keep the completed items when some positions were not claimed."""
+    with Session.begin() as session:
+        client = MessageLane(session)
+        client.create_queue(lane)
+        client.post_messages(lane, ["a", "b", "c"])
+        client.claim(lane, "worker", 1)
+
+    result = msglane(database_url, "queue", "complete", lane, "worker", "1", "2")
+
+    assert result.exit_code == 1
+    assert "Completed 1 of 2 messages" in result.output
+
+    with Session() as session:
+        queue_id = MessageLane(session).work_queue_id(lane, "default")
+        stmt = (
+            sa.select(WorkItem.lane_position)
+            .where(WorkItem.work_queue_id == queue_id)
+            .order_by(WorkItem.lane_position)
+        )
+        positions = session.scalars(stmt).all()
+
+    assert positions == [2, 3]
+
+
+def test_message_has(database_url, Session, lane):
+    """Exit 1 only for missing messages listed with --missing."""
+    with Session.begin() as session:
+        (found,) = MessageLane(session).post_messages(lane, ["a"])
+
+    absent = "00000000-0000-0000-0000-000000000000"
+
+    result = msglane(database_url, "message", "has", absent)
+    assert (result.exit_code, result.output) == (0, "False\n")
+
+    result = msglane(database_url, "message", "has", str(found), absent)
+    assert (result.exit_code, result.output) == (0, f"{found}\n")
+
+    result = msglane(database_url, "message", "has", "--missing", str(found), absent)
+    assert (result.exit_code, result.output) == (1, f"{absent}\n")
+
+
+def test_missing_lane_stats(scratch_url):
+    """Point to db upgrade on a database without lane statistics."""
+    engine = sa.create_engine(scratch_url)
+
+    try:
+        models.create_all(engine)
+        LaneStats.__table__.drop(engine)
+
+        with sessionmaker(engine).begin() as session:
+            MessageLane(session).create_lane("old")
+            MessageLane(session).post_messages("old", ["a", "bb"])
+    finally:
+        engine.dispose()
+
+    result = msglane(scratch_url, "status")
+    assert result.exit_code == 1
+    assert "msglane db upgrade" in result.output
+
+    result = msglane(scratch_url, "overview", "--as_bytes")
+    assert result.exit_code == 0
+    assert "msglane db upgrade" in result.output
+    assert result.output.splitlines()[-1].split()[:4] == ["old", "1", "2", "2"]
+
+    result = msglane(scratch_url, "db", "upgrade")
+    assert result.exit_code == 0
+
+    result = msglane(scratch_url, "status")
+    assert result.exit_code == 0
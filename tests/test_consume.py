@@ -0,0 +1,29 @@
+"""Tests for the parallel lane consumer."""
+
+import threading
+
+from messagelane import MessageLane, consume
+
+
+def test_follow_past_deleted_tail(Session, lane):
+    """Wait for new messages when the last positions hold no message."""
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        msglane.post_messages(lane, ["a", "b", "c"])
+        msglane.del_message(lane, 3)
+
+    handled = []
+    result = []
+
+    def run():
+        result.append(
+            consume.consume(Session, lane, handled.append, follow=True, timeout=0.5)
+        )
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(10)
+
+    assert not thread.is_alive()
+    assert result == [2]
+    assert [job.payload for job in handled] == [b"a", b"b"]
@@ -0,0 +1,74 @@
+"""Tests for message attachment manifests."""
+
+from email.message import EmailMessage
+
+import pytest
+
+from messagelane import manifest
+
+NESTED = b"""\
+Subject: nested\r
+X-Site: abc\r
+Content-Type: multipart/mixed; boundary="outer"\r
+\r
+preamble\r
+--outer\r
+Content-Type: multipart/alternative; boundary="inner"\r
+\r
+inner preamble\r
+--inner\r
+Content-Type: text/plain\r
+\r
+hello\r
+--inner\r
+Content-Type: text/html\r
+\r
+<p>hello</p>\r
+--inner--\r
+inner epilogue\r
+--outer\r
+Content-Type: application/octet-stream\r
+Content-Disposition: attachment; filename="data.bin"\r
+\r
+abcdef\r
+--outer--\r
+"""
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64, 4096])
+def test_nested_multipart(chunk_size):
+    """List the parts of a nested multipart, fed in any chunk size."""
+    result = manifest.scan(
+        NESTED[start : start + chunk_size]
+        for start in range(0, len(NESTED), chunk_size)
+    )
+
+    assert result["headers"] == [("subject", "nested"), ("x-site", "abc")]
+    assert result["attachments"] == [
+        {"filename": None, "content_type": "text/plain", "size": 5},
+        {"filename": None, "content_type": "text/html", "size": 12},
+        {"filename": "data.bin", "content_type": "application/octet-stream", "size": 6},
+    ]
+
+
+def test_base64_attachment():
+    """Report the decoded size of a base64 attachment."""
+    message = EmailMessage()
+    message["Subject"] = "image"
+    message.set_content("see attached")
+    message.add_attachment(
+        b"\x00" * 1000, maintype="image", subtype="png", filename="image.png"
+    )
+
+    result = manifest.scan([message.as_bytes()])
+
+    assert result["attachments"][-1] == {
+        "filename": "image.png",
+        "content_type": "image/png",
+        "size": 1000,
+    }
+
+
+def test_not_email():
+    """Return None for text that is not an email message."""
+    assert manifest.scan_text("just some text\n") is None
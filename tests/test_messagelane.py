@@ -0,0 +1,365 @@
+"""Tests for MessageLane against PostgreSQL."""
+
+import hashlib
+import io
+import json
+import secrets
+
+import pytest
+import sqlalchemy as sa
+
+from messagelane import MessageLane, messagelane
+from messagelane.models import Message, Payload, Reservation
+
+
+def test_rebuild_lane_stats(Session, lane):
+    """Return the number of lanes with messages from a stats rebuild."""
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        msglane.post_messages(lane, ["a", "b"])
+
+        lanes = session.scalar(sa.select(sa.func.count(Message.lane_id.distinct())))
+
+        assert msglane.rebuild_lane_stats() == lanes
+        counts = {row.name: row.count for row in msglane.overview()}
+        assert counts[lane] == 2
+
+
+@pytest.mark.parametrize("codec", ["none", "zlib"])
+def test_iter_message_bytes(Session, lane, codec):
+    """Read small payloads in one statement and large ones in slices."""
+    large = "é" * 1000 + secrets.token_hex(4000)
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with Session.begin() as session:
+        msglane = MessageLane(session, codec=codec)
+        msglane.post_messages(lane, ["payload", large])
+
+        msglane.get_lane_id(lane)
+        sa.event.listen(session.get_bind(), "before_cursor_execute", count)
+
+        try:
+            assert b"".join(msglane.iter_message_bytes(lane, 1)) == b"payload"
+            assert len(statements) == 2
+
+            chunks = list(msglane.iter_message_bytes(lane, 2, chunk_size=1024))
+        finally:
+            sa.event.remove(session.get_bind(), "before_cursor_execute", count)
+
+        assert len(chunks) > 1
+        assert b"".join(chunks) == large.encode()
+
+
+def test_post_messages_from_files(Session, lane, tmp_path, monkeypatch):
+    """Post small files in bounded batches and stream large ones."""
+    monkeypatch.setattr(messagelane, "STREAM_SIZE", 100)
+    monkeypatch.setattr(messagelane, "BATCH_FILES", 2)
+    monkeypatch.setattr(messagelane, "BATCH_BYTES", 10)
+
+    contents = ["a", "bb", "ccc", "x" * 200, "dddddddd", "eeee", "f"]
+    filenames = []
+
+    for index, content in enumerate(contents):
+        filename = tmp_path / f"{index}.txt"
+        filename.write_text(content)
+        filenames.append(filename)
+
+    batches = []
+    streamed = []
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+
+        post_messages = msglane.post_messages
+        post_message_from_stream = msglane.post_message_from_stream
+
+        def post_batch(name, payloads, **kw):
+            batches.append(list(payloads))
+            return post_messages(name, payloads, **kw)
+
+        def post_stream(name, stream, **kw):
+            streamed.append(stream.name)
+            return post_message_from_stream(name, stream, **kw)
+
+        monkeypatch.setattr(msglane, "post_messages", post_batch)
+        monkeypatch.setattr(msglane, "post_message_from_stream", post_stream)
+
+        results = msglane.post_messages_from_files(lane, filenames)
+
+        messages = msglane.get_messages(lane, 1, len(contents))
+
+        assert [message.payload for message in messages] == contents
+        assert [message.message_uuid for message in messages] == results
+
+    assert streamed == [str(filenames[3])]
+    assert [batch for batch in batches if batch] == [
+        ["a", "bb"],
+        ["ccc"],
+        ["dddddddd"],
+        ["eeee", "f"],
+    ]
+
+
+def test_recompress_messages(Session, lane):
+    """Recompress in batches bounded by bytes, keeping payloads and stats."""
+    payloads = ["text " * 100, b"\x00" * 500, "tiny", "é" * 300]
+
+    with Session.begin() as session:
+        MessageLane(session).post_messages(lane, payloads)
+
+    with Session.begin() as session:
+        msglane = MessageLane(session, codec="zlib")
+        batches = list(msglane.recompress_messages(lane, max_bytes=400))
+
+        # "tiny" does not get smaller and is left as it is
+        assert batches == [(1, 1), (2, 1), (4, 1)]
+        assert list(msglane.recompress_messages(lane)) == [(3, 0)]
+
+    with Session() as session:
+        msglane = MessageLane(session)
+        messages = msglane.get_messages(lane, 1, 4)
+
+        assert [message.payload for message in messages] == payloads
+        assert [message.payload_codec for message in messages] == [
+            "zlib",
+            "zlib",
+            None,
+            "zlib",
+        ]
+
+        stored = [message.stored_size for message in messages]
+        assert stored[2] == 4
+        assert stored[0] < 100 and stored[1] < 100
+
+        (row,) = [row for row in msglane.overview() if row["name"] == lane]
+        assert row["stored_size"] == sum(stored)
+
+
+def test_reservation_visibility(Session, lane):
+    """Hold the committed position below an outstanding reservation."""
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        msglane.post_messages(lane, ["a"])
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        reservation = msglane.reserve_positions(lane, 2)
+
+        assert (reservation.first_position, reservation.last_position) == (2, 3)
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        msglane.post_messages(lane, ["d"])
+
+        assert msglane.get_lane(lane).marker == 4
+        assert msglane.committed_position(lane) == 1
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        msglane.post_messages(lane, ["b", "c"], reservation=reservation)
+
+        assert msglane.committed_position(lane) == 4
+
+        messages = msglane.get_messages(lane, 1, 4)
+        assert [message.payload for message in messages] == ["a", "b", "c", "d"]
+
+    with Session.begin() as session, pytest.raises(ValueError, match="not exist"):
+        MessageLane(session).post_messages(lane, ["b", "c"], reservation=reservation)
+
+
+def test_reservation_size(Session, lane):
+    """Reject a post that does not fill the reserved block."""
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        reservation = msglane.reserve_positions(lane, 2)
+
+        with pytest.raises(ValueError, match="1 payloads for 2"):
+            msglane.post_messages(lane, ["a"], reservation=reservation)
+
+        msglane.release_positions(reservation)
+
+
+def test_reservation_expired(Session, lane):
+    """Refuse an expired reservation and stop holding back the lane."""
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        reservation = msglane.reserve_positions(lane, 2, lease=0)
+
+        assert msglane.committed_position(lane) == 2
+
+        with pytest.raises(ValueError, match="expired"):
+            msglane.post_messages(lane, ["a", "b"], reservation=reservation)
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        msglane.post_messages(lane, ["c"])
+
+        assert msglane.committed_position(lane) == 3
+        positions = [message.lane_position for message in msglane.list_messages(lane)]
+        assert positions == [3]
+
+
+def test_release_positions(Session, lane):
+    """Release a reservation, leaving a gap, and remove expired ones."""
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        expired = msglane.reserve_positions(lane, 1, lease=0)
+        reservation = msglane.reserve_positions(lane, 2)
+
+        assert msglane.committed_position(lane) == 1
+
+        msglane.release_positions(reservation)
+
+        assert msglane.committed_position(lane) == 3
+        stmt = sa.select(Reservation).where(Reservation.lane_id == expired.lane_id)
+        assert session.scalars(stmt).all() == []
+
+    with Session.begin() as session, pytest.raises(ValueError, match="not exist"):
+        MessageLane(session).post_messages(lane, ["a", "b"], reservation=reservation)
+
+
+def test_dedup_refcount(Session, new_lane):
+    """Count references to shared payloads and remove orphaned ones."""
+    first, second = new_lane(), new_lane()
+    payload = secrets.token_hex(100)
+    payload_hash = hashlib.md5(payload.encode()).digest()
+
+    def refcount(session):
+        stmt = sa.select(Payload.refcount).where(Payload.payload_hash == payload_hash)
+        return session.scalar(stmt)
+
+    with Session.begin() as session:
+        msglane = MessageLane(session, dedup=True)
+        msglane.post_messages(first, [payload, payload])
+
+        assert refcount(session) == 2
+
+    with Session.begin() as session:
+        msglane = MessageLane(session, dedup=True)
+        msglane.post_message(second, payload)
+
+        assert refcount(session) == 3
+        messages = msglane.get_messages(first, 1, 2)
+        assert [message.payload for message in messages] == [payload, payload]
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        msglane.del_message(first, 1)
+
+        assert refcount(session) == 2
+
+        msglane.del_messages(first, "infinity")
+
+        assert refcount(session) == 1
+        assert msglane.get_message(second, 1).payload == payload
+
+        msglane.del_message(second, 1)
+
+        assert refcount(session) is None
+
+
+def fields(message):
+    """Return the fields of a message kept by an archive."""
+    return (
+        message.message_uuid,
+        message.ts,
+        message.payload,
+        message.payload_binary,
+        message.payload_codec,
+        message.payload_size,
+        message.stored_size,
+    )
+
+
+@pytest.mark.parametrize("archive_codec", ["none", "zlib"])
+def test_export_import(Session, new_lane, archive_codec):
+    """Round trip a lane through an archive, keeping payloads in order."""
+    source, target = new_lane(), new_lane()
+    payloads = ["text " * 100, b"\x00" * 500, "skipped", "é", b"\xff\xfe"]
+
+    with Session.begin() as session:
+        msglane = MessageLane(session, codec="zlib")
+        msglane.post_messages(source, payloads[:3])
+
+        msglane = MessageLane(session, dedup=True)
+        msglane.post_messages(source, payloads[3:])
+        msglane.del_message(source, 3)
+
+        exported = [fields(message) for message in msglane.get_messages(source, 1, 5)]
+        output = io.BytesIO()
+
+        assert msglane.export_messages(source, output, codec=archive_codec) == 4
+
+        msglane.del_messages(source, "infinity")
+
+    output.seek(0)
+    header = json.loads(output.readline())
+    output.seek(0)
+
+    assert header["format"] == messagelane.ARCHIVE_FORMAT
+    assert header["version"] == messagelane.ARCHIVE_VERSION
+    assert header["lane"] == source
+    assert header["codec"] == archive_codec
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        assert msglane.import_messages(output, target) == (target, 4, 0)
+
+        imported = msglane.get_messages(target, 1, 4)
+
+        assert [message.lane_position for message in imported] == [1, 2, 3, 4]
+
+        assert [fields(message) for message in imported] == exported
+        assert not any(message.payload_shared for message in imported)
+
+        assert [message.payload for message in imported] == [
+            payload for payload in payloads if payload != "skipped"
+        ]
+        binary = [message.payload_binary for message in imported]
+        assert binary == [False, True, False, True]
+        assert imported[0].payload_codec == "zlib"
+
+    output.seek(0)
+
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        assert msglane.import_messages(output, target) == (target, 0, 4)
+
+
+@pytest.mark.parametrize("dedup", [False, True])
+def test_post_message_to_lanes(Session, new_lane, dedup):
+    """Post a copy to every lane, or to none if a listed lane is missing."""
+    names = sorted(new_lane() for _ in range(3))
+    payload = secrets.token_hex(100)
+
+    with Session.begin() as session:
+        msglane = MessageLane(session, dedup=dedup)
+        msglane.post_message(names[0], "first")
+
+        results = msglane.post_message_to_lanes(names, payload)
+
+        assert sorted(results) == names
+        assert len(set(results.values())) == 3
+
+        for name, position in zip(names, [2, 1, 1]):
+            message = msglane.get_message(name, position)
+            assert message.message_uuid == results[name]
+            assert message.payload == payload
+            assert message.payload_shared == dedup
+
+    with Session.begin() as session:
+        msglane = MessageLane(session, dedup=dedup)
+
+        with pytest.raises(ValueError, match=f"{names[0]}-missing"):
+            msglane.post_message_to_lanes([*names, f"{names[0]}-missing"], "lost")
+
+        markers = [msglane.get_lane(name).marker for name in names]
+        assert markers == [2, 1, 1]
+
+        stmt = sa.select(Payload).where(
+            Payload.payload_hash == hashlib.md5(b"lost").digest()
+        )
+        assert session.scalars(stmt).all() == []
@@ -0,0 +1,26 @@
+"""Tests for the database schema."""
+
+import sqlalchemy as sa
+
+from messagelane import models
+
+
+def test_upgrade_notify_trigger(database_url):
+    """Restore the message notify trigger, repeatably."""
+    engine = sa.create_engine(database_url)
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(sa.text("DROP TRIGGER message_notify ON message"))
+            conn.execute(sa.text("DROP FUNCTION messagelane_notify()"))
+
+        models.upgrade(engine)
+        models.upgrade(engine)
+
+        with engine.connect() as conn:
+            stmt = sa.text(
+                "SELECT count(*) FROM pg_trigger WHERE tgname = 'message_notify'"
+            )
+            assert conn.scalar(stmt) == 1
+    finally:
+        engine.dispose()
@@ -0,0 +1,97 @@
+"""Tests for message table partitions."""
+
+import datetime
+import uuid
+
+from email.message import EmailMessage
+
+import sqlalchemy as sa
+
+from messagelane import MessageLane, partitions
+
+UTC = datetime.timezone.utc
+
+
+def post(Session, name, timestamps):
+    """Create a lane and post a message at each timestamp."""
+    with Session.begin() as session:
+        msglane = MessageLane(session)
+        msglane.create_lane(name)
+        msglane.post_messages(name, [str(ts) for ts in timestamps], timestamps)
+
+
+def test_create_partition_moves_default_rows(partitioned_Session):
+    """Move rows that landed in the default partition into a new one."""
+    future = datetime.datetime.now(UTC) + datetime.timedelta(days=30)
+    post(partitioned_Session, "telemetry", [future, future])
+
+    with partitioned_Session.begin() as session:
+        conn = session.connection()
+        created = partitions.create_partitions(conn, "daily", ahead=40)
+
+        name = partitions.partition_name(partitions.period_start(future, "daily"))
+        assert name in created
+
+        rows = {
+            partition["name"]: conn.scalar(
+                sa.text(f"SELECT count(*) FROM {partition['name']}")
+            )
+            for partition in partitions.list_partitions(conn)
+        }
+
+        assert rows[name] == 2
+        assert rows[partitions.DEFAULT_PARTITION] == 0
+
+        msglane = MessageLane(session)
+        assert [m.payload for m in msglane.get_messages("telemetry", 1, 2)] == [
+            str(future),
+            str(future),
+        ]
+
+
+def test_drop_partitions(partitioned_Session):
+    """Drop partitions up to a datetime, ISO string or infinity."""
+    hour = datetime.timedelta(hours=1)
+    today = partitions.period_start(datetime.datetime.now(UTC), "daily")
+    tomorrow = today + datetime.timedelta(days=1)
+
+    post(partitioned_Session, "telemetry", [today + hour, tomorrow + hour])
+
+    with partitioned_Session.begin() as session:
+        msglane = MessageLane(session)
+        conn = session.connection()
+
+        assert msglane.del_messages("%", today) == 0
+        assert msglane.del_messages("%", tomorrow.isoformat()) == 1
+
+        names = [partition["name"] for partition in partitions.list_partitions(conn)]
+        assert partitions.partition_name(today) not in names
+        assert partitions.partition_name(tomorrow) in names
+
+        assert msglane.del_messages("%", "infinity") == 1
+
+        assert [row["count"] for row in msglane.overview()] == [0]
+
+
+def test_manifest_same_uuid_in_lanes(partitioned_Session):
+    """Record manifests by position when lanes hold the same message uuid."""
+    message_uuid = uuid.uuid4()
+
+    email = EmailMessage()
+    email["Subject"] = "report"
+    email.set_content("see attached")
+    email.add_attachment(
+        b"data", maintype="application", subtype="pdf", filename="r.pdf"
+    )
+
+    with partitioned_Session.begin() as session:
+        msglane = MessageLane(session)
+
+        for name in ["north", "south"]:
+            msglane.create_lane(name)
+            msglane.post_message_from_email(name, email, message_uuid=message_uuid)
+
+        for name in ["north", "south"]:
+            entries = msglane.get_manifest(name, 1)
+            assert entries["headers"] == [("subject", "report")]
+            assert [a.filename for a in entries["attachments"]] == [None, "r.pdf"]
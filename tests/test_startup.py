@@ -0,0 +1,26 @@
+"""Tests for the import time of the package and command line program."""
+
+import pathlib
+
+import pytest
+
+import messagelane
+
+from messagelane.bench import startup
+
+# Generous limit on the best import time in seconds, well above the
+# typical time but far below the cost of loading SQLAlchemy and friends
+
+BUDGET = 0.5
+
+
+@pytest.mark.parametrize("module", ["messagelane", "messagelane.commands.msglane"])
+def test_startup(module, monkeypatch):
+    """Import in a fresh interpreter within budget, deferring heavy modules."""
+    src = pathlib.Path(messagelane.__file__).parents[1]
+    monkeypatch.setenv("PYTHONPATH", str(src))
+
+    result = startup.run(module, repeat=3)
+
+    assert result["loaded"] == []
+    assert result["best"] < BUDGET